@@ -0,0 +1,216 @@
+import time
+import threading
+from datetime import date
+
+import numpy as np
+
+from normalize import format_date
+from records import Transaction
+
+INITIAL_CAPACITY = 1024
+
+
+class SpendAnalytics:
+    """Columnar transaction history for vectorized spending rollups.
+
+    Transactions are held in three parallel NumPy arrays (day ordinal, amount
+    in cents, merchant code) that grow by doubling, so rollups over the whole
+    history are a handful of bincount/cumsum calls instead of a loop over dicts.
+    With a MerchantIndex, merchant codes stand for canonical merchants.
+    """
+
+    def __init__(self, merchant_index=None):
+        self.lock = threading.Lock()
+        self.merchant_index = merchant_index
+        self.size = 0
+        self.days = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self.cents = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.merchants = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self.merchant_names = []
+        self.merchant_codes = {}
+        self.rows = {}  # record key -> row index
+
+    @classmethod
+    def from_totals(cls, spend_totals):
+        """Load the existing history and follow future updates to spend_totals"""
+        analytics = cls(spend_totals.merchants)
+        with spend_totals.lock:
+            analytics.extend(spend_totals.records.items())
+            spend_totals.subscribers.append(analytics.update)
+        return analytics
+
+    def _merchant_code(self, name):
+        if self.merchant_index:
+            name = self.merchant_index.canonical(name)
+        code = self.merchant_codes.get(name)
+        if code is None:
+            code = self.merchant_codes[name] = len(self.merchant_names)
+            self.merchant_names.append(name)
+        return code
+
+    def _merchant_label(self, code):
+        name = self.merchant_names[code]
+        return self.merchant_index.name(name) if self.merchant_index else name
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed <= len(self.days):
+            return
+        capacity = max(needed, 2 * len(self.days))
+        for name in ('days', 'cents', 'merchants'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def extend(self, items):
+        """Bulk-append (key, Transaction) pairs"""
+        items = list(items)
+        with self.lock:
+            self._reserve(len(items))
+            start, end = self.size, self.size + len(items)
+            self.days[start:end] = np.fromiter((r.day for _, r in items), np.int32, len(items))
+            self.cents[start:end] = np.fromiter((r.cents for _, r in items), np.int64, len(items))
+            self.merchants[start:end] = np.fromiter(
+                (self._merchant_code(r.name) for _, r in items), np.int32, len(items)
+            )
+            for offset, (key, _) in enumerate(items):
+                self.rows[key] = start + offset
+            self.size = end
+
+    def update(self, key, record):
+        """Insert or overwrite a single record (SpendTotals subscriber hook)"""
+        with self.lock:
+            row = self.rows.get(key)
+            if row is None:
+                self._reserve(1)
+                row = self.rows[key] = self.size
+                self.size += 1
+            self.days[row] = record.day
+            self.cents[row] = record.cents
+            self.merchants[row] = self._merchant_code(record.name)
+
+    def _columns(self):
+        with self.lock:
+            n = self.size
+            return self.days[:n].copy(), self.cents[:n].copy(), self.merchants[:n].copy()
+
+    def daily_series(self, start, end, days=None, cents=None):
+        """Spend per day for ordinals start..end inclusive"""
+        if days is None:
+            days, cents, _ = self._columns()
+        mask = (days >= start) & (days <= end)
+        return np.bincount(days[mask] - start, weights=cents[mask], minlength=end - start + 1)
+
+    def rolling(self, windows=(7, 30), span=30, end=None):
+        """Rolling window spend for each of the last `span` days ending at `end`"""
+        end = end if end is not None else date.today().toordinal()
+        days, cents, _ = self._columns()
+        lead = max(windows) - 1
+        series = self.daily_series(end - span - lead + 1, end, days, cents)
+        running = np.concatenate(([0], np.cumsum(series)))
+        result = []
+        for i in range(span):
+            day = end - span + 1 + i
+            row = {'date': format_date(day)}
+            for window in windows:
+                hi = lead + i + 1
+                row[f'rolling{window}'] = int(running[hi] - running[hi - window])
+            result.append(row)
+        return result
+
+    def merchant_trends(self, window=30, end=None, limit=20):
+        """Per-merchant spend in the latest window against the window before it"""
+        end = end if end is not None else date.today().toordinal()
+        days, cents, merchants = self._columns()
+        count = len(self.merchant_names)
+        current = (days > end - window) & (days <= end)
+        previous = (days > end - 2 * window) & (days <= end - window)
+        now = np.bincount(merchants[current], weights=cents[current], minlength=count)
+        before = np.bincount(merchants[previous], weights=cents[previous], minlength=count)
+        order = np.argsort(-now)[:limit]
+        trends = []
+        for code in order:
+            if now[code] == 0 and before[code] == 0:
+                continue
+            change = None if before[code] == 0 else round((now[code] - before[code]) / before[code] * 100, 1)
+            trends.append({
+                'merchant': self._merchant_label(code),
+                'currentCents': int(now[code]),
+                'previousCents': int(before[code]),
+                'changePercent': change,
+            })
+        return trends
+
+    def velocity_alerts(self, recent=7, baseline=28, factor=1.5, minimum_cents=2000, end=None):
+        """Flag merchants (and overall spend) running well above their baseline pace.
+
+        The last `recent` days are compared with the average `recent`-day spend
+        over the `baseline` days before them.
+        """
+        end = end if end is not None else date.today().toordinal()
+        days, cents, merchants = self._columns()
+        count = len(self.merchant_names)
+        recent_mask = (days > end - recent) & (days <= end)
+        baseline_mask = (days > end - recent - baseline) & (days <= end - recent)
+        now = np.bincount(merchants[recent_mask], weights=cents[recent_mask], minlength=count)
+        pace = np.bincount(merchants[baseline_mask], weights=cents[baseline_mask], minlength=count)
+        pace = pace * recent / baseline
+
+        alerts = []
+        flagged = np.nonzero((now >= minimum_cents) & (now > factor * pace))[0]
+        for code in flagged[np.argsort(-now[flagged])]:
+            alerts.append({
+                'merchant': self._merchant_label(code),
+                'recentCents': int(now[code]),
+                'baselineCents': int(round(pace[code])),
+            })
+        total_now, total_pace = now.sum(), pace.sum()
+        if total_now >= minimum_cents and total_now > factor * total_pace:
+            alerts.insert(0, {
+                'merchant': None,
+                'recentCents': int(total_now),
+                'baselineCents': int(round(total_pace)),
+            })
+        return alerts
+
+    def summary(self, end=None):
+        return {
+            'transactions': self.size,
+            'rolling': self.rolling(end=end),
+            'merchantTrends': self.merchant_trends(end=end),
+            'velocityAlerts': self.velocity_alerts(end=end),
+        }
+
+
+def main():
+    """Benchmark the rollups over a synthetic history"""
+    rows = 200_000
+    rng = np.random.default_rng(0)
+    today = date.today().toordinal()
+    day_values = today - rng.integers(0, 3 * 365, rows)
+    cent_values = rng.integers(100, 20_000, rows)
+    merchant_values = rng.integers(0, 500, rows)
+    items = [
+        (str(i), Transaction(int(d), f'Merchant {m}', int(c)))
+        for i, (d, c, m) in enumerate(zip(day_values, cent_values, merchant_values))
+    ]
+
+    analytics = SpendAnalytics()
+    started = time.perf_counter()
+    analytics.extend(items)
+    print(f"Loaded {rows:,} rows in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    for name, call in (
+        ('rolling 7/30-day', analytics.rolling),
+        ('merchant trends', analytics.merchant_trends),
+        ('velocity alerts', analytics.velocity_alerts),
+    ):
+        started = time.perf_counter()
+        for _ in range(10):
+            call()
+        print(f"{name}: {(time.perf_counter() - started) * 100:.2f} ms per call")
+
+
+if __name__ == "__main__":
+    main()
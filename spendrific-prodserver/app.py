@@ -1,21 +1,51 @@
+import time
+STARTUP_BEGAN = time.perf_counter()
+
 import os
 import ssl
+import atexit
+import signal
+import socket
 import logging
+import subprocess
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from cheroot.wsgi import Server as WSGIServer
-from cheroot.ssl.builtin import BuiltinSSLAdapter
-from chase import Browser as ChaseBrowser
-from bill_pay import DatcuBillPay
+from tls import ReloadingSSLAdapter
+from profiles import CHASE_PROFILE_DIR, DATCU_PROFILE_DIR
+from browser_watchdog import BrowserWatchdog
+from browser_pool import BrowserPool, WorkerCrashed
+from watcher import ChaseWatcher
+from scrape_state import ScrapeState
+from scheduler import PollScheduler
+from totals import SpendTotals
+from normalize import format_cents, parse_cents
+from records import PAID, Transaction, from_dicts
+from card_info import CardInfoCache
+from balance_history import BalanceHistory
+from payments import (
+    IN_PROGRESS, SUCCEEDED, UNKNOWN, PaymentBatcher, PaymentLedger, PaymentUncertainError,
+    payment_fingerprint
+)
+from encoding import EncodedResponseCache
+from payment_flow import UNSAFE_STEPS, BillPayCheckpoints
+from deadline import DeadlineExceeded, DuplicateJob, JobCancelled, JobRegistry, JobRequeued, ServerDraining
+from job_journal import JobJournal
+from budget_sync import BudgetBackendError, BudgetSync, StubBackend, YNABBackend
+from categorize import Categorizer
+from merchants import MerchantIndex
+from reconcile import Reconciler
+from streaming import NDJSON_MIMETYPE, gzip_stream, ndjson_lines, wants_gzip, wants_ndjson
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_talisman import Talisman
 import csv
+import psutil
+import threading
 import traceback
 import sys
-from datetime import datetime
-import re
+from datetime import date, datetime, timedelta
 from logging.handlers import RotatingFileHandler
 
 # Configure logging
@@ -74,44 +104,188 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def run_https_server():
-    """Run HTTPS server"""
+# Duration of each startup phase in ms, logged and served by /health
+startup_phases = {}
+_phase_began = STARTUP_BEGAN
+
+def startup_phase(name):
+    """Record the startup phase that just finished"""
+    global _phase_began
+    now = time.perf_counter()
+    startup_phases[name] = round((now - _phase_began) * 1000, 1)
+    _phase_began = now
+    logger.info(f"Startup: {name} took {startup_phases[name]} ms")
+
+startup_phase('imports')
+
+# Running spend aggregates, updated as transactions are scraped and paid.
+# Merchant totals, analytics and categories key on canonical merchant ids,
+# and posted charges settle the pending records they match.
+spend_totals = SpendTotals(
+    merchants=MerchantIndex(),
+    reconciler=Reconciler(
+        window_days=int(os.getenv('RECONCILE_WINDOW_DAYS', 4)),
+        tolerance_pct=int(os.getenv('RECONCILE_TOLERANCE_PCT', 25)),
+        tolerance_cents=parse_cents(os.getenv('RECONCILE_TOLERANCE', '5.00')),
+        on_adjust=lambda key, previous, record: adjust_payments(key, previous, record)
+    )
+)
+startup_phase('load_history')
+
+# NumPy-backed analytics, built on first use so numpy stays out of startup
+spend_analytics = None
+analytics_lock = threading.Lock()
+
+def get_spend_analytics():
+    global spend_analytics
+    with analytics_lock:
+        if spend_analytics is None:
+            from analytics import SpendAnalytics
+            spend_analytics = SpendAnalytics.from_totals(spend_totals)
+        return spend_analytics
+
+# Merchant rules compiled into one matcher, built in the background at startup
+categorizer = None
+categorizer_lock = threading.Lock()
+
+def get_categorizer():
+    global categorizer
+    with categorizer_lock:
+        if categorizer is None:
+            categorizer = Categorizer.from_totals(spend_totals)
+        return categorizer
+
+# Serializes Chase scrapes between the endpoint and the background scheduler
+fetch_lock = threading.Lock()
+
+# Queued and running browser jobs, each with one overall time budget
+browser_jobs = JobRegistry()
+FETCH_DEADLINE = int(os.getenv('FETCH_DEADLINE', 180))
+PAY_DEADLINE = int(os.getenv('PAY_DEADLINE', 300))
+
+# Samples and recycles the Chrome process trees spawned by this server
+browser_watchdog = None
+if os.getenv('BROWSER_WATCHDOG', '1') == '1':
+    browser_watchdog = BrowserWatchdog(
+        [CHASE_PROFILE_DIR, DATCU_PROFILE_DIR, CHASE_PROFILE_DIR + '_clones', DATCU_PROFILE_DIR + '_clones'],
+        max_rss_mb=int(os.getenv('BROWSER_MAX_RSS_MB', 1500)),
+        max_age=int(os.getenv('BROWSER_MAX_AGE', 3600)),
+        interval=int(os.getenv('BROWSER_WATCHDOG_INTERVAL', 60))
+    )
+
+# Optional long-running Chase tab that pushes pending changes as they appear
+chase_watcher = None
+if os.getenv('CHASE_WATCHER', '0') == '1':
+    chase_watcher = ChaseWatcher(
+        on_change=spend_totals.ingest,
+        poll_interval=float(os.getenv('CHASE_WATCHER_POLL', 2)),
+        refresh_interval=float(os.getenv('CHASE_WATCHER_REFRESH', 300)),
+        watchdog=browser_watchdog
+    )
+
+# Chase and DATCU browser sessions run in worker processes, not request threads
+browser_pool = BrowserPool(size=int(os.getenv('BROWSER_WORKERS', 2)), watchdog=browser_watchdog)
+
+def request_budget(default):
+    """Budget in seconds for this request: ?deadline= may shorten the default"""
+    try:
+        return min(default, max(1, int(request.args.get('deadline', default))))
+    except ValueError:
+        return default
+
+# Optional adaptive background polling, for when the live watcher is not used
+poll_scheduler = None
+if os.getenv('SCHEDULER', '0') == '1' and not chase_watcher:
+    poll_scheduler = PollScheduler(
+        min_interval=int(os.getenv('POLL_MIN_INTERVAL', 900)),
+        max_interval=int(os.getenv('POLL_MAX_INTERVAL', 4 * 3600))
+    )
+    poll_scheduler.add_account('chase', lambda: fetch_chase_transactions()['added'])
+
+# Structured card info served from memory; stale reads refresh in the background
+# Card info refreshes stay within the /fetch-transactions rate (10 per hour)
+card_info_cache = CardInfoCache(
+    refresh=lambda: fetch_chase_transactions(),
+    ttl=int(os.getenv('CARD_INFO_TTL', 900)),
+    min_interval=max(360, int(os.getenv('CARD_INFO_MIN_REFRESH', 360))),
+    can_refresh=lambda: not browser_jobs.draining and not shutdown_started.is_set()
+)
+
+# Downsampled card balance time series, appended to by every scrape
+balance_history = BalanceHistory()
+
+# Bill-pay submissions keyed by idempotency key, so retries never pay twice
+payment_ledger = PaymentLedger(compact_bytes=int(os.getenv('PAYMENT_LEDGER_COMPACT_BYTES', 1 << 20)))
+PAYMENT_WAIT_TIMEOUT = int(os.getenv('PAYMENT_WAIT_TIMEOUT', 300))
+
+# Last completed step of each DATCU payment run, so retries resume safely
+bill_pay_checkpoints = BillPayCheckpoints()
+
+# Browser jobs set aside by a drain, resumed by the next server process
+pending_jobs = JobJournal()
+DRAIN_TIMEOUT = int(os.getenv('DRAIN_TIMEOUT', PAY_DEADLINE))
+PID_FILE = 'server.pid'
+https_server = None
+shutdown_started = threading.Event()
+# Background refreshes must not start browser workers while the interpreter exits
+atexit.register(shutdown_started.set)
+replacement_ready = threading.Event()
+
+# Optional batching window: approved amounts are combined into one payment
+payment_batcher = None
+if os.getenv('PAYMENT_BATCHING', '0') == '1':
+    threshold = os.getenv('PAYMENT_BATCH_THRESHOLD')
+    payment_batcher = PaymentBatcher(
+        payment_ledger,
+        submit=lambda total_cents, key: submit_bill_payment(total_cents, key),
+        on_paid=lambda records: mark_paid(records),
+        window=int(os.getenv('PAYMENT_BATCH_WINDOW', 3600)),
+        threshold_cents=parse_cents(threshold) if threshold else None
+    )
+
+# Serialized and compressed /transactions and /cardInfo bodies, per data version
+response_cache = EncodedResponseCache()
+
+# Optional push of scraped transactions to a budgeting app
+budget_sync = None
+BUDGET_BACKEND = os.getenv('BUDGET_BACKEND')
+if BUDGET_BACKEND == 'ynab':
+    budget_backend = YNABBackend(
+        os.getenv('YNAB_TOKEN'),
+        budget_id=os.getenv('YNAB_BUDGET_ID', 'last-used'),
+        account_id=os.getenv('YNAB_ACCOUNT_ID')
+    )
+elif BUDGET_BACKEND == 'stub':
+    budget_backend = StubBackend(latency=float(os.getenv('BUDGET_STUB_LATENCY', 0)))
+elif BUDGET_BACKEND:
+    raise ValueError(f"Unknown BUDGET_BACKEND: {BUDGET_BACKEND}")
+if BUDGET_BACKEND:
+    budget_sync = BudgetSync(budget_backend, batch_size=int(os.getenv('BUDGET_SYNC_BATCH', 100)))
+BUDGET_AUTO_SYNC = os.getenv('BUDGET_AUTO_SYNC', '0') == '1'
+BUDGET_SYNC_DAYS = int(os.getenv('BUDGET_SYNC_DAYS', 30))
+
+def run_https_server(on_listening=None):
+    """Run HTTPS server; on_listening is called once the socket is bound"""
+    global https_server
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', 8000))
     
-    # Configure SSL with basic security settings for development
-    ssl_adapter = BuiltinSSLAdapter(certfile, keyfile)
-    ssl_adapter.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    
-    # Load certificate
-    ssl_adapter.context.load_cert_chain(certfile, keyfile)
-    
-    # Set basic cipher suites that iOS definitely supports
-    ssl_adapter.context.set_ciphers(
-        'ECDHE-RSA-AES256-SHA:AES256-SHA:HIGH:!RC4:!DH:!MD5:!aNULL:!eNULL:!NULL:!DES:!EDH:!EXP:!SEED'
-    )
-    
-    # Security options with basic compatibility
-    ssl_adapter.context.options = (
-        ssl.OP_NO_SSLv2 | 
-        ssl.OP_NO_SSLv3 |
-        ssl.OP_NO_COMPRESSION
+    # TLS 1.2-1.3 with session tickets; a rotated cert/key pair is picked up
+    # without a restart
+    ssl_adapter = ReloadingSSLAdapter(
+        certfile, keyfile,
+        interval=int(os.getenv('TLS_RELOAD_INTERVAL', 5)),
+        tickets=int(os.getenv('TLS_TICKETS', 2))
     )
     
-    # Allow TLS 1.2 (removing 1.3 temporarily for testing)
-    ssl_adapter.context.minimum_version = ssl.TLSVersion.TLSv1_2
-    ssl_adapter.context.maximum_version = ssl.TLSVersion.TLSv1_2
-    
-    # Development settings - accept self-signed certificates
-    ssl_adapter.context.verify_mode = ssl.CERT_NONE
-    ssl_adapter.context.check_hostname = False
-    
     # Enable SSL debugging through logging
     logging.getLogger('ssl').setLevel(logging.DEBUG)
     
     # Create HTTPS server
-    https_server = WSGIServer((host, port), app)
+    # SO_REUSEPORT lets a replacement process bind while this one drains
+    https_server = WSGIServer((host, port), app, reuse_port=hasattr(socket, 'SO_REUSEPORT'))
     https_server.ssl_adapter = ssl_adapter
+    startup_phase('tls_config')
     
     try:
         logger.info(f'Starting HTTPS server on {host}:{port}')
@@ -121,9 +295,13 @@ def run_https_server():
         logger.info(' - Cipher suite configuration:')
         for cipher in ssl_adapter.context.get_ciphers():
             logger.info(f'   - {cipher["name"]}')
-        https_server.start()
+        https_server.prepare()
+        startup_phase('listen')
+        if on_listening:
+            on_listening()
+        https_server.serve()
     except (KeyboardInterrupt, SystemExit):
-        https_server.stop()
+        shutdown()
     except ssl.SSLError as e:
         logger.error(f"SSL Error: {e}")
         logger.error(f"SSL Error Code: {e.reason}")
@@ -135,36 +313,116 @@ def run_https_server():
 @app.route('/health', methods=['GET'])
 @limiter.exempt
 def health_check():
+    # Load balancers stop routing to a draining process
     return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat()
-    })
+        'status': 'draining' if browser_jobs.draining else 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'startup': startup_phases,
+        'tls': https_server.ssl_adapter.status() if https_server else None
+    }), 503 if browser_jobs.draining else 200
+
+def draining_response(message='Server is restarting, try again shortly'):
+    response = jsonify({'status': 'error', 'message': message})
+    response.headers['Retry-After'] = '10'
+    return response, 503
+
+def fetch_chase_transactions(deadline=None):
+    """Scrape Chase once; returns {'changed', 'count', 'added'}.
+
+    Shared by /fetch-transactions and the background scheduler, and
+    serialized so only one Chase session runs at a time. Waiting for that
+    session counts against the deadline.
+    """
+    deadline = deadline or browser_jobs.start('fetch', FETCH_DEADLINE)
+    try:
+        deadline.acquire(fetch_lock)
+        try:
+            if chase_watcher and chase_watcher.is_running():
+                logger.info("Refreshing the live Chase tab...")
+                try:
+                    outcome = chase_watcher.refresh_now(deadline.timeout(60))
+                    return {
+                        'changed': outcome['changed'],
+                        'count': len(outcome['transactions']) if outcome['changed'] else 0,
+                        'added': outcome['added']
+                    }
+                except (TimeoutError, RuntimeError) as e:
+                    logger.warning(f"{e}; scraping in a browser worker instead")
+        
+            logger.info("Scraping Chase in a browser worker...")
+            result = browser_pool.run('chase', (), deadline)
+            if result is None:
+                logger.info("Activity unchanged since last scrape, skipping extraction")
+                return {'changed': False, 'count': 0, 'added': 0}
+        
+            digest, rows = result
+            transactions = [Transaction(*row) for row in rows]
+            logger.info(f"Found {len(transactions)} transactions")
+            added = spend_totals.ingest(transactions)
+            logger.info(f"Added {added} new transactions to spend totals")
+            # Only now may the next scrape skip this activity as unchanged
+            ScrapeState().commit('activity', digest)
+            # Reconciled and re-posted charges change synced transactions
+            # without adding any, so every changed scrape syncs
+            auto_sync_budget()
+            return {'changed': True, 'count': len(transactions), 'added': added}
+        finally:
+            fetch_lock.release()
+    except JobRequeued:
+        # A drain set the scrape aside; the next server process runs it
+        pending_jobs.add('fetch', 'fetch')
+        raise
+    finally:
+        browser_jobs.finish(deadline)
+
+def auto_sync_budget():
+    """Sync recent history in the background if BUDGET_AUTO_SYNC is on"""
+    if budget_sync and BUDGET_AUTO_SYNC:
+        threading.Thread(target=sync_recent_to_budget, name='budget-sync', daemon=True).start()
+
+def mark_paid(records):
+    """Record paid transactions and clear them in the budgeting app"""
+    if spend_totals.mark_paid(records):
+        auto_sync_budget()
+
+def sync_recent_to_budget():
+    """Push the last BUDGET_SYNC_DAYS days of history that is new or changed since it was synced"""
+    start = (date.today() - timedelta(days=BUDGET_SYNC_DAYS)).isoformat()
+    try:
+        budget_sync.sync(spend_totals.iter_keyed(start), lambda key, record: get_categorizer().category(record.name))
+    except Exception as e:
+        logger.error(f"Budget sync failed: {e}")
 
 @app.route('/fetch-transactions', methods=['POST'])
 @limiter.limit("10 per hour")
 def fetch_transactions():
     logger.info("Starting fetch-transactions endpoint")
-    browser = None
     try:
-        logger.info("Initializing Chrome browser...")
-        browser = ChaseBrowser()
-        
-        logger.info("Opening Chase website and logging in...")
-        browser.open()
-        
-        logger.info("Getting latest transactions...")
-        transactions = browser.get_latest_transactions()
-        logger.info(f"Found {len(transactions)} transactions")
-        
-        logger.info("Saving transactions to CSV...")
-        browser.save_to_csv(transactions)
-        
+        deadline = browser_jobs.start('fetch', request_budget(FETCH_DEADLINE), request.headers.get('X-Job-Id'))
+    except ServerDraining as e:
+        return draining_response(str(e))
+    except DuplicateJob as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    try:
+        result = fetch_chase_transactions(deadline)
         logger.info("Operation completed successfully")
         return jsonify({
             'status': 'success',
-            'message': 'Transactions fetched',
-            'count': len(transactions)
+            'message': 'Transactions fetched' if result['changed'] else 'No changes since last fetch',
+            'changed': result['changed'],
+            'count': result['count'],
+            'jobId': deadline.id
         })
+    except JobRequeued as e:
+        logger.info(f"fetch-transactions set aside for the restart: {str(e)}")
+        return draining_response('Server is restarting; the fetch runs again once it is back')
+    except (DeadlineExceeded, JobCancelled) as e:
+        logger.warning(f"fetch-transactions stopped: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'progress': e.progress
+        }), 504 if isinstance(e, DeadlineExceeded) else 409
     except Exception as e:
         logger.error(f"Error in fetch-transactions: {str(e)}")
         logger.error(traceback.format_exc())
@@ -173,33 +431,139 @@ def fetch_transactions():
             'message': str(e),
             'traceback': traceback.format_exc()
         }), 500
-    finally:
-        if browser:
-            logger.info("Closing browser...")
-            try:
-                browser.close()
-            except Exception as e:
-                logger.error(f"Error closing browser: {str(e)}")
 
 @app.route('/transactions', methods=['GET'])
 @limiter.limit("30 per minute")
 def get_transactions():
     logger.info("Received request to get transactions")
     try:
-        transactions = []
-        with open('chase_transactions.csv', 'r') as file:
-            reader = csv.DictReader(file)
-            transactions = list(reader)
-        logger.info(f"Retrieved {len(transactions)} transactions from CSV")
-        return jsonify(transactions)
+        if wants_ndjson(request):
+            return stream_transactions()
+        
+        def build():
+            with open('chase_transactions.csv', 'r') as file:
+                transactions = from_dicts(csv.DictReader(file))
+            logger.info(f"Retrieved {len(transactions)} transactions from CSV")
+            return [t.to_dict() for t in transactions]
+        
+        version = os.stat('chase_transactions.csv').st_mtime_ns
+        return response_cache.respond(request, 'transactions', version, build)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"Error reading transactions: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def stream_transactions():
+    """Stream transactions as NDJSON, optionally gzipped, with bounded memory.
+
+    With from/to the listing comes from the retained history; otherwise it
+    streams the latest scrape from the CSV.
+    """
+    start, end = request.args.get('from'), request.args.get('to')
+    if start or end or request.args.get('history') == '1':
+        records = spend_totals.iter_transactions(start, end)
+    else:
+        # A missing file is still a 500 from the caller; the file itself is
+        # opened by the generator, so a response never iterated holds no handle
+        os.stat('chase_transactions.csv')
+        def read_csv():
+            with open('chase_transactions.csv', 'r') as file:
+                for row in csv.DictReader(file):
+                    record = Transaction.from_dict(row)
+                    if record is not None:
+                        yield record
+        records = read_csv()
+
+    body = ndjson_lines(records)
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    if wants_gzip(request):
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    logger.info("Streaming transactions as NDJSON")
+    return Response(stream_with_context(body), mimetype=NDJSON_MIMETYPE, headers=headers)
+
+def submit_bill_payment(total_cents, key, deadline=None):
+    """Pay total_cents through DATCU in a browser worker.
+
+    Steps are checkpointed under `key`, so a retry with the same key checks
+    DATCU for an earlier submission before paying. Raises
+    PaymentUncertainError if a failure after submitting cannot be verified.
+    """
+    deadline = deadline or browser_jobs.start('pay', PAY_DEADLINE)
+    try:
+        logger.info(f"Paying {format_cents(total_cents)} through DATCU...")
+        browser_pool.run('pay', (total_cents, key), deadline)
+    except WorkerCrashed as e:
+        if deadline.requeued:
+            raise JobRequeued(deadline) from e
+        checkpoint = bill_pay_checkpoints.get(key) or {}
+        if checkpoint.get('step') in UNSAFE_STEPS:
+            raise PaymentUncertainError(str(e)) from e
+        raise
+    except PaymentUncertainError as e:
+        # Cut short by a drain: the resumed run checks DATCU before paying
+        if isinstance(e.__cause__, JobRequeued):
+            raise JobRequeued(deadline) from e
+        raise
+    finally:
+        browser_jobs.finish(deadline)
+
+def adjust_payments(key, previous, record):
+    """A reconciled charge changed amount; returns what that meant for payments.
+
+    'batch' if it was waiting in the open payment batch, which now pays the
+    posted amount; 'paid' if the old amount was already paid, leaving the
+    difference outstanding; None if no payment covered it yet.
+    """
+    if previous.status == PAID:
+        logger.warning(f"{record.name} posted at {record.amount} after {previous.amount} was paid")
+        return 'paid'
+    try:
+        if payment_batcher and payment_batcher.adjust(previous, record):
+            return 'batch'
+    except Exception as e:
+        logger.error(f"Could not adjust the payment batch for {key}: {e}")
+    return None
+
+def pay_and_record(key, records, budget=PAY_DEADLINE, job_id=None):
+    """Pay the records' total under `key` and settle its ledger entry.
+
+    Returns the success response. If a drain sets the payment aside it is
+    saved for the next server process, the ledger shows it as queued, and
+    JobRequeued or ServerDraining is raised. DuplicateJob is raised, with
+    nothing paid, if `job_id` belongs to a job that is still running.
+    """
+    total_cents = sum(r.cents for r in records)
+    try:
+        deadline = browser_jobs.start('pay', budget, job_id)
+        submit_bill_payment(total_cents, key, deadline)
+    except (JobRequeued, ServerDraining):
+        pending_jobs.add('pay', key, cents=total_cents, transactions=[r.to_record() for r in records])
+        payment_ledger.defer(key)
+        raise
+    except PaymentUncertainError as e:
+        payment_ledger.mark_unknown(key, str(e))
+        raise
+    except Exception as e:
+        payment_ledger.fail(key, str(e))
+        raise
+
+    response = {
+        'status': 'success',
+        'message': 'Bill pay completed',
+        'amount': format_cents(total_cents),
+        'paymentKey': key
+    }
+    payment_ledger.succeed(key, response)
+    mark_paid(records)
+    return response
+
 @app.route('/pay-bill', methods=['POST'])
 @limiter.limit("5 per hour")
 def pay_bill():
-    bill_pay = None
+    if browser_jobs.draining:
+        return draining_response()
     try:
         # Get the modified CSV data from request
         transactions = request.json.get('transactions', [])
@@ -210,58 +574,110 @@ def pay_bill():
                 'message': 'No transactions provided'
             }), 400
         
-        # Save to CSV
-        with open('chase_transactions.csv', 'w') as file:
-            writer = csv.DictWriter(file, fieldnames=['Date', 'Name', 'Amount'])
-            writer.writeheader()
-            writer.writerows(transactions)
-        
-        # Calculate total amount from transactions with better error handling
-        total = 0
+        # Parse into records, calculating the total in exact cents
+        payable, rejected = [], []
         for t in transactions:
-            amount_str = t.get('Amount', '').strip()
-            if not amount_str:
+            if not str(t.get('Amount', '')).strip():
                 logger.warning(f"Skipping transaction with empty amount: {t}")
-                continue
-                
-            try:
-                # Remove $ and any other non-numeric characters except decimal point and negative sign
-                amount_str = amount_str.replace('$', '').replace(',', '').strip()
-                amount = float(amount_str)
-                total += amount
-            except ValueError:
-                logger.error(f"Invalid amount format in transaction: {t}")
-                return jsonify({
-                    'status': 'error',
-                    'message': f'Invalid amount format: {amount_str}'
-                }), 400
+            else:
+                payable.append(t)
+        records = from_dicts(payable, on_invalid=rejected.append)
+        if rejected:
+            logger.error(f"Invalid amount format in transaction: {rejected[0]}")
+            return jsonify({
+                'status': 'error',
+                'message': f"Invalid amount format: {rejected[0].get('Amount')}"
+            }), 400
+        total_cents = sum(r.cents for r in records)
         
-        if total <= 0:
+        # Save to CSV
+        with open('chase_transactions.csv', 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Date', 'Name', 'Amount'])
+            writer.writerows(r.to_row() for r in records)
+        
+        if total_cents <= 0:
             return jsonify({
                 'status': 'error',
                 'message': 'Total amount must be greater than 0'
             }), 400
             
-        logger.info(f"Calculated total amount for bill pay: ${total:.2f}")
-        
-        # Initialize and execute bill pay
-        bill_pay = DatcuBillPay()
-        logger.info("Logging into DATCU...")
-        bill_pay.login()
+        total = format_cents(total_cents)
+        logger.info(f"Calculated total amount for bill pay: {total}")
         
-        logger.info("Navigating to bill pay section...")
-        bill_pay.navigate_to_bill_pay()
+        # Retries of the same payment are answered from the ledger
+        fingerprint = payment_fingerprint(records)
+        key = request.headers.get('Idempotency-Key') or fingerprint
+        action, entry = payment_ledger.begin(key, fingerprint, total)
+        if action == 'replay':
+            logger.info(f"Payment {key} already completed, replaying result")
+            return jsonify(dict(entry['response'], replayed=True))
+        if action == 'attach':
+            logger.info(f"Payment {key} already running, waiting for it")
+            entry = payment_ledger.wait(key, PAYMENT_WAIT_TIMEOUT)
+            if entry['status'] == SUCCEEDED:
+                return jsonify(dict(entry['response'], replayed=True))
+            if entry['status'] == IN_PROGRESS:
+                return jsonify({'status': 'pending', 'message': 'Payment still in progress', 'paymentKey': key}), 202
+            return jsonify({'status': 'error', 'message': entry['error'], 'paymentKey': key}), 500
+        if action == 'queued':
+            return jsonify({
+                'status': 'queued',
+                'message': 'Payment queued for the next batch' if entry.get('batchId') else 'Payment will resume after the server restarts',
+                'batchId': entry.get('batchId'),
+                'paymentKey': key
+            }), 202
+        if action == 'conflict':
+            return jsonify({
+                'status': 'error',
+                'message': 'Idempotency-Key was already used for different transactions'
+            }), 422
+        if action == 'unknown':
+            return jsonify({
+                'status': 'error',
+                'message': 'A previous attempt was interrupted; verify it with DATCU and resolve it before retrying',
+                'paymentKey': key
+            }), 409
         
-        logger.info(f"Initiating payment for ${total:.2f}...")
-        bill_pay.initiate_payment(f"{total:.2f}")
+        if payment_batcher:
+            batch_id = payment_batcher.add(key, records)
+            logger.info(f"Queued {total} in payment batch {batch_id}")
+            return jsonify({
+                'status': 'queued',
+                'message': 'Payment queued for the next batch',
+                'amount': total,
+                'batchId': batch_id,
+                'paymentKey': key
+            }), 202
         
+        response = pay_and_record(key, records, request_budget(PAY_DEADLINE), request.headers.get('X-Job-Id'))
         logger.info("Bill pay completed successfully")
-        return jsonify({
-            'status': 'success', 
-            'message': 'Bill pay completed',
-            'amount': f"${total:.2f}"
-        })
+        return jsonify(response)
         
+    except (JobRequeued, ServerDraining) as e:
+        logger.info(f"Bill pay set aside for the restart: {str(e)}")
+        return jsonify({
+            'status': 'queued',
+            'message': 'Payment will resume after the server restarts',
+            'paymentKey': key
+        }), 202
+    except DuplicateJob as e:
+        return jsonify({'status': 'error', 'message': str(e), 'paymentKey': key}), 409
+    except (DeadlineExceeded, JobCancelled) as e:
+        logger.warning(f"Bill pay stopped before submitting: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'progress': e.progress
+        }), 504 if isinstance(e, DeadlineExceeded) else 409
+    except PaymentUncertainError as e:
+        logger.error(f"Bill pay outcome unknown: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'paymentKey': key,
+            'progress': getattr(e.__cause__, 'progress', None)
+        }), 500
     except Exception as e:
         logger.error(f"Error in bill pay: {str(e)}")
         logger.error(traceback.format_exc())
@@ -270,59 +686,476 @@ def pay_bill():
             'message': str(e),
             'traceback': traceback.format_exc()
         }), 500
-        
-    finally:
-        if bill_pay:
-            logger.info("Closing browser...")
-            try:
-                bill_pay.close()
-            except Exception as e:
-                logger.error(f"Error closing browser: {str(e)}")
 
-def parse_card_info():
+
+@app.route('/payments/batch', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_payment_batch():
+    if not payment_batcher:
+        return jsonify({'enabled': False, 'open': False})
+    return jsonify(dict(payment_batcher.status(), enabled=True))
+
+@app.route('/payments/<key>', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_payment(key):
+    entry = payment_ledger.get(key)
+    if not entry:
+        return jsonify({'status': 'error', 'message': 'Unknown payment'}), 404
+    checkpoint = bill_pay_checkpoints.get(entry.get('batchId') or key)
+    return jsonify(dict(entry, checkpoint=checkpoint))
+
+@app.route('/payments/<key>/cancel', methods=['POST'])
+@limiter.limit("10 per hour")
+def cancel_payment(key):
+    """Take a request out of the open payment batch before it is paid"""
+    if not payment_batcher or not payment_batcher.cancel(key):
+        return jsonify({'status': 'error', 'message': 'No queued payment with that key'}), 404
+    return jsonify(payment_ledger.get(key))
+
+@app.route('/payments/<key>/resolve', methods=['POST'])
+@limiter.limit("10 per hour")
+def resolve_payment(key):
+    """Settle an interrupted payment after checking DATCU's payment history"""
+    entry = payment_ledger.get(key)
+    if not entry or entry['status'] != UNKNOWN:
+        return jsonify({'status': 'error', 'message': 'No interrupted payment with that key'}), 404
+    paid = bool(request.json.get('paid'))
+    return jsonify(payment_ledger.resolve(key, paid))
+
+@app.route('/browsers', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_browsers():
+    if not browser_watchdog:
+        return jsonify({'running': False})
+    return jsonify(browser_watchdog.metrics())
+
+@app.route('/workers', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_workers():
+    return jsonify(browser_pool.status())
+
+@app.route('/jobs', methods=['GET'])
+@limiter.limit("30 per minute")
+def list_jobs():
+    return jsonify({
+        'jobs': browser_jobs.list(),
+        'draining': browser_jobs.draining,
+        'saved': pending_jobs.pending()
+    })
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@limiter.limit("30 per minute")
+def cancel_job(job_id):
+    """Abort a queued or running browser job and close its browser"""
+    report = browser_jobs.cancel(job_id)
+    if report is None:
+        return jsonify({'status': 'error', 'message': 'No such job'}), 404
+    logger.info(f"Cancelled job {job_id}")
+    return jsonify(report)
+
+@app.route('/totals', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_totals():
+    group_by = request.args.get('group_by', 'day')
     try:
-        with open('cardInfo', 'r') as file:
-            content = file.read()
-            
-            # Extract card name and last 4 digits
-            card_match = re.search(r'(.*?)\s*\(...(\d{4})\)', content)
-            card_name = card_match.group(1) if card_match else "Unknown Card"
-            last_four = card_match.group(2) if card_match else "0000"
-            
-            # Extract current balance
-            balance_match = re.search(r'Current balance\s*\$([0-9,.]+)', content)
-            current_balance = float(balance_match.group(1).replace(',', '')) if balance_match else 0.0
-            
-            return {
-                "cardName": card_name,
-                "lastFourDigits": last_four,
-                "currentBalance": current_balance
-            }
+        groups = spend_totals.query(
+            group_by,
+            start=request.args.get('from'),
+            end=request.args.get('to')
+        )
+        return jsonify({
+            'groupBy': group_by,
+            'from': request.args.get('from'),
+            'to': request.args.get('to'),
+            'groups': groups
+        })
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_totals: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/analytics', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_analytics():
+    try:
+        return jsonify(get_spend_analytics().summary())
     except Exception as e:
-        logger.error(f"Error parsing card info: {str(e)}")
-        return None
+        logger.error(f"Error in get_analytics: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/balance/history', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_balance_history():
+    try:
+        start, end = request.args.get('from'), request.args.get('to')
+        points = balance_history.query(
+            datetime.fromisoformat(start).timestamp() if start else None,
+            datetime.fromisoformat(end).timestamp() if end else None
+        )
+        return jsonify({'from': start, 'to': end, 'points': points})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_balance_history: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/scrape-stats', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_scrape_stats():
+    return jsonify(ScrapeState().stats())
+
+@app.route('/scheduler', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_scheduler_status():
+    if not poll_scheduler:
+        return jsonify({'running': False, 'enabled': False})
+    return jsonify(dict(poll_scheduler.status(), enabled=True))
+
+@app.route('/watcher', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_watcher_status():
+    if not chase_watcher:
+        return jsonify({'running': False, 'enabled': False})
+    return jsonify(dict(chase_watcher.status(), enabled=True))
 
 @app.route('/cardInfo', methods=['GET'])
 @limiter.limit("30 per minute")
 def get_card_info():
     try:
-        card_info = parse_card_info()
-        if card_info:
-            return jsonify(card_info)
-        else:
-            return jsonify({'status': 'error', 'message': 'Failed to parse card information'}), 500
+        card_info, age, stale = card_info_cache.get()
+        if not card_info:
+            return jsonify({'status': 'error', 'message': 'Card information not captured yet'}), 503
+        response = response_cache.respond(request, 'cardInfo', card_info['capturedAt'], lambda: card_info)
+        response.headers['Age'] = str(int(age))
+        response.headers['Cache-Control'] = f'max-age={card_info_cache.ttl}, stale-while-revalidate'
+        if stale:
+            response.headers['X-Data-Stale'] = '1'
+        return response
     except Exception as e:
         logger.error(f"Error in get_card_info: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/budget/sync', methods=['POST'])
+@limiter.limit("10 per minute")
+def sync_budget():
+    """Push recorded transactions in from/to that are new or changed since they were synced.
+
+    An optional "categories" object maps merchant names to a category name
+    or id in the budgeting app; other merchants go through the categorizer.
+    """
+    if not budget_sync:
+        return jsonify({'status': 'error', 'message': 'No budgeting backend configured'}), 404
+    try:
+        data = request.get_json(silent=True) or {}
+        categories = data.get('categories') or {}
+        keyed = spend_totals.iter_keyed(data.get('from'), data.get('to'))
+        stats = budget_sync.sync(
+            keyed, lambda key, record: categories.get(record.name) or get_categorizer().category(record.name)
+        )
+        if stats['error']:
+            return jsonify(dict(stats, status='error', message=stats['error'])), 502
+        return jsonify(dict(stats, status='success'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except BudgetBackendError as e:
+        logger.error(f"Error in sync_budget: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 502
+    except Exception as e:
+        logger.error(f"Error in sync_budget: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/budget/sync', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_budget_sync_status():
+    if not budget_sync:
+        return jsonify({'enabled': False})
+    return jsonify(dict(budget_sync.status(), enabled=True))
+
+@app.route('/budget/categories', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_budget_categories():
+    if not budget_sync:
+        return jsonify({'status': 'error', 'message': 'No budgeting backend configured'}), 404
+    try:
+        return jsonify({'categories': budget_sync.categories.list()})
+    except BudgetBackendError as e:
+        logger.error(f"Error in get_budget_categories: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 502
+
+@app.route('/reconcile', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_reconciliations():
+    """Recent pending-to-posted matches"""
+    try:
+        return jsonify(spend_totals.reconciler.summary(int(request.args.get('limit', 100))))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_reconciliations: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/merchants', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_merchants():
+    """Canonical merchants; ?q= filters by name, ?name= resolves one scraped name"""
+    merchants = spend_totals.merchants
+    name = request.args.get('name')
+    if name:
+        merchant_id = merchants.canonical(name)
+        merchants.flush()
+        return jsonify({'name': name, 'merchantId': merchant_id, 'merchant': merchants.name(merchant_id)})
+    return jsonify({'merchants': merchants.list(request.args.get('q'))})
+
+@app.route('/categories', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_categories():
+    return jsonify(get_categorizer().summary())
+
+@app.route('/categories/rules', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_category_rules():
+    return jsonify({'rules': get_categorizer().rules})
+
+@app.route('/categories/rules', methods=['PUT'])
+@limiter.limit("10 per minute")
+def put_category_rules():
+    """Replace the merchant rules; the history is recategorized"""
+    try:
+        data = request.get_json(silent=True) or {}
+        count = get_categorizer().set_rules(data.get('rules'))
+        logger.info(f"Loaded {count} category rules")
+        return jsonify(dict(get_categorizer().summary(), status='success'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in put_category_rules: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/categories/choices', methods=['POST'])
+@limiter.limit("60 per minute")
+def add_category_choice():
+    """Remember the category the user picked for a merchant"""
+    try:
+        data = request.get_json(silent=True) or {}
+        merchant = get_categorizer().learn(data.get('name') or '', data.get('category'))
+        return jsonify({'status': 'success', 'merchant': merchant, 'category': data.get('category')})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in add_category_choice: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+def prewarm():
+    """Background startup work that must not delay the listener"""
+    began = time.perf_counter()
+    try:
+        get_categorizer()
+        startup_phases['categorizer'] = round((time.perf_counter() - began) * 1000, 1)
+    except Exception as e:
+        logger.error(f"Loading category rules failed: {e}")
+    began = time.perf_counter()
+    if browser_watchdog:
+        # Browsers left on our profiles by an earlier run would block new
+        # sessions; one open_browser.py is still driving is not touched
+        try:
+            killed = browser_watchdog.kill_orphans(abandoned_only=True)
+            logger.info(f"Killed {killed} orphaned browser processes")
+        except Exception as e:
+            logger.error(f"Orphan cleanup failed: {e}")
+        browser_watchdog.start()
+    try:
+        browser_pool.start()
+        startup_phases['workers'] = round((time.perf_counter() - began) * 1000, 1)
+        if pending_jobs.pending() or os.getenv('RESTARTED_FROM'):
+            threading.Thread(target=resume_pending_jobs, name='resume-jobs', daemon=True).start()
+        if os.getenv('BROWSER_PREWARM', '0') == '1':
+            began = time.perf_counter()
+            deadline = browser_jobs.start('prewarm', 120)
+            try:
+                browser_pool.run('warm', (), deadline)
+            finally:
+                browser_jobs.finish(deadline)
+            startup_phases['browser_prewarm'] = round((time.perf_counter() - began) * 1000, 1)
+    except Exception as e:
+        logger.error(f"Browser prewarm failed: {e}")
+    logger.info(f"Startup: background prewarm finished {startup_phases}")
+
+def on_listening():
+    startup_phases['total'] = round((time.perf_counter() - STARTUP_BEGAN) * 1000, 1)
+    logger.info(f"Startup: listening after {startup_phases['total']} ms")
+    handing_over = os.getenv('RESTARTED_FROM')
+    if handing_over:
+        # Tell the process we are replacing that it can stop listening
+        try:
+            os.kill(int(handing_over), signal.SIGUSR1)
+        except (OSError, ValueError):
+            pass
+    threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
+
+def resume_payment(entry):
+    """Run a payment saved by the previous process's drain"""
+    records = [Transaction.from_record(record) for record in entry['transactions']]
+    payment_ledger.update(entry['key'], status=IN_PROGRESS)
+    try:
+        pay_and_record(entry['key'], records)
+    except (JobRequeued, ServerDraining):
+        raise
+    except Exception as e:
+        # The outcome is in the ledger; the entry is done
+        logger.error(f"Resumed payment {entry['key']} failed: {e}")
+
+def resume_fetch(entry):
+    try:
+        fetch_chase_transactions()
+    except (JobRequeued, ServerDraining):
+        raise
+    except Exception as e:
+        logger.error(f"Resumed Chase fetch failed: {e}")
+
+def resume_pending_jobs():
+    handing_over = os.getenv('RESTARTED_FROM')
+    if handing_over:
+        # The process we replace drains after we listen and saves what it
+        # sets aside as it goes, so its jobs are complete once it exits
+        try:
+            psutil.Process(int(handing_over)).wait(DRAIN_TIMEOUT + 120)
+        except (psutil.NoSuchProcess, ValueError):
+            pass
+        except psutil.TimeoutExpired:
+            logger.error(f"Server {handing_over} still running; resuming the jobs it saved so far")
+        # Payments it took or set aside while we were listening
+        payment_ledger.reload()
+    resumed = pending_jobs.resume({'pay': resume_payment, 'fetch': resume_fetch})
+    logger.info(f"Resumed {resumed} jobs saved by the previous server process")
+
+def stop_producers():
+    """Stop the background services that start browser work on their own"""
+    if payment_batcher:
+        payment_batcher.stop(timeout=0)
+    if poll_scheduler:
+        poll_scheduler.stop(timeout=0)
+    if chase_watcher:
+        chase_watcher.stop()
+
+def drain():
+    """Stop taking browser work. Background producers stop, queued jobs are
+    saved for the next process and running ones get DRAIN_TIMEOUT seconds."""
+    if browser_jobs.draining:
+        return
+    logger.info(f"Draining browser jobs (up to {DRAIN_TIMEOUT}s)...")
+    stop_producers()
+    if browser_jobs.drain(DRAIN_TIMEOUT):
+        logger.info(f"Drained; {len(pending_jobs.pending())} jobs saved for the next process")
+    else:
+        logger.error(f"Browser jobs still running after the drain: {browser_jobs.list()}")
+
+def start_replacement(timeout=60):
+    """Start a new server process on our port and wait until it listens"""
+    env = dict(os.environ, RESTARTED_FROM=str(os.getpid()))
+    process = subprocess.Popen([sys.executable] + sys.argv, env=env)
+    if replacement_ready.wait(timeout):
+        logger.info(f"Replacement server {process.pid} is listening")
+    else:
+        logger.error(f"Replacement server {process.pid} did not start listening in {timeout}s")
+
+def shutdown(restart=False):
+    """Stop serving after draining browser jobs.
+
+    On a restart the replacement is started first and takes new requests
+    on the same port (SO_REUSEPORT) as soon as it listens, so clients never
+    wait for the drain. This process then drains, answering with 503 and
+    Retry-After, and the replacement resumes the jobs it saved once it has
+    exited.
+    """
+    if shutdown_started.is_set():
+        return
+    shutdown_started.set()
+    if restart:
+        # Only one process may run the background services
+        stop_producers()
+        # The new process's watchdog takes over; ours would kill its browsers
+        if browser_watchdog:
+            browser_watchdog.stop(timeout=5)
+        start_replacement()
+    drain()
+    browser_pool.stop()
+    if browser_watchdog:
+        browser_watchdog.stop(timeout=5)
+    if https_server:
+        https_server.stop()
+
+def on_signal(signum, frame):
+    # Keep serving from the main thread while the drain runs
+    restart = hasattr(signal, 'SIGHUP') and signum == signal.SIGHUP
+    logger.info(f"Received {'SIGHUP, restarting' if restart else signal.Signals(signum).name + ', shutting down'}")
+    threading.Thread(target=shutdown, args=(restart,), name='shutdown', daemon=True).start()
+
+def claim_pid_file():
+    """Refuse to run next to another server on the same state files,
+    unless it is the process handing over to us"""
+    if os.path.exists(PID_FILE):
+        with open(PID_FILE, 'r') as f:
+            pid = f.read().strip()
+        if pid.isdigit() and pid != os.getenv('RESTARTED_FROM'):
+            try:
+                running = any('app.py' in part for part in psutil.Process(int(pid)).cmdline())
+            except psutil.Error:
+                running = False
+            if running:
+                sys.exit(f"Server already running with pid {pid}; send it SIGHUP to restart")
+    with open(PID_FILE, 'w') as f:
+        f.write(str(os.getpid()))
+
+def release_pid_file():
+    try:
+        with open(PID_FILE, 'r') as f:
+            ours = f.read().strip() == str(os.getpid())
+        if ours:
+            os.remove(PID_FILE)
+    except OSError:
+        pass
+
 if __name__ == '__main__':
-    # Load SSL certificate and key
-    cert_path = os.path.join(os.path.dirname(__file__), 'cert.pem')
-    key_path = os.path.join(os.path.dirname(__file__), 'key.pem')
+    claim_pid_file()
+    # SIGTERM everywhere; NSSM sends Ctrl+Break (SIGBREAK) to stop a Windows service
+    signal.signal(signal.SIGTERM, on_signal)
+    if hasattr(signal, 'SIGBREAK'):
+        signal.signal(signal.SIGBREAK, on_signal)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, on_signal)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: replacement_ready.set())
     
-    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+    # Generate a self-signed certificate in-process on first run
+    if not (os.path.exists(certfile) and os.path.exists(keyfile)):
         logger.warning("SSL certificate files not found. Generating new ones...")
-        os.system('python generate_cert.py')
+        from generate_cert import generate_self_signed_cert
+        generate_self_signed_cert(cert_dir)
+        startup_phase('generate_cert')
+    
+    if chase_watcher:
+        logger.info("Starting live Chase watcher...")
+        chase_watcher.start()
+    if poll_scheduler:
+        logger.info("Starting background polling scheduler...")
+        poll_scheduler.start()
+    if payment_batcher:
+        logger.info("Starting payment batcher...")
+        payment_batcher.start()
+    startup_phase('background_services')
     
     logger.info("Starting Flask application in production mode...")
-    run_https_server()
\ No newline at end of file
+    try:
+        run_https_server(on_listening)
+    finally:
+        drain()
+        if payment_batcher:
+            payment_batcher.stop(timeout=5)
+        if poll_scheduler:
+            poll_scheduler.stop(timeout=5)
+        if chase_watcher:
+            chase_watcher.stop()
+        browser_pool.stop()
+        if browser_watchdog:
+            browser_watchdog.stop(timeout=5)
+        release_pid_file()
\ No newline at end of file
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import bisect
+import threading
+from datetime import datetime
+
+from file_lock import file_lock
+
+BALANCE_FILE = 'balance_history.json'
+HOUR = 3600
+DAY = 24 * HOUR
+
+# (tier, bucket width in seconds, how long points stay in this tier)
+TIERS = (
+    ('raw', None, 7 * DAY),
+    ('hourly', HOUR, 90 * DAY),
+    ('daily', DAY, 10 * 365 * DAY),
+)
+
+
+class BalanceHistory:
+    """Card balance time series with automatic downsampling.
+
+    Points are [timestamp, cents, min_cents, max_cents]. Observations are kept
+    at full resolution for 7 days, then folded into hourly buckets, then into
+    daily buckets after 90 days, and dropped after ten years, so the file stays
+    bounded (about 2k hourly and 3.7k daily points plus a week of raw points).
+    Each tier is sorted by timestamp, so range queries are a bisect per tier.
+    Scrapes in several browser worker processes append to the same file, so
+    each append re-reads and rewrites it under a lock file.
+    """
+
+    def __init__(self, filename=BALANCE_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.tiers = {name: [] for name, _, _ in TIERS}
+        self.mtime = None
+        self._reload()
+
+    def _reload(self, force=False):
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if force or mtime != self.mtime:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                self.tiers.update(json.load(f))
+            self.mtime = mtime
+
+    def _save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.tiers, f, separators=(',', ':'))
+        os.replace(tmp, self.filename)
+        self.mtime = os.stat(self.filename).st_mtime_ns
+
+    def _downsample(self, now):
+        """Move points that outlived their tier into the next, coarser one"""
+        for (name, _, keep), (next_name, width, _) in zip(TIERS, TIERS[1:]):
+            points = self.tiers[name]
+            cutoff = bisect.bisect_left(points, [now - keep])
+            if not cutoff:
+                continue
+            target = self.tiers[next_name]
+            for ts, cents, low, high in points[:cutoff]:
+                bucket = ts - ts % width
+                if target and target[-1][0] == bucket:
+                    last = target[-1]
+                    last[1] = cents  # close of the bucket
+                    last[2] = min(last[2], low)
+                    last[3] = max(last[3], high)
+                else:
+                    target.append([bucket, cents, low, high])
+            del points[:cutoff]
+        name, _, keep = TIERS[-1]
+        points = self.tiers[name]
+        del points[:bisect.bisect_left(points, [now - keep])]
+
+    def append(self, cents, ts=None):
+        """Record an observed balance"""
+        ts = int(ts if ts is not None else time.time())
+        with self.lock, file_lock(self.filename + '.lock'):
+            # The mtime may not have moved if another process wrote just now
+            self._reload(force=True)
+            raw = self.tiers['raw']
+            if raw and raw[0][0] > ts:
+                return  # older than every raw point; keep tiers sorted
+            # Another worker may have recorded a later observation first
+            bisect.insort(raw, [ts, cents, cents, cents])
+            self._downsample(max(ts, raw[-1][0]))
+            self._save()
+
+    def query(self, start=None, end=None):
+        """Return points between start and end (timestamps), oldest first"""
+        start = start if start is not None else 0
+        end = end if end is not None else float('inf')
+        with self.lock:
+            self._reload()
+            result = []
+            for name, _, _ in reversed(TIERS):
+                points = self.tiers[name]
+                lo = bisect.bisect_left(points, [start])
+                hi = bisect.bisect_right(points, [end, float('inf')])
+                for ts, cents, low, high in points[lo:hi]:
+                    result.append({
+                        'time': datetime.fromtimestamp(ts).isoformat(),
+                        'balance': cents / 100,
+                        'low': low / 100,
+                        'high': high / 100,
+                        'resolution': name,
+                    })
+            return result
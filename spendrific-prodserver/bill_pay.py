@@ -7,24 +7,32 @@ from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 from dotenv import load_dotenv
 import os
-import time
-import csv
-from datetime import datetime
 import sys
+from datetime import date
+from totals import SpendTotals
+from normalize import format_cents, parse_date
+from payment_flow import BillPayCheckpoints, BillPayFlow
+from deadline import Deadline
+from profiles import DATCU_PROFILE_DIR
 
-# Define the profile directory path
-CHROME_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chrome_profile_datcu")
+# Golden profile directory, cloned per session (see profiles.py)
+CHROME_PROFILE_DIR = DATCU_PROFILE_DIR
+PAY_BILLS_URL = "https://online.datcu.org/move-money/pay-bills"
 
 class DatcuBillPay:
-    def __init__(self):
+    def __init__(self, deadline=None, profile_dir=CHROME_PROFILE_DIR):
+        # Overall time budget shared by every wait; unbounded by default
+        self.deadline = deadline or Deadline(kind='datcu')
+        self.deadline.step('launch')
         options = Options()
         # Use specific profile directory
-        options.add_argument(f"--user-data-dir={CHROME_PROFILE_DIR}")
+        options.add_argument(f"--user-data-dir={profile_dir}")
         options.add_argument("--page-load-strategy=eager")
         
         # Create and start browser with automatic ChromeDriver installation
         service = Service(ChromeDriverManager().install())
         self.driver = webdriver.Chrome(service=service, options=options)
+        self.deadline.on_cancel.append(self.close)
         self.driver.set_window_size(1800, 1089)  # Set window size as per test
         
         # Load environment variables
@@ -34,20 +42,29 @@ class DatcuBillPay:
         if not self.username or not self.password:
             raise ValueError("DATCU_USERNAME and DATCU_PASSWORD must be set in .env file")
 
+    def _wait(self, timeout):
+        """WebDriverWait bounded by what is left of the deadline"""
+        return WebDriverWait(self.driver, self.deadline.timeout(timeout))
+
+    def _get(self, url):
+        self.driver.set_page_load_timeout(self.deadline.timeout(300))
+        self.driver.get(url)
+
     def login(self):
         """Log into DATCU account"""
+        self.deadline.step('login')
         try:
             print("Navigating to DATCU website...")
-            self.driver.get("https://www.datcu.org/")
-            time.sleep(3)  # Wait for page load
+            self._get("https://www.datcu.org/")
+            self.deadline.sleep(3)  # Wait for page load
             
             print("Opening login window...")
             # Click login toggle to bring up login window
-            login_toggle = WebDriverWait(self.driver, 10).until(
+            login_toggle = self._wait(10).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, ".login-toggle"))
             )
             login_toggle.click()
-            time.sleep(3)  # Give more time for login form to appear
+            self.deadline.sleep(3)  # Give more time for login form to appear
             
             print("Looking for login form...")
             # Try to switch to potential login iframe
@@ -74,8 +91,9 @@ class DatcuBillPay:
             
             username_field = None
             for selector_type, selector in username_selectors:
+                wait = self._wait(5)  # outside the try so a spent deadline propagates
                 try:
-                    username_field = WebDriverWait(self.driver, 5).until(
+                    username_field = wait.until(
                         EC.presence_of_element_located((selector_type, selector))
                     )
                     print(f"Found username field with selector: {selector}")
@@ -102,8 +120,9 @@ class DatcuBillPay:
             
             password_field = None
             for selector_type, selector in password_selectors:
+                wait = self._wait(5)  # outside the try so a spent deadline propagates
                 try:
-                    password_field = WebDriverWait(self.driver, 5).until(
+                    password_field = wait.until(
                         EC.presence_of_element_located((selector_type, selector))
                     )
                     print(f"Found password field with selector: {selector}")
@@ -132,9 +151,10 @@ class DatcuBillPay:
             print("Looking for login button...")
             login_button = None
             for selector_type, selector in login_button_selectors:
+                wait = self._wait(5)
                 try:
                     print(f"Trying selector: {selector}")
-                    login_button = WebDriverWait(self.driver, 5).until(
+                    login_button = wait.until(
                         EC.element_to_be_clickable((selector_type, selector))
                     )
                     print(f"Found login button with selector: {selector}")
@@ -174,7 +194,7 @@ class DatcuBillPay:
                     raise
             
             print("Waiting for login to complete...")
-            time.sleep(5)  # Wait for login to complete
+            self.deadline.sleep(5)  # Wait for login to complete
             
         except Exception as e:
             print(f"Error during login: {e}")
@@ -183,21 +203,22 @@ class DatcuBillPay:
 
     def navigate_to_bill_pay(self):
         """Navigate to bill pay section"""
+        self.deadline.step('navigate')
         try:
             print("Waiting for accounts page...")
             # Wait for URL to be on accounts page
-            WebDriverWait(self.driver, 20).until(  # Increased timeout
+            self._wait(20).until(  # Increased timeout
                 lambda driver: "online.datcu.org/accounts" in driver.current_url
             )
             print(f"Current URL: {self.driver.current_url}")
             
             print("Navigating to move-money page...")
-            self.driver.get("https://online.datcu.org/move-money")
-            time.sleep(3)  # Wait for page to load
+            self._get("https://online.datcu.org/move-money")
+            self.deadline.sleep(3)  # Wait for page to load
             
             print("Navigating to bill pay screen...")
-            self.driver.get("https://online.datcu.org/move-money/pay-bills")
-            time.sleep(3)  # Wait for bill pay page to load
+            self._get(PAY_BILLS_URL)
+            self.deadline.sleep(3)  # Wait for bill pay page to load
             
             print("Successfully navigated to bill pay screen")
             
@@ -207,47 +228,109 @@ class DatcuBillPay:
             self.driver.save_screenshot("navigation_error.png")
             raise
 
+    def reopen_bill_pay(self):
+        """Load the bill pay page again in a session that is already past
+        the accounts page (a retry or a verification in the same session)"""
+        self.deadline.step('navigate')
+        try:
+            print("Reloading bill pay screen...")
+            self._get(PAY_BILLS_URL)
+            self.deadline.sleep(3)  # Wait for bill pay page to load
+        except Exception as e:
+            print(f"Error reloading bill pay: {e}")
+            print(f"Current URL: {self.driver.current_url}")
+            self.driver.save_screenshot("navigation_error.png")
+            raise
+
+    def is_logged_in(self):
+        """True while the browser is inside online banking"""
+        return "online.datcu.org" in self.driver.current_url
+
+    def _payment_frame(self):
+        """Switch to the bill pay iframe"""
+        self.driver.switch_to.default_content()
+        self.driver.switch_to.frame(0)
+
+    def enter_amount(self, amount):
+        self.deadline.step('enter_amount')
+        print(f"Entering payment amount ${amount}...")
+        self._payment_frame()
+        amount_field = self._wait(10).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "input.form-control.pmtAmount.singlePaymentAmount.amount"))
+        )
+        amount_field.click()
+        amount_field.clear()  # Clear any existing value
+        amount_field.send_keys(amount)
+
+    def continue_to_review(self):
+        self.deadline.step('review')
+        print("Clicking continue button...")
+        continue_button = self._wait(10).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, ".hidden-xs > .btn > .fa"))
+        )
+        continue_button.click()
+        self.deadline.sleep(2)  # Wait for next screen
+
+    def submit_payment(self):
+        self.deadline.step('submit')
+        print("Clicking submit payment button...")
+        submit_button = self._wait(10).until(
+            EC.element_to_be_clickable((By.ID, "btnSubmitPayment"))
+        )
+        submit_button.click()
+        self.deadline.sleep(2)  # Wait for confirmation modal
+
+    def confirm_payment(self):
+        self.deadline.step('confirm')
+        print("Confirming payment...")
+        confirm_button = self._wait(10).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, ".modal-footer > .pull-left:nth-child(2)"))
+        )
+        confirm_button.click()
+        self.deadline.sleep(2)  # Wait for confirmation screen
+        self.driver.switch_to.default_content()
+
+    def has_confirmation(self, cents):
+        """True if the bill pay iframe shows a confirmation for this amount"""
+        self.deadline.step('verify')
+        self._payment_frame()
+        text = self.driver.find_element(By.TAG_NAME, "body").text
+        return "confirmation" in text.lower() and format_cents(cents) in text
+
+    def count_payments(self, cents, day=None):
+        """Number of payments of this amount dated `day` (ISO date, default
+        today) in the bill pay history.
+
+        A history list with no rows counts as none. Raises if no history list
+        is found at all, since that means the result could not be checked
+        rather than that there were none.
+        """
+        self._payment_frame()
+        day = date.fromisoformat(day) if day else date.today()
+        dates = {day.strftime("%m/%d/%Y"), f"{day.month}/{day.day}/{day.year}"}
+        amount = format_cents(cents)
+        history_selectors = [".pendingPayments", ".recentPayments", ".payment-history"]
+        lists = [
+            found for selector in history_selectors
+            for found in self.driver.find_elements(By.CSS_SELECTOR, selector)
+        ]
+        if not lists:
+            self.driver.save_screenshot("payment_history_error.png")
+            raise Exception("Bill pay history not found")
+        rows = [row for history in lists for row in history.find_elements(By.TAG_NAME, "tr")]
+        return sum(
+            1 for row in rows
+            if amount in row.text and any(d in row.text for d in dates)
+        )
+
     def initiate_payment(self, amount="1.00"):
         """Initiate a bill payment"""
         try:
             print(f"Initiating payment for ${amount}...")
-            
-            # Switch to the bill pay iframe
-            print("Switching to bill pay iframe...")
-            self.driver.switch_to.frame(0)
-            
-            # Enter payment amount
-            print("Looking for amount field...")
-            amount_field = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input.form-control.pmtAmount.singlePaymentAmount.amount"))
-            )
-            amount_field.click()
-            amount_field.clear()  # Clear any existing value
-            amount_field.send_keys(amount)
-            
-            print("Clicking continue button...")
-            continue_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, ".hidden-xs > .btn > .fa"))
-            )
-            continue_button.click()
-            time.sleep(2)  # Wait for next screen
-            
-            print("Clicking submit payment button...")
-            submit_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.ID, "btnSubmitPayment"))
-            )
-            submit_button.click()
-            time.sleep(2)  # Wait for confirmation modal
-            
-            print("Confirming payment...")
-            confirm_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, ".modal-footer > .pull-left:nth-child(2)"))
-            )
-            confirm_button.click()
-            
-            # Switch back to default content
-            self.driver.switch_to.default_content()
-            
+            self.enter_amount(amount)
+            self.continue_to_review()
+            self.submit_payment()
+            self.confirm_payment()
             print("Payment submitted successfully!")
             
         except Exception as e:
@@ -260,21 +343,14 @@ class DatcuBillPay:
         self.driver.quit()
 
 def calculate_daily_total(date_str="Jan 23, 2025"):
-    """Calculate total transactions for a specific date"""
+    """Calculate total transactions (in cents) for a specific date"""
     try:
-        total = 0.0
-        transactions = []
-        
-        with open('chase_transactions.csv', 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['Date'].strip('"') == date_str:
-                    amount = float(row['Amount'].strip('"').replace('$', ''))
-                    total += amount
-                    transactions.append({
-                        'name': row['Name'].strip('"'),
-                        'amount': amount
-                    })
+        records = SpendTotals().transactions_on(date_str)
+        transactions = [
+            {'name': r.name, 'cents': r.cents}
+            for r in records
+        ]
+        total = sum(r.cents for r in records)
         
         return total, transactions
     except Exception as e:
@@ -290,11 +366,11 @@ def main():
         # Display transactions and total
         print(f"\nTransactions for {date_str}:")
         for t in transactions:
-            print(f"- {t['name']}: ${t['amount']:.2f}")
-        print(f"\nTotal amount: ${total:.2f}")
+            print(f"- {t['name']}: {format_cents(t['cents'])}")
+        print(f"\nTotal amount: {format_cents(total)}")
         
         # Ask for confirmation
-        confirm = input(f"\nWould you like to initiate a bill pay for ${total:.2f}? (yes/no): ")
+        confirm = input(f"\nWould you like to initiate a bill pay for {format_cents(total)}? (yes/no): ")
         
         if confirm.lower() != 'yes':
             print("Bill pay cancelled")
@@ -303,9 +379,9 @@ def main():
         # Proceed with bill pay
         datcu = DatcuBillPay()
         try:
-            datcu.login()
-            datcu.navigate_to_bill_pay()
-            datcu.initiate_payment(f"{total:.2f}")
+            key = f"cli-{parse_date(date_str)}-{total}"
+            BillPayFlow(datcu, total, key, BillPayCheckpoints()).run()
+            print("Payment submitted successfully!")
         finally:
             datcu.close()
             
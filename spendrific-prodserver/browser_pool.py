@@ -0,0 +1,371 @@
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+import subprocess
+from contextlib import nullcontext
+from multiprocessing.connection import Client, Listener
+
+import psutil
+
+from deadline import Deadline, DeadlineExceeded
+from payments import PaymentUncertainError
+from profiles import ProfileManager
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker may overrun its deadline (or a cancel) before it is killed
+KILL_GRACE = 30
+STARTUP_TIMEOUT = 60
+
+
+class BrowserJobError(Exception):
+    """A browser job failed in its worker"""
+
+
+class WorkerCrashed(BrowserJobError):
+    """The worker process died or hung while running a job"""
+
+
+# Jobs run inside a worker process. Each takes the worker-side deadline and
+# `notify(kind, *values)` for messages to the server, and returns something
+# small and picklable.
+
+def _profile(golden_dir):
+    """A private clone of the golden profile, so sessions can run side by side"""
+    if os.getenv('PROFILE_CLONES', '1') == '1':
+        return ProfileManager(golden_dir).session()
+    return nullcontext(golden_dir)
+
+
+def scrape_chase(deadline, notify):
+    """Scrape the activity; None if unchanged, else (activity digest,
+    [(day, name, cents, status, state), ...]). The server commits the
+    digest once it has ingested the rows."""
+    from chase import CHROME_PROFILE_DIR, Browser
+    with _profile(CHROME_PROFILE_DIR) as profile_dir:
+        browser = Browser(deadline, profile_dir)
+        notify('browser', browser.driver.service.process.pid)
+        try:
+            browser.open()
+            if browser.activity_unchanged():
+                return None
+            transactions = browser.get_latest_transactions()
+            browser.save_to_csv(transactions)
+            return browser.activity_digest, [(t.day, t.name, t.cents, t.status, t.state) for t in transactions]
+        finally:
+            browser.close()
+
+
+def pay_datcu(deadline, notify, cents, key):
+    from bill_pay import CHROME_PROFILE_DIR, DatcuBillPay
+    from payment_flow import BillPayCheckpoints, BillPayFlow
+    with _profile(CHROME_PROFILE_DIR) as profile_dir:
+        bill_pay = DatcuBillPay(deadline, profile_dir)
+        notify('browser', bill_pay.driver.service.process.pid)
+        try:
+            BillPayFlow(bill_pay, cents, key, BillPayCheckpoints()).run()
+        finally:
+            bill_pay.close()
+
+
+def warm_browser(deadline, notify):
+    """Resolve the driver and start headless Chrome once, so the first real
+    session finds the driver cached and Chrome's files in the OS cache"""
+    import tempfile
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+    deadline.step('launch')
+    with tempfile.TemporaryDirectory() as profile_dir:
+        options = Options()
+        options.add_argument('--headless=new')
+        options.add_argument(f"--user-data-dir={profile_dir}")
+        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+        notify('browser', driver.service.process.pid)
+        driver.quit()
+
+
+JOBS = {
+    'chase': scrape_chase,
+    'pay': pay_datcu,
+    'warm': warm_browser,
+}
+
+
+def _worker_main(conn):
+    """Worker loop. Messages are tuples:
+
+    server -> worker: ('run', job_id, kind, args, budget), ('cancel', job_id), ('stop',)
+    worker -> server: ('step', job_id, name), ('browser', job_id, pid),
+                      ('done', job_id, result), ('error', job_id, type, message, cause_type)
+    """
+    # Selenium and the scrapers load here, off the server's startup path
+    import chase, bill_pay  # noqa: F401
+    runs = queue.Queue()
+    current = {}
+    cancelled = set()
+
+    def listen():
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                os._exit(0)  # server went away
+            if message[0] == 'run':
+                runs.put(message)
+            elif message[0] == 'cancel':
+                cancelled.add(message[1])
+                deadline = current.get(message[1])
+                if deadline:
+                    deadline.cancel()
+            else:
+                runs.put(None)
+                return
+
+    threading.Thread(target=listen, name='worker-listener', daemon=True).start()
+    while True:
+        message = runs.get()
+        if message is None:
+            return
+        _, job_id, kind, args, budget = message
+        deadline = Deadline(budget, kind, job_id)
+        deadline.on_step.append(lambda name: conn.send(('step', job_id, name)))
+        current[job_id] = deadline
+        if job_id in cancelled:
+            deadline.cancel()
+        try:
+            result = JOBS[kind](deadline, lambda *values: conn.send((values[0], job_id) + values[1:]), *args)
+            conn.send(('done', job_id, result))
+        except Exception as e:
+            cause = type(e.__cause__).__name__ if e.__cause__ else None
+            conn.send(('error', job_id, type(e).__name__, str(e), cause))
+        finally:
+            current.pop(job_id, None)
+            cancelled.discard(job_id)
+
+
+class _Worker:
+    """One worker process, started as `python browser_pool.py` so it does not
+    re-import the server, and connected back over a local authenticated pipe"""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.jobs = 0
+        self.restarts = 0
+        self.job = None
+
+    def start(self):
+        authkey = os.urandom(16)
+        listener = Listener(authkey=authkey)
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), listener.address],
+            stdin=subprocess.PIPE
+        )
+        self.process.stdin.write(authkey.hex().encode('ascii') + b'\n')
+        self.process.stdin.close()
+        accepted = []
+
+        def accept():
+            try:
+                accepted.append(listener.accept())
+            except (OSError, EOFError):
+                pass  # listener closed because the worker never connected
+
+        thread = threading.Thread(target=accept, daemon=True)
+        thread.start()
+        thread.join(STARTUP_TIMEOUT)
+        listener.close()
+        if not accepted:
+            self.process.kill()
+            raise WorkerCrashed(f"Browser worker {self.index} did not start")
+        self.conn = accepted[0]
+
+    def is_alive(self):
+        return bool(self.process and self.process.poll() is None)
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def kill(self):
+        """Kill the worker with any chromedriver/Chrome it started"""
+        try:
+            process = psutil.Process(self.process.pid)
+            procs = process.children(recursive=True) + [process]
+        except psutil.NoSuchProcess:
+            procs = []
+        for proc in procs:
+            try:
+                proc.kill()
+            except psutil.NoSuchProcess:
+                pass
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            pass
+        self.conn.close()
+
+    def restart(self):
+        self.kill()
+        self.restarts += 1
+        self.start()
+
+    def status(self):
+        return {
+            'worker': self.index,
+            'pid': self.process.pid if self.process else None,
+            'alive': self.is_alive(),
+            'job': self.job,
+            'jobs': self.jobs,
+            'restarts': self.restarts,
+        }
+
+
+class BrowserPool:
+    """Runs browser jobs in a pool of supervised worker processes.
+
+    Selenium, Chrome's memory and any hung driver call stay out of the web
+    server process. run() blocks the calling request thread until a worker
+    is free (within the job's deadline), streams the worker's step reports
+    into the server-side Deadline, and returns the job's result. Cancelling
+    the Deadline asks the worker to close its browser. A worker that dies,
+    or overruns its deadline or a cancel by KILL_GRACE seconds, is killed
+    together with its browser and replaced.
+    """
+
+    def __init__(self, size=2, watchdog=None):
+        self.size = max(1, size)
+        self.watchdog = watchdog
+        self.workers = [_Worker(i) for i in range(self.size)]
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for worker in self.workers:
+                worker.start()
+                self.idle.put(worker)
+            self.started = True
+        logger.info(f"Started {self.size} browser workers")
+
+    def stop(self, timeout=10):
+        with self.lock:
+            if not self.started:
+                return
+            self.started = False
+        for worker in self.workers:
+            try:
+                worker.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        for worker in self.workers:
+            try:
+                worker.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+
+    def status(self):
+        return {
+            'size': self.size,
+            'idle': self.idle.qsize(),
+            'workers': [worker.status() for worker in self.workers],
+        }
+
+    def _acquire(self, deadline):
+        while True:
+            try:
+                worker = self.idle.get(timeout=deadline.timeout(0.5))
+            except queue.Empty:
+                continue
+            if not worker.is_alive():
+                logger.warning(f"Browser worker {worker.index} died while idle, restarting")
+                worker.restart()
+            return worker
+
+    def run(self, kind, args, deadline):
+        """Run a job in a worker and return its result, raising its error here"""
+        self.start()
+        worker = self._acquire(deadline)
+        budget = deadline.remaining() if deadline.budget is not None else None
+        cancel = lambda: worker.send(('cancel', deadline.id))
+        browser_pid = cancelled_at = None
+        try:
+            worker.job = deadline.id
+            worker.send(('run', deadline.id, kind, args, budget))
+            deadline.on_cancel.append(cancel)
+            while True:
+                if cancelled_at is None and deadline.cancelled.is_set():
+                    cancelled_at = time.monotonic()
+                if worker.conn.poll(1.0):
+                    try:
+                        message = worker.conn.recv()
+                    except (EOFError, OSError):
+                        message = None
+                    if message is None:
+                        worker.restart()
+                        raise WorkerCrashed(f"Browser worker {worker.index} exited during {deadline.step_name}")
+                    if message[1] != deadline.id:
+                        continue  # late message from a job that was given up on
+                    if message[0] == 'step':
+                        deadline.record(message[2])
+                    elif message[0] == 'browser':
+                        browser_pid = message[2]
+                        if self.watchdog:
+                            self.watchdog.register(browser_pid, deadline.cancel)
+                    elif message[0] == 'done':
+                        worker.jobs += 1
+                        return message[2]
+                    else:
+                        worker.jobs += 1
+                        self._raise(deadline, *message[2:])
+                elif not worker.is_alive():
+                    worker.restart()
+                    raise WorkerCrashed(f"Browser worker {worker.index} crashed during {deadline.step_name}")
+                elif self._overdue(deadline, cancelled_at):
+                    logger.error(f"Browser worker {worker.index} is unresponsive, killing it")
+                    worker.restart()
+                    if deadline.cancelled.is_set():
+                        raise deadline.cancelled_error()
+                    raise DeadlineExceeded(deadline)
+        finally:
+            if cancel in deadline.on_cancel:
+                deadline.on_cancel.remove(cancel)
+            if self.watchdog and browser_pid:
+                self.watchdog.unregister(browser_pid)
+            worker.job = None
+            self.idle.put(worker)
+
+    def _overdue(self, deadline, cancelled_at):
+        if cancelled_at is not None:
+            return time.monotonic() > cancelled_at + KILL_GRACE
+        return deadline.expires is not None and time.monotonic() > deadline.expires + KILL_GRACE
+
+    def _raise(self, deadline, error_type, message, cause_type):
+        """Re-raise a worker's error as the matching exception in the server"""
+        causes = {'DeadlineExceeded': DeadlineExceeded, 'JobCancelled': lambda d: d.cancelled_error()}
+        if error_type in causes:
+            raise causes[error_type](deadline)
+        if error_type == 'PaymentUncertainError':
+            cause = causes[cause_type](deadline) if cause_type in causes else None
+            raise PaymentUncertainError(message) from cause
+        raise BrowserJobError(message)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s worker %(name)s %(levelname)s: %(message)s')
+    try:
+        connection = Client(sys.argv[1], authkey=bytes.fromhex(sys.stdin.readline().strip()))
+    except (OSError, ValueError) as e:
+        # The server exited between starting us and accepting the connection
+        sys.exit(f"Browser worker: server went away before it connected ({e})")
+    _worker_main(connection)
@@ -0,0 +1,252 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+DRIVER_NAMES = ('chromedriver', 'chromedriver.exe')
+
+
+def _kill_tree(process, timeout=3):
+    """Terminate a process and all its descendants, killing any that linger"""
+    try:
+        procs = process.children(recursive=True) + [process]
+    except psutil.NoSuchProcess:
+        return 0
+    for proc in procs:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(procs, timeout=timeout)
+    for proc in alive:
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+    return len(procs)
+
+
+class BrowserWatchdog:
+    """Tracks the chromedriver/Chrome process trees this server spawns.
+
+    Every chromedriver under the server is a session, registered or not,
+    so one leaked by a failed close() is still seen. Each sweep samples RSS
+    and CPU across the session's whole tree and recycles sessions over
+    `max_rss_mb` or older than `max_age` seconds: registered sessions get
+    their `release` callback first (e.g. cancelling the job, which quits the
+    driver), and whatever is left of the tree is killed. Chrome processes
+    using one of `profile_dirs` that belong to no session are orphans (a
+    previous server run, a forgotten open_browser.py window) and are killed
+    once they are older than `orphan_grace` seconds, as are re-parented
+    chromedrivers whose Chrome uses one of them. Sessions registered as
+    long-lived (the live Chase watcher) are only recycled for memory.
+    """
+
+    def __init__(self, profile_dirs, max_rss_mb=1500, max_age=3600, interval=60, orphan_grace=900):
+        self.profile_flags = [f"--user-data-dir={path}" for path in profile_dirs]
+        self.max_rss_mb = max_rss_mb
+        self.max_age = max_age
+        self.interval = interval
+        self.orphan_grace = orphan_grace
+        self.lock = threading.Lock()
+        self.releases = {}   # chromedriver pid -> release callback
+        self.long_lived = set()  # registered pids exempt from max_age
+        self.procs = {}      # pid -> psutil.Process, kept so cpu_percent has a baseline
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last = {'sessions': [], 'lastSweep': None}
+        self.counts = {'recycled': 0, 'orphansKilled': 0}
+
+    def register(self, pid, release, long_lived=False):
+        """Recycle the session of this chromedriver pid through `release` rather
+        than by killing it; a long-lived session is never recycled for its age"""
+        with self.lock:
+            self.releases[pid] = release
+            if long_lived:
+                self.long_lived.add(pid)
+        return pid
+
+    def unregister(self, pid):
+        with self.lock:
+            self.releases.pop(pid, None)
+            self.long_lived.discard(pid)
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='browser-watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _process(self, proc):
+        cached = self.procs.get(proc.pid)
+        if cached is None or cached.create_time() != proc.create_time():
+            self.procs[proc.pid] = cached = proc
+        return cached
+
+    def _sessions(self):
+        """chromedriver descendants of this server (directly or through a
+        browser worker) with their full process trees"""
+        sessions = []
+        for child in psutil.Process(os.getpid()).children(recursive=True):
+            try:
+                if child.name().lower() in DRIVER_NAMES:
+                    sessions.append((child, [child] + child.children(recursive=True)))
+            except psutil.NoSuchProcess:
+                continue
+        return sessions
+
+    def _sample(self, driver, tree, now):
+        rss = cpu = 0.0
+        for proc in tree:
+            try:
+                proc = self._process(proc)
+                rss += proc.memory_info().rss
+                cpu += proc.cpu_percent(interval=None)
+            except psutil.NoSuchProcess:
+                continue
+        return {
+            'pid': driver.pid,
+            'registered': driver.pid in self.releases,
+            'processes': len(tree),
+            'rssMb': round(rss / 2 ** 20, 1),
+            'cpuPercent': round(cpu, 1),
+            'age': round(now - driver.create_time()),
+        }
+
+    def _recycle(self, driver, reason):
+        logger.warning(f"Watchdog: recycling browser session {driver.pid} ({reason})")
+        with self.lock:
+            release = self.releases.pop(driver.pid, None)
+            self.long_lived.discard(driver.pid)
+        if release:
+            try:
+                release()
+            except Exception as e:
+                logger.error(f"Watchdog: release of {driver.pid} failed: {e}")
+        _kill_tree(driver)
+        self.counts['recycled'] += 1
+
+    def _uses_profile(self, procs):
+        for proc in procs:
+            try:
+                cmdline = ' '.join(proc.cmdline())
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            if any(flag in cmdline for flag in self.profile_flags):
+                return True
+        return False
+
+    @staticmethod
+    def _abandoned(proc):
+        """True if the process that started proc is gone (re-parented to init)"""
+        parent = proc.parent()
+        return parent is None or parent.pid == 1
+
+    def kill_orphans(self, grace=None, abandoned_only=False):
+        """Kill Chrome processes on our profiles that no live session owns.
+
+        With `abandoned_only` (at startup) age does not matter, but only
+        trees whose owner has exited are killed, so a browser opened by a
+        live open_browser.py to seed a golden profile is left alone.
+        """
+        grace = 0 if abandoned_only else (self.orphan_grace if grace is None else grace)
+        owned = set()
+        for _, tree in self._sessions():
+            owned.update(proc.pid for proc in tree)
+        now = time.time()
+        killed = 0
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'create_time']):
+            info = proc.info
+            if info['pid'] in owned or now - (info['create_time'] or now) < grace:
+                continue
+            if (info['name'] or '').lower() in DRIVER_NAMES:
+                # A chromedriver whose server is gone has been re-parented.
+                # Its own command line names no profile, so it is ours only
+                # if the Chrome it drives runs on one of our profiles.
+                try:
+                    if not self._abandoned(proc):
+                        continue
+                    ours = self._uses_profile(proc.children())
+                except psutil.NoSuchProcess:
+                    continue
+                if ours:
+                    logger.warning(f"Watchdog: killing orphaned chromedriver {info['pid']}")
+                    killed += _kill_tree(proc)
+                continue
+            if 'chrom' not in (info['name'] or '').lower():
+                continue
+            cmdline = ' '.join(info['cmdline'] or [])
+            if not any(flag in cmdline for flag in self.profile_flags):
+                continue
+            try:
+                parent = proc.parent()
+                # Only the top of a browser tree; its children go with it
+                if parent and any(flag in ' '.join(parent.cmdline()) for flag in self.profile_flags):
+                    continue
+                if abandoned_only and not self._abandoned(proc):
+                    continue
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+            logger.warning(f"Watchdog: killing orphaned browser {info['pid']} ({info['name']})")
+            killed += _kill_tree(proc)
+        self.counts['orphansKilled'] += killed
+        return killed
+
+    def sweep(self):
+        now = time.time()
+        sessions = []
+        for driver, tree in self._sessions():
+            try:
+                sample = self._sample(driver, tree, now)
+            except psutil.NoSuchProcess:
+                continue
+            if sample['rssMb'] > self.max_rss_mb:
+                self._recycle(driver, f"{sample['rssMb']} MB RSS")
+            elif sample['age'] > self.max_age and driver.pid not in self.long_lived:
+                self._recycle(driver, f"{sample['age']}s old")
+            else:
+                sessions.append(sample)
+        self.procs = {pid: proc for pid, proc in self.procs.items() if proc.is_running()}
+        with self.lock:
+            self.releases = {
+                pid: release for pid, release in self.releases.items() if psutil.pid_exists(pid)
+            }
+            self.long_lived &= set(self.releases)
+        try:
+            self.kill_orphans()
+        except Exception as e:
+            logger.error(f"Watchdog: orphan scan failed: {e}")
+        self.last = {'sessions': sessions, 'lastSweep': now}
+
+    def metrics(self):
+        sessions = self.last['sessions']
+        return dict(
+            self.counts,
+            running=bool(self.thread and self.thread.is_alive()),
+            sessions=len(sessions),
+            processes=sum(s['processes'] for s in sessions),
+            rssMb=round(sum(s['rssMb'] for s in sessions), 1),
+            cpuPercent=round(sum(s['cpuPercent'] for s in sessions), 1),
+            maxRssMb=self.max_rss_mb,
+            maxAge=self.max_age,
+            lastSweep=datetime.fromtimestamp(self.last['lastSweep']).isoformat() if self.last['lastSweep'] else None,
+            details=sessions,
+        )
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Watchdog sweep failed: {e}")
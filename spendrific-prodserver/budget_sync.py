@@ -0,0 +1,428 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+
+from records import PAID
+
+logger = logging.getLogger(__name__)
+
+SYNC_FILE = 'budget_sync.jsonl'
+
+
+class BudgetBackendError(Exception):
+    """A budgeting API call failed; `retryable` if trying again may succeed"""
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class BudgetBackend(ABC):
+    """A budgeting app that transactions are pushed to.
+
+    Backends implement categories(), create_transactions() and
+    update_transactions(). The first is YNAB; EveryDollar or Mint plug in
+    by subclassing this with their own API calls. `max_batch` is the most
+    transactions one create or update call takes.
+    """
+
+    name = 'backend'
+    max_batch = 100
+
+    @abstractmethod
+    def categories(self):
+        """Assignable categories as [{'id', 'name', 'group'}]"""
+
+    @abstractmethod
+    def create_transactions(self, items):
+        """Create items in one call and return the import ids that already existed.
+
+        Each item is {'importId', 'date' (ISO), 'cents', 'payee',
+        'categoryId' (or None), 'cleared' (bool)}.
+        """
+
+    @abstractmethod
+    def update_transactions(self, items):
+        """Update earlier created transactions in one call.
+
+        Each item is {'importId', 'date' (ISO), 'cents', 'cleared' (bool)};
+        the payee and category are left as they are in the budgeting app.
+        """
+
+
+class YNABBackend(BudgetBackend):
+    """YNAB's REST API: one bulk POST per batch, import ids for deduplication"""
+
+    name = 'ynab'
+    BASE_URL = 'https://api.ynab.com/v1'
+
+    def __init__(self, token, budget_id='last-used', account_id=None, timeout=30):
+        if not token:
+            raise ValueError("YNAB_TOKEN is required for the YNAB backend")
+        self.token = token
+        self.budget_id = budget_id
+        self.account_id = account_id
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        request = urllib.request.Request(
+            self.BASE_URL + path,
+            data=json.dumps(body).encode('utf-8') if body is not None else None,
+            method=method,
+            headers={'Authorization': f"Bearer {self.token}", 'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)['data']
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode('utf-8', 'replace')[:200]
+            retry_after = e.headers.get('Retry-After')
+            raise BudgetBackendError(
+                f"YNAB {method} {path} returned {e.code}: {detail}",
+                retryable=e.code == 429 or e.code >= 500,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+            ) from e
+        except (urllib.error.URLError, OSError) as e:
+            raise BudgetBackendError(f"YNAB {method} {path} failed: {e}", retryable=True) from e
+
+    def _account(self):
+        """The budget's open credit card account, as the iOS app picks it"""
+        if self.account_id is None:
+            accounts = self._request('GET', f"/budgets/{self.budget_id}/accounts")['accounts']
+            card = next((
+                a for a in accounts
+                if a['type'] == 'creditCard' and not a['closed'] and not a['deleted']
+            ), None)
+            if card is None:
+                raise BudgetBackendError("No open credit card account in the YNAB budget")
+            self.account_id = card['id']
+        return self.account_id
+
+    def categories(self):
+        groups = self._request('GET', f"/budgets/{self.budget_id}/categories")['category_groups']
+        return [
+            {'id': c['id'], 'name': c['name'], 'group': g['name']}
+            for g in groups if not g['hidden'] and not g['deleted']
+            for c in g['categories'] if not c['hidden'] and not c['deleted']
+        ]
+
+    def create_transactions(self, items):
+        account_id = self._account()
+        data = self._request('POST', f"/budgets/{self.budget_id}/transactions", {'transactions': [{
+            'account_id': account_id,
+            'date': item['date'],
+            'amount': -item['cents'] * 10,  # milliunits; charges are outflows
+            'payee_name': item['payee'][:200],
+            'category_id': item['categoryId'],
+            'cleared': 'cleared' if item['cleared'] else 'uncleared',
+            'approved': True,
+            'import_id': item['importId'],
+        } for item in items]})
+        return data.get('duplicate_import_ids') or []
+
+    def update_transactions(self, items):
+        self._request('PATCH', f"/budgets/{self.budget_id}/transactions", {'transactions': [{
+            'import_id': item['importId'],
+            'date': item['date'],
+            'amount': -item['cents'] * 10,
+            'cleared': 'cleared' if item['cleared'] else 'uncleared',
+        } for item in items]})
+
+
+STUB_CATEGORIES = ('Groceries', 'Dining Out', 'Gas', 'Shopping', 'Subscriptions', 'Travel', 'Bills')
+
+
+class StubBackend(BudgetBackend):
+    """In-memory backend for local testing and benchmarks.
+
+    Each call sleeps `latency` seconds in place of the network, and fails
+    with a retryable error with probability `fail_rate`.
+    """
+
+    name = 'stub'
+
+    def __init__(self, latency=0.0, fail_rate=0.0, max_batch=100):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.max_batch = max_batch
+        self.created = {}  # import id -> item
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise BudgetBackendError("Stub backend failure", retryable=True)
+
+    def categories(self):
+        self._call()
+        return [
+            {'id': f"stub-{i}", 'name': name, 'group': 'Stub'}
+            for i, name in enumerate(STUB_CATEGORIES)
+        ]
+
+    def create_transactions(self, items):
+        self._call()
+        duplicates = [item['importId'] for item in items if item['importId'] in self.created]
+        for item in items:
+            self.created.setdefault(item['importId'], item)
+        return duplicates
+
+    def update_transactions(self, items):
+        self._call()
+        for item in items:
+            self.created[item['importId']] = dict(self.created[item['importId']], **item)
+
+
+class CategoryCache:
+    """Category name -> id lookups against the backend.
+
+    The list is fetched once and refreshed after `ttl` seconds. A name that
+    is not in it triggers one early refresh, but at most every `min_refresh`
+    seconds, so a batch full of unknown names costs one extra call.
+    """
+
+    def __init__(self, backend, ttl=3600, min_refresh=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self.lock = threading.Lock()
+        self.by_name = {}
+        self.by_id = {}
+        self.fetched = None
+
+    def refresh(self):
+        categories = self.backend.categories()
+        with self.lock:
+            self.by_id = {c['id']: c for c in categories}
+            self.by_name = {c['name'].casefold(): c for c in categories}
+            self.fetched = time.monotonic()
+
+    def _age(self):
+        return float('inf') if self.fetched is None else time.monotonic() - self.fetched
+
+    def resolve(self, value):
+        """Category id for a category name or id; None if there is no such category"""
+        if not value:
+            return None
+        if self._age() > self.ttl:
+            self.refresh()
+        for attempt in range(2):
+            with self.lock:
+                category = self.by_id.get(value) or self.by_name.get(value.casefold())
+            if category or attempt or self._age() < self.min_refresh:
+                break
+            self.refresh()
+        return category['id'] if category else None
+
+    def list(self):
+        if self._age() > self.ttl:
+            self.refresh()
+        with self.lock:
+            return list(self.by_id.values())
+
+
+class BudgetSync:
+    """Pushes scraped transactions to a budgeting backend in bulk.
+
+    Transactions use the same keys as SpendTotals. Each key gets a stable
+    import id, so a batch retried after a timeout is deduplicated by the
+    backend instead of being created twice. Synced keys are appended to
+    budget_sync.jsonl with the date, amount and payment status sent. Later
+    runs skip them unless one of those changed (a posted charge reconciled
+    under the same key, or a bill paid), in which case the transaction is
+    updated in place. Batches of up to
+    `batch_size` go out in one call each; retryable failures (rate limits,
+    5xx, network errors) back off exponentially with jitter, honouring
+    Retry-After, up to `max_retries` times.
+    """
+
+    def __init__(self, backend, filename=SYNC_FILE, batch_size=None, max_retries=5,
+                 backoff=1.0, max_backoff=60, category_ttl=3600):
+        self.backend = backend
+        self.filename = filename
+        self.batch_size = min(batch_size or backend.max_batch, backend.max_batch)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.categories = CategoryCache(backend, ttl=category_ttl)
+        self.lock = threading.Lock()
+        self.synced = {}  # key -> {'importId', 'date', 'cents', 'status'} as last sent
+        self.last = None
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.synced[entry['key']] = {
+                            'importId': entry['importId'],
+                            'date': entry.get('date'),
+                            'cents': entry.get('cents'),
+                            'status': entry.get('status'),
+                        }
+
+    @staticmethod
+    def import_id(key):
+        """Stable id for a transaction key, within YNAB's 36-character limit"""
+        return 'SPND:' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:31]
+
+    @staticmethod
+    def _sent(record):
+        return {'date': date.fromordinal(record.day).isoformat(), 'cents': record.cents, 'status': record.status}
+
+    def _persist(self, keys, categories=None):
+        """Append what was sent for keys; categories only for created transactions"""
+        synced_at = datetime.now().isoformat()
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            for key in keys:
+                entry = dict(self.synced[key], key=key, syncedAt=synced_at)
+                if categories is not None:
+                    entry['categoryId'] = categories.get(key)
+                f.write(json.dumps(entry) + '\n')
+
+    def _with_retry(self, call, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call(*args)
+            except BudgetBackendError as e:
+                if not e.retryable or attempt == self.max_retries:
+                    raise
+                delay = e.retry_after
+                if delay is None:
+                    delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1)
+                logger.warning(f"{self.backend.name}: {e}; retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def pending(self, keyed):
+        """(new, changed): the (key, Transaction) pairs never synced, and the
+        synced ones whose date, amount or payment status differ from what was sent"""
+        new, changed = [], []
+        for key, record in keyed:
+            sent = self.synced.get(key)
+            if sent is None:
+                new.append((key, record))
+            elif any(sent[field] != value for field, value in self._sent(record).items()):
+                changed.append((key, record))
+        return new, changed
+
+    def sync(self, keyed, category_for=None):
+        """Push (key, Transaction) pairs that are new or changed since they were synced.
+
+        category_for(key, record) may return a category name or id; it is
+        only used for new transactions. Returns run stats, including
+        throughput in transactions per second.
+        """
+        with self.lock:
+            started = time.perf_counter()
+            keyed = list(keyed)
+            todo, changed = self.pending(keyed)
+            stats = {
+                'backend': self.backend.name,
+                'requested': len(keyed),
+                'skipped': len(keyed) - len(todo) - len(changed),
+                'created': 0,
+                'updated': 0,
+                'duplicates': 0,
+                'uncategorized': 0,
+                'batches': 0,
+                'error': None,
+            }
+            try:
+                for i in range(0, len(todo), self.batch_size):
+                    batch = todo[i:i + self.batch_size]
+                    items, categories = [], {}
+                    for key, record in batch:
+                        category_id = self._with_retry(
+                            self.categories.resolve, category_for(key, record) if category_for else None
+                        )
+                        categories[key] = category_id
+                        stats['uncategorized'] += category_id is None
+                        items.append({
+                            'importId': self.import_id(key),
+                            'date': date.fromordinal(record.day).isoformat(),
+                            'cents': record.cents,
+                            'payee': record.name,
+                            'categoryId': category_id,
+                            'cleared': record.status == PAID,
+                        })
+                    duplicates = set(self._with_retry(self.backend.create_transactions, items))
+                    for (key, record), item in zip(batch, items):
+                        self.synced[key] = dict(self._sent(record), importId=item['importId'])
+                    self._persist([key for key, _ in batch], categories)
+                    stats['batches'] += 1
+                    stats['duplicates'] += len(duplicates)
+                    stats['created'] += len(batch) - len(duplicates)
+
+                for i in range(0, len(changed), self.batch_size):
+                    batch = changed[i:i + self.batch_size]
+                    self._with_retry(self.backend.update_transactions, [{
+                        'importId': self.synced[key]['importId'],
+                        'date': date.fromordinal(record.day).isoformat(),
+                        'cents': record.cents,
+                        'cleared': record.status == PAID,
+                    } for key, record in batch])
+                    for key, record in batch:
+                        self.synced[key] = dict(self.synced[key], **self._sent(record))
+                    self._persist([key for key, _ in batch])
+                    stats['batches'] += 1
+                    stats['updated'] += len(batch)
+            except BudgetBackendError as e:
+                logger.error(f"{self.backend.name}: sync stopped: {e}")
+                stats['error'] = str(e)
+
+            elapsed = time.perf_counter() - started
+            done = stats['created'] + stats['duplicates'] + stats['updated']
+            stats['seconds'] = round(elapsed, 3)
+            stats['perSecond'] = round(done / elapsed, 1) if elapsed > 0 else None
+            stats['finishedAt'] = datetime.now().isoformat()
+            self.last = stats
+        logger.info(
+            f"{self.backend.name}: synced {done} transactions ({stats['updated']} updated) in "
+            f"{stats['batches']} batches ({stats['perSecond']}/s), skipped {stats['skipped']}"
+        )
+        return stats
+
+    def status(self):
+        return {
+            'backend': self.backend.name,
+            'synced': len(self.synced),
+            'batchSize': self.batch_size,
+            'lastRun': self.last,
+        }
+
+
+def main():
+    """Compare one-call-per-transaction with batched sync against the stub"""
+    import sys
+    import tempfile
+    from records import Transaction
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+    transactions = [
+        (f"key-{i}", Transaction(739274 + i % 365, f"MERCHANT {i % 300}", 100 + i % 9000))
+        for i in range(count)
+    ]
+    category_for = lambda key, record: STUB_CATEGORIES[record.cents % len(STUB_CATEGORIES)]
+
+    print(f"{count} transactions, {latency * 1000:.0f} ms per backend call")
+    for label, batch_size in (('one by one', 1), ('batched', 100)):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = StubBackend(latency=latency)
+            sync = BudgetSync(backend, filename=os.path.join(tmp, SYNC_FILE), batch_size=batch_size)
+            stats = sync.sync(transactions, category_for)
+        print(f"{label:11} {stats['perSecond']:>9} tx/s   {backend.calls} calls   {stats['seconds']} s")
+
+
+if __name__ == "__main__":
+    main()
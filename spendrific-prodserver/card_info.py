@@ -0,0 +1,119 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+from normalize import parse_cents
+
+logger = logging.getLogger(__name__)
+
+CARD_INFO_FILE = 'card_info.json'
+CARD_RE = re.compile(r'(.*?)\s*\(...(\d{4})\)')
+BALANCE_RE = re.compile(r'Current balance\s*\$([0-9,.]+)')
+
+
+def parse_balance_cents(text):
+    """Current balance in cents from the card summary text, or None"""
+    balance_match = BALANCE_RE.search(text)
+    return parse_cents(balance_match.group(1)) if balance_match else None
+
+
+def parse_card_text(text):
+    """Extract card name, last four digits and balance from the card summary text"""
+    card_match = CARD_RE.search(text)
+    balance_cents = parse_balance_cents(text)
+    return {
+        'cardName': card_match.group(1) if card_match else "Unknown Card",
+        'lastFourDigits': card_match.group(2) if card_match else "0000",
+        'currentBalance': balance_cents / 100 if balance_cents is not None else 0.0,
+        'capturedAt': datetime.now().isoformat(),
+    }
+
+
+def save_card_info(record, filename=CARD_INFO_FILE):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(record, f)
+    os.replace(tmp, filename)
+
+
+class CardInfoCache:
+    """Serves the structured card record from memory with stale-while-revalidate.
+
+    Within `ttl` seconds of the last capture the record is served as fresh.
+    After that it is still served immediately, but marked stale, and one
+    background call to `refresh` (a Chase scrape) is started to replace it.
+    Refreshes are at least `min_interval` seconds apart, so reads never log
+    in to Chase more often than /fetch-transactions may. After a failed
+    refresh the interval doubles with each failure, up to `max_backoff`.
+    No refresh starts while `can_refresh()` is false (draining or shutting
+    down).
+    """
+
+    def __init__(self, refresh, ttl=900, filename=CARD_INFO_FILE, min_interval=360,
+                 max_backoff=4 * 3600, can_refresh=None):
+        self.refresh = refresh
+        self.ttl = ttl
+        self.filename = filename
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self.can_refresh = can_refresh
+        self.lock = threading.Lock()
+        self.record = None
+        self.mtime = None
+        self.fresh_at = None
+        self.refreshing = False
+        self.attempted_at = None
+        self.failures = 0
+
+    def _reload(self):
+        """Pick up a new file written by any scrape; one stat() when unchanged"""
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.mtime:
+            return
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            self.record = json.load(f)
+        self.mtime = mtime
+        captured = datetime.fromisoformat(self.record['capturedAt']).timestamp()
+        self.fresh_at = max(captured, self.fresh_at or 0)
+
+    def _revalidate(self):
+        try:
+            self.refresh()
+            with self.lock:
+                self.fresh_at = time.time()
+                self.failures = 0
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+            logger.error(f"Card info refresh failed ({self.failures} in a row): {e}")
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def _may_refresh(self, now):
+        if self.refreshing or (self.can_refresh and not self.can_refresh()):
+            return False
+        if self.attempted_at is None:
+            return True
+        interval = min(self.min_interval * 2 ** self.failures, max(self.max_backoff, self.min_interval))
+        return now - self.attempted_at >= interval
+
+    def get(self):
+        """Return (record, age in seconds, stale) or (None, None, True) if never captured"""
+        with self.lock:
+            self._reload()
+            now = time.time()
+            age = now - self.fresh_at if self.fresh_at else None
+            stale = age is None or age > self.ttl
+            if stale and self._may_refresh(now):
+                self.refreshing = True
+                self.attempted_at = now
+                threading.Thread(target=self._revalidate, name='card-info-refresh', daemon=True).start()
+            return self.record, age, stale
@@ -0,0 +1,311 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from collections import deque
+
+from normalize import format_cents
+
+RULES_FILE = 'category_rules.json'
+CHOICES_FILE = 'category_choices.jsonl'
+
+
+def merchant_key(name):
+    """Case- and whitespace-insensitive form of a merchant name"""
+    return ' '.join(name.upper().split())
+
+
+class RuleMatcher:
+    """All rules compiled for a single pass over a merchant name.
+
+    A rule is {'match', 'category'} plus optional 'priority' (higher wins)
+    and 'regex'. Plain rules match as case-insensitive substrings and are
+    compiled into one Aho-Corasick automaton, so a name is scanned once no
+    matter how many rules there are. Regex rules are joined into one
+    pattern, tried in rank order. When several rules match, the highest
+    priority wins, then the longest pattern, then the earliest rule.
+    """
+
+    def __init__(self, rules):
+        ranked = sorted(
+            range(len(rules)),
+            key=lambda i: (-rules[i].get('priority', 0), -len(rules[i]['match']), i)
+        )
+        self.categories = [rules[i]['category'] for i in ranked]
+        self.goto = [{}]
+        self.best = [None]  # state -> best rank ending here, including suffixes
+        regexes = []
+        for rank, i in enumerate(ranked):
+            if rules[i].get('regex'):
+                regexes.append(f"(?=.*?(?P<r{rank}>{rules[i]['match']}))")
+            else:
+                self._add(merchant_key(rules[i]['match']), rank)
+        self._link()
+        self.regex = None
+        if regexes:
+            # The rule's own group closes last, so lastgroup names it even
+            # when the rule has groups of its own
+            try:
+                self.regex = re.compile('^(?:' + '|'.join(regexes) + ')', re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"Regex rules do not combine (duplicate group names?): {e}")
+
+    def _add(self, pattern, rank):
+        state = 0
+        for char in pattern:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = self.goto[state][char] = len(self.goto)
+                self.goto.append({})
+                self.best.append(None)
+            state = nxt
+        if self.best[state] is None or rank < self.best[state]:
+            self.best[state] = rank
+
+    def _link(self):
+        """Breadth-first failure links; each state inherits its suffixes' best rank"""
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and char not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(char, 0)
+                inherited = self.best[self.fail[nxt]]
+                if inherited is not None and (self.best[nxt] is None or inherited < self.best[nxt]):
+                    self.best[nxt] = inherited
+
+    def match(self, key):
+        """Category of the best rule matching a merchant_key(), or None"""
+        goto, fail, best = self.goto, self.fail, self.best
+        found = None
+        state = 0
+        for char in key:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            rank = best[state]
+            if rank is not None and (found is None or rank < found):
+                found = rank
+        if self.regex is not None:
+            m = self.regex.match(key)
+            if m and (found is None or int(m.lastgroup[1:]) < found):
+                found = int(m.lastgroup[1:])
+        return None if found is None else self.categories[found]
+
+
+def _validate(rules):
+    if not isinstance(rules, list):
+        raise ValueError("rules must be a list")
+    for rule in rules:
+        if not isinstance(rule, dict) or not rule.get('match') or not rule.get('category'):
+            raise ValueError(f"Each rule needs 'match' and 'category': {rule}")
+        if not isinstance(rule.get('priority', 0), int):
+            raise ValueError(f"Rule priority must be an integer: {rule}")
+        if rule.get('regex'):
+            try:
+                re.compile(rule['match'])
+            except re.error as e:
+                raise ValueError(f"Invalid regex {rule['match']!r}: {e}")
+    return rules
+
+
+class Categorizer:
+    """Assigns budget categories to transactions by merchant name.
+
+    A category the user picked for a merchant (learn()) beats any rule.
+    Results are memoized per merchant, so after the first transaction from
+    a merchant the rest are a dictionary lookup. Rules live in
+    category_rules.json and choices are appended to category_choices.jsonl.
+    Attached to SpendTotals, it keeps per-category spend up to date as
+    transactions are ingested. With a MerchantIndex, merchants are canonical
+    merchant ids and rules see the canonical name, so "SQ *JOES CAFE AUSTIN
+    TX" and "JOES CAFE" share one memo entry and one user choice.
+    """
+
+    def __init__(self, rules_file=RULES_FILE, choices_file=CHOICES_FILE, merchants=None):
+        self.rules_file = rules_file
+        self.choices_file = choices_file
+        self.merchants = merchants
+        self.lock = threading.Lock()
+        self.rules = []
+        self.choices = {}   # merchant -> category
+        self.memo = {}      # merchant -> category or None
+        self.records = {}   # record key -> (merchant, cents)
+        self.totals = {}    # category -> [cents, count]
+        if os.path.exists(rules_file):
+            with open(rules_file, 'r', encoding='utf-8') as f:
+                self.rules = _validate(json.load(f))
+        if os.path.exists(choices_file):
+            with open(choices_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.choices[self._merchant(entry['merchant'])] = entry['category']
+        self.matcher = RuleMatcher(self.rules)
+
+    @classmethod
+    def from_totals(cls, spend_totals, **kwargs):
+        """Categorize the existing history and follow future updates to spend_totals"""
+        categorizer = cls(merchants=spend_totals.merchants, **kwargs)
+        with spend_totals.lock:
+            categorizer.extend(spend_totals.records.items())
+            spend_totals.subscribers.append(categorizer.update)
+        return categorizer
+
+    def _merchant(self, name):
+        """Canonical merchant id, or the merchant_key() without an index"""
+        return self.merchants.canonical(name) if self.merchants else merchant_key(name)
+
+    def _label(self, merchant):
+        return self.merchants.name(merchant) if self.merchants else merchant
+
+    def _category(self, merchant):
+        try:
+            return self.memo[merchant]
+        except KeyError:
+            category = self.choices.get(merchant) or self.matcher.match(merchant_key(self._label(merchant)))
+            self.memo[merchant] = category
+            return category
+
+    def category(self, name):
+        """Category for a merchant name, or None if no rule or choice covers it"""
+        merchant = self._merchant(name)
+        with self.lock:
+            return self._category(merchant)
+
+    def categorize_many(self, names):
+        """Categories for many merchant names, each distinct merchant matched once"""
+        merchants = [self._merchant(name) for name in names]
+        with self.lock:
+            return [self._category(merchant) for merchant in merchants]
+
+    def _bump(self, category, cents, count):
+        total = self.totals.setdefault(category, [0, 0])
+        total[0] += cents
+        total[1] += count
+        if total[1] == 0:
+            del self.totals[category]
+
+    def _assign(self, key, merchant, cents):
+        previous = self.records.get(key)
+        if previous is not None:
+            self._bump(self._category(previous[0]), -previous[1], -1)
+        self.records[key] = (merchant, cents)
+        self._bump(self._category(merchant), cents, 1)
+
+    def extend(self, items):
+        """Categorize (key, Transaction) pairs in one batch"""
+        items = [(key, self._merchant(record.name), record.cents) for key, record in items]
+        with self.lock:
+            for key, merchant, cents in items:
+                self._assign(key, merchant, cents)
+
+    def update(self, key, record):
+        """Categorize a single new or changed record (SpendTotals subscriber hook)"""
+        merchant = self._merchant(record.name)
+        with self.lock:
+            self._assign(key, merchant, record.cents)
+
+    def _recount(self):
+        self.memo = {}
+        self.totals = {}
+        for merchant, cents in self.records.values():
+            self._bump(self._category(merchant), cents, 1)
+
+    def set_rules(self, rules):
+        """Replace all rules, save them and recategorize the history"""
+        rules = _validate(rules)
+        matcher = RuleMatcher(rules)
+        tmp = self.rules_file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(rules, f, indent=2)
+        os.replace(tmp, self.rules_file)
+        with self.lock:
+            self.rules = rules
+            self.matcher = matcher
+            self._recount()
+        return len(rules)
+
+    def learn(self, name, category):
+        """Remember the user's category for a merchant; it beats every rule"""
+        if not merchant_key(name) or not category:
+            raise ValueError("Both a merchant name and a category are required")
+        merchant = self._merchant(name)
+        with open(self.choices_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'merchant': self._label(merchant), 'category': category}) + '\n')
+        with self.lock:
+            self.choices[merchant] = category
+            if self.memo.get(merchant) != category:
+                self._recount()
+        return self._label(merchant)
+
+    def summary(self):
+        with self.lock:
+            totals = sorted(self.totals.items(), key=lambda item: -item[1][0])
+            return {
+                'rules': len(self.rules),
+                'choices': len(self.choices),
+                'merchants': len(self.memo),
+                'categories': [
+                    {'category': category, 'amount': format_cents(cents), 'cents': cents, 'count': count}
+                    for category, (cents, count) in totals
+                ],
+            }
+
+
+def main():
+    """Benchmark the compiled matcher against a rule-by-rule scan"""
+    import sys
+    from records import Transaction
+
+    rule_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    tx_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    rng = random.Random(0)
+    words = [''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rng.randint(4, 9))) for _ in range(5000)]
+    rules = [
+        {'match': f"{rng.choice(words)} {rng.choice(words)}", 'category': f"Category {i % 40}"}
+        for i in range(rule_count)
+    ]
+    rules += [{'match': r'^SQ \*', 'category': 'Square', 'regex': True}, {'match': r'#\d{4,}', 'category': 'Chain', 'regex': True}]
+    names = [
+        f"{'SQ *' if i % 9 == 0 else ''}{rules[i % rule_count]['match'] if i % 3 else rng.choice(words)} #{rng.randint(1, 99999)}"
+        for i in range(tx_count // 10)
+    ]
+    items = [(str(i), Transaction(739274 + i % 365, rng.choice(names), 100 + i % 9000)) for i in range(tx_count)]
+
+    started = time.perf_counter()
+    matcher = RuleMatcher(_validate(rules))
+    print(f"Compiled {len(rules):,} rules into {len(matcher.goto):,} states in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ('cold', 'memoized'):
+            if label == 'cold':
+                categorizer = Categorizer(os.path.join(tmp, RULES_FILE), os.path.join(tmp, CHOICES_FILE))
+                categorizer.set_rules(rules)
+            started = time.perf_counter()
+            categorizer.extend(items)
+            elapsed = time.perf_counter() - started
+            print(f"{label:9} {tx_count:,} transactions in {elapsed * 1000:7.1f} ms ({tx_count / elapsed:,.0f} tx/s)")
+
+    sample = [merchant_key(name) for name in names[:200]]
+    literals = [(merchant_key(r['match']), r['category']) for r in rules if not r.get('regex')]
+    started = time.perf_counter()
+    for key in sample:
+        next((category for pattern, category in literals if pattern in key), None)
+    naive = (time.perf_counter() - started) / len(sample)
+    started = time.perf_counter()
+    for key in sample:
+        matcher.match(key)
+    compiled = (time.perf_counter() - started) / len(sample)
+    print(f"per name: rule-by-rule {naive * 1e6:,.0f} us, compiled {compiled * 1e6:,.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,21 +6,35 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from webdriver_manager.chrome import ChromeDriverManager
 import csv
-from datetime import datetime
 import os
 from dotenv import load_dotenv
-import time
 import platform
 import sys
+from totals import SpendTotals
+from records import PENDING, POSTED, from_dicts
+from merchants import MerchantIndex
+from reconcile import Reconciler
+from scrape_state import ScrapeState
+from card_info import CARD_INFO_FILE, parse_balance_cents, parse_card_text, save_card_info
+from balance_history import BalanceHistory
+from deadline import Deadline
+from profiles import CHASE_PROFILE_DIR
 
-# Define the profile directory path
-CHROME_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chrome_profile")
+# Golden profile directory, cloned per session (see profiles.py)
+CHROME_PROFILE_DIR = CHASE_PROFILE_DIR
+
+# Activity table id prefixes; posted rows use the same layout as pending ones
+PENDING_TABLE = 'PENDING-dataTableId'
+POSTED_TABLE = 'POSTED-dataTableId'
 
 class Browser:
-    def __init__(self):
+    def __init__(self, deadline=None, profile_dir=CHROME_PROFILE_DIR):
+        # Overall time budget shared by every wait; unbounded by default
+        self.deadline = deadline or Deadline(kind='chase')
+        self.deadline.step('launch')
         options = Options()
         # Use specific profile directory
-        options.add_argument(f"--user-data-dir={CHROME_PROFILE_DIR}")
+        options.add_argument(f"--user-data-dir={profile_dir}")
         options.add_argument("--page-load-strategy=eager")  # Don't wait for all resources
         
         # Add Windows-specific options
@@ -34,6 +48,7 @@ class Browser:
             driver_path = driver_manager.install()
             service = Service(executable_path=driver_path)
             self.driver = webdriver.Chrome(service=service, options=options)
+            self.deadline.on_cancel.append(self.close)
         except Exception as e:
             print(f"Error initializing Chrome WebDriver: {str(e)}")
             print(f"Python Version: {sys.version}")
@@ -49,12 +64,25 @@ class Browser:
         self.password = os.getenv('CHASE_PASSWORD')
         if not self.username or not self.password:
             raise ValueError("CHASE_USERNAME and CHASE_PASSWORD must be set in .env file")
+        
+        # Content hashes from the last saved scrape, to skip unchanged pages
+        self.scrape_state = ScrapeState()
+        self.activity_digest = None
+
+    def _wait(self, timeout):
+        """WebDriverWait bounded by what is left of the deadline"""
+        return WebDriverWait(self.driver, self.deadline.timeout(timeout))
+
+    def _get(self, url):
+        self.driver.set_page_load_timeout(self.deadline.timeout(300))
+        self.driver.get(url)
 
     def login(self):
         """Log into Chase account"""
+        self.deadline.step('login')
         try:
             print("Waiting for login page to load...")
-            time.sleep(5)  # Give page time to fully load
+            self.deadline.sleep(5)  # Give page time to fully load
             
             # Switch to the login iframe
             print("\nSwitching to login iframe...")
@@ -62,7 +90,7 @@ class Browser:
             
             # Handle password field directly by ID
             print("\nLooking for password field...")
-            password_field = WebDriverWait(self.driver, 10).until(
+            password_field = self._wait(10).until(
                 EC.presence_of_element_located((By.ID, "password"))
             )
             
@@ -72,7 +100,7 @@ class Browser:
             
             # Handle sign in button
             print("\nLooking for sign in button...")
-            sign_in_button = WebDriverWait(self.driver, 10).until(
+            sign_in_button = self._wait(10).until(
                 EC.element_to_be_clickable((By.ID, "signin-button"))
             )
             
@@ -84,7 +112,7 @@ class Browser:
             
             print("\nWaiting for login to complete...")
             # Wait for redirect to dashboard
-            WebDriverWait(self.driver, 20).until(
+            self._wait(20).until(
                 lambda driver: "secure.chase.com/web/auth/dashboard" in driver.current_url
             )
             print("Login successful!")
@@ -103,14 +131,15 @@ class Browser:
 
     def get_card_info(self):
         """Get and store card name and last digits"""
+        self.deadline.step('card_info')
         try:
             print("\nGetting card information...")
             # Wait for dashboard to load
-            time.sleep(5)
+            self.deadline.sleep(5)
             
             # Find the container element first
             print("Looking for card info container...")
-            container = WebDriverWait(self.driver, 10).until(
+            container = self._wait(10).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, ".mds-mt-6"))
             )
             
@@ -118,10 +147,20 @@ class Browser:
             card_info = container.text
             print(f"Found container text: {card_info}")
             
-            # Save to file
-            with open('cardInfo', 'w', encoding='utf-8') as f:
-                f.write(card_info)
-            print(f"Card information saved to cardInfo file")
+            # Every observed balance goes into the time series, changed or not
+            balance_cents = parse_balance_cents(card_info)
+            if balance_cents is not None:
+                BalanceHistory().append(balance_cents)
+            
+            changed, digest = self.scrape_state.check('cardInfo', card_info)
+            if not changed:
+                print("Card information unchanged since last run, skipping save")
+                return
+            
+            # Parse once here and save the structured, timestamped record
+            save_card_info(parse_card_text(card_info))
+            self.scrape_state.commit('cardInfo', digest)
+            print(f"Card information saved to {CARD_INFO_FILE}")
             
         except Exception as e:
             print(f"Error getting card information: {e}")
@@ -131,42 +170,44 @@ class Browser:
 
     def open(self, url="https://secure.chase.com"):
         """Open Chase website and handle initial loading"""
-        self.driver.get(url)
+        self.deadline.step('open')
+        self._get(url)
         print("Loaded initial page, waiting 5 seconds...")
-        time.sleep(5)  # Delay for page to stabilize
+        self.deadline.sleep(5)  # Delay for page to stabilize
         self.login()
-        time.sleep(5)
+        self.deadline.sleep(5)
         self.get_card_info()  # Get card info after login
         print("Navigating to transactions page...")
         self.navigate_to_transactions()
         print("Waiting for page to load...")
-        time.sleep(3)  # Give transactions page time to load
+        self.deadline.sleep(3)  # Give transactions page time to load
 
     def navigate_to_transactions(self):
+        self.deadline.step('navigate')
         # Direct URL to transactions page
         transactions_url = "https://secure.chase.com/web/auth/dashboard#/dashboard/transactions/1124076097/CARD/BAC"
         print("\nNavigating to transactions page...")
-        self.driver.get(transactions_url)
+        self._get(transactions_url)
         
         # Wait and verify we're on the transactions page
         try:
             print("Waiting for transactions page to load...")
-            WebDriverWait(self.driver, 10).until(
+            self._wait(10).until(
                 lambda driver: "transactions" in driver.current_url
             )
             
             # Double check we're on the right page
             if "transactions" not in self.driver.current_url:
                 print("Not on transactions page, retrying navigation...")
-                time.sleep(2)  # Brief pause before retry
-                self.driver.get(transactions_url)
-                WebDriverWait(self.driver, 10).until(
+                self.deadline.sleep(2)  # Brief pause before retry
+                self._get(transactions_url)
+                self._wait(10).until(
                     lambda driver: "transactions" in driver.current_url
                 )
             
             # Wait for transactions table to load
             print("Waiting for transactions table...")
-            WebDriverWait(self.driver, 10).until(
+            self._wait(10).until(
                 EC.presence_of_element_located((By.CLASS_NAME, "mds-activity-table__row"))
             )
             print("Successfully loaded transactions page")
@@ -177,70 +218,85 @@ class Browser:
             self.driver.save_screenshot("navigation_error.png")
             raise
 
+    def activity_unchanged(self):
+        """Hash the activity tables; True if they match the last saved scrape"""
+        self.deadline.step('check_activity')
+        self._wait(10).until(
+            EC.presence_of_element_located((By.ID, f"{PENDING_TABLE}-mds-diy-data-table"))
+        )
+        text = self.driver.execute_script(
+            "return arguments[0].map(id => document.getElementById(id))"
+            ".filter(Boolean).map(table => table.innerText).join('\\n');",
+            [f"{PENDING_TABLE}-mds-diy-data-table", f"{POSTED_TABLE}-mds-diy-data-table"]
+        )
+        changed, self.activity_digest = self.scrape_state.check('activity', text)
+        if not changed:
+            print("Activity table unchanged since last run")
+        return not changed
+
+    def _read_rows(self, table, state, limit=10):
+        """Read up to `limit` rows of an activity table as transaction dicts"""
+        rows = []
+        for i in range(limit):
+            try:
+                # Get date from row header
+                date_element = self.driver.find_element(
+                    By.CSS_SELECTOR, 
+                    f"#{table}-row-header-row{i}-columnundefined .mds-activity-table__row-value--text"
+                )
+                
+                # Get description from column 1
+                name_element = self.driver.find_element(
+                    By.CSS_SELECTOR,
+                    f"#{table}-value-row{i}-column1 .mds-activity-table__row-value--text"
+                )
+                
+                # Get amount from column 2
+                amount_element = self.driver.find_element(
+                    By.CSS_SELECTOR,
+                    f"#{table}-value-row{i}-column2 .mds-activity-table__row-value--text"
+                )
+                
+                # Clean up merchant name by taking only the first instance before newline
+                merchant_name = name_element.text.split('\n')[0].strip()
+                
+                rows.append({
+                    'date': date_element.text,
+                    'name': merchant_name,
+                    'amount': amount_element.text,
+                    'state': state
+                })
+                
+            except:
+                break  # No more rows found
+        return rows
+
     def get_latest_transactions(self):
-        """Get latest transactions from the transactions page"""
+        """Get latest pending and posted transactions from the transactions page"""
+        self.deadline.step('extract')
         try:
             print("Looking for pending transactions table...")
             # Wait for the pending transactions table to load
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.ID, "PENDING-dataTableId-mds-diy-data-table"))
+            self._wait(10).until(
+                EC.presence_of_element_located((By.ID, f"{PENDING_TABLE}-mds-diy-data-table"))
             )
             
             print("Getting pending transactions...")
-            pending_transactions = []
-            
-            # Look for pending transactions rows
-            for i in range(10):  # Check first 10 possible pending transactions
-                try:
-                    # Get date from row header
-                    date_element = self.driver.find_element(
-                        By.CSS_SELECTOR, 
-                        f"#PENDING-dataTableId-row-header-row{i}-columnundefined .mds-activity-table__row-value--text"
-                    )
-                    
-                    # Get description from column 1
-                    name_element = self.driver.find_element(
-                        By.CSS_SELECTOR,
-                        f"#PENDING-dataTableId-value-row{i}-column1 .mds-activity-table__row-value--text"
-                    )
-                    
-                    # Get amount from column 2
-                    amount_element = self.driver.find_element(
-                        By.CSS_SELECTOR,
-                        f"#PENDING-dataTableId-value-row{i}-column2 .mds-activity-table__row-value--text"
-                    )
-                    
-                    # Clean up merchant name by taking only the first instance before newline
-                    merchant_name = name_element.text.split('\n')[0].strip()
-                    
-                    # Normalize date format
-                    date_str = date_element.text
-                    try:
-                        # Try parsing numerical format (MM/DD/YYYY)
-                        date_obj = datetime.strptime(date_str, '%m/%d/%Y')
-                    except ValueError:
-                        try:
-                            # Try parsing written format (MMM DD, YYYY)
-                            date_obj = datetime.strptime(date_str, '%b %d, %Y')
-                        except ValueError:
-                            print(f"Warning: Could not parse date format: {date_str}")
-                            date_obj = None
-                    
-                    # Format date consistently as "MMM DD, YYYY"
-                    formatted_date = date_obj.strftime('%b %d, %Y') if date_obj else date_str
-                    
-                    transaction = {
-                        'date': formatted_date,
-                        'name': merchant_name,
-                        'amount': amount_element.text
-                    }
-                    pending_transactions.append(transaction)
-                    
-                except:
-                    break  # No more pending transactions found
-                
+            pending_transactions = self._read_rows(PENDING_TABLE, PENDING)
             print(f"Found {len(pending_transactions)} pending transactions")
-            return pending_transactions
+            
+            # Posted rows let pending charges be reconciled once they settle;
+            # the table is read only if it is already on the page
+            posted_transactions = []
+            if self.driver.find_elements(By.ID, f"{POSTED_TABLE}-mds-diy-data-table"):
+                posted_transactions = self._read_rows(POSTED_TABLE, POSTED)
+                print(f"Found {len(posted_transactions)} posted transactions")
+            
+            # Normalize dates, amounts and merchant names into compact records in one pass
+            return from_dicts(
+                pending_transactions + posted_transactions,
+                on_invalid=lambda t: print(f"Warning: Could not parse transaction: {t}")
+            )
             
         except Exception as e:
             print(f"Error getting transactions: {e}")
@@ -249,7 +305,8 @@ class Browser:
             raise
 
     def save_to_csv(self, transactions, filename='chase_transactions.csv'):
-        """Save transactions to CSV file"""
+        """Save pending transactions to CSV file"""
+        transactions = [t for t in transactions if t.state == PENDING]
         print(f"\nSaving {len(transactions)} transactions to {filename}")
         
         with open(filename, 'w', newline='') as f:
@@ -257,19 +314,35 @@ class Browser:
             writer.writerow(['Date', 'Name', 'Amount'])  # Header row
             
             for t in transactions:
-                writer.writerow([t['date'], t['name'], t['amount']])
+                writer.writerow(t.to_row())
         
         print("Transactions saved successfully")
 
+    def commit_activity(self):
+        """Remember the hashed activity once its transactions are ingested.
+
+        Call only after the ingest succeeded, or a failed one would be
+        skipped as unchanged next time. Without a preceding
+        activity_unchanged() (e.g. the watcher) this clears the hash.
+        """
+        self.scrape_state.commit('activity', self.activity_digest)
+
     def close(self):
-        self.driver.quit()
+        try:
+            self.scrape_state.flush()
+        finally:
+            self.driver.quit()
 
 def main():
     browser = Browser()
     try:
         browser.open()
+        if browser.activity_unchanged():
+            return
         transactions = browser.get_latest_transactions()
         browser.save_to_csv(transactions)
+        SpendTotals(merchants=MerchantIndex(), reconciler=Reconciler()).ingest(transactions)
+        browser.commit_activity()
         
     finally:
         browser.close()
@@ -0,0 +1,192 @@
+import time
+import uuid
+import threading
+from collections import deque
+from datetime import datetime
+
+
+class DeadlineExceeded(Exception):
+    """The job ran out of its time budget"""
+
+    def __init__(self, deadline):
+        super().__init__(f"Deadline of {deadline.budget}s exceeded during {deadline.step_name or 'queue'}")
+        self.progress = deadline.report()
+
+
+class JobCancelled(Exception):
+    """The job was cancelled through the jobs API"""
+
+    def __init__(self, deadline):
+        super().__init__(f"Job {deadline.id} was cancelled during {deadline.step_name or 'queue'}")
+        self.progress = deadline.report()
+
+
+class JobRequeued(JobCancelled):
+    """The job was set aside by a server drain and runs again after the restart"""
+
+    def __init__(self, deadline):
+        Exception.__init__(self, f"Job {deadline.id} was set aside for the restart during {deadline.step_name or 'queue'}")
+        self.progress = deadline.report()
+
+
+class ServerDraining(Exception):
+    """The server is shutting down and starts no new browser jobs"""
+
+
+class DuplicateJob(Exception):
+    """A client-supplied job id is already in use by an active job"""
+
+
+class Deadline:
+    """One overall time budget for a browser job, passed down into every wait.
+
+    timeout(cap) gives a wait the smaller of its usual cap and the time left,
+    sleep() is cut short by the deadline or a cancel, and step() marks
+    progress and fails fast once the budget is gone. A budget of None never
+    expires, which is what the command-line scripts use.
+    """
+
+    def __init__(self, budget=None, kind='job', job_id=None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.budget = budget
+        self.started = time.monotonic()
+        self.started_at = datetime.now().isoformat()
+        self.expires = self.started + budget if budget is not None else None
+        self.state = 'queued'
+        self.step_name = None
+        self.completed = deque(maxlen=50)
+        self.cancelled = threading.Event()
+        self.requeued = False
+        self.on_cancel = []
+        self.on_step = []
+
+    def remaining(self):
+        if self.expires is None:
+            return float('inf')
+        return max(0.0, self.expires - time.monotonic())
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise self.cancelled_error()
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(self)
+
+    def step(self, name):
+        """Mark the start of a named step, failing fast if the job is over"""
+        self.check()
+        self.record(name)
+        for callback in self.on_step:
+            callback(name)
+
+    def record(self, name):
+        """Note a step reached elsewhere (e.g. in a worker) without checking"""
+        if self.step_name is not None:
+            self.completed.append(self.step_name)
+        self.state = 'running'
+        self.step_name = name
+
+    def timeout(self, cap):
+        """Seconds a wait may use: its own cap, bounded by the time left"""
+        self.check()
+        return min(cap, self.remaining())
+
+    def sleep(self, seconds):
+        if self.cancelled.wait(min(seconds, self.remaining())):
+            raise self.cancelled_error()
+        self.check()
+
+    def acquire(self, lock, poll=0.5):
+        """Wait for `lock` within the budget, giving up early if cancelled"""
+        while not lock.acquire(timeout=self.timeout(poll)):
+            pass
+
+    def cancel(self):
+        """Abort the job and release whatever it holds (e.g. its browser)"""
+        self.cancelled.set()
+        for callback in list(self.on_cancel):
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def requeue(self):
+        """Cancel the job so that its caller saves it for the next server process"""
+        self.requeued = True
+        self.cancel()
+
+    def cancelled_error(self):
+        return JobRequeued(self) if self.requeued else JobCancelled(self)
+
+    def report(self):
+        return {
+            'jobId': self.id,
+            'kind': self.kind,
+            'state': ('requeued' if self.requeued else 'cancelled') if self.cancelled.is_set() else self.state,
+            'budget': self.budget,
+            'elapsed': round(time.monotonic() - self.started, 1),
+            'startedAt': self.started_at,
+            'completedSteps': list(self.completed),
+            'step': self.step_name,
+        }
+
+
+class JobRegistry:
+    """Queued and running browser jobs, so they can be listed, cancelled and drained"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.jobs = {}
+        self.draining = False
+
+    def start(self, kind, budget, job_id=None):
+        deadline = Deadline(budget, kind, job_id)
+        with self.lock:
+            if self.draining:
+                raise ServerDraining("Server is restarting, try again shortly")
+            # A second job under the same id would replace the first in the
+            # registry, leaving it impossible to list, cancel or drain
+            if deadline.id in self.jobs:
+                raise DuplicateJob(f"Job {deadline.id} is already running")
+            self.jobs[deadline.id] = deadline
+        return deadline
+
+    def finish(self, deadline):
+        with self.lock:
+            self.jobs.pop(deadline.id, None)
+            self.changed.notify_all()
+
+    def drain(self, timeout, grace=60):
+        """Refuse new jobs and wait for the current ones to end.
+
+        Jobs that have not reached a browser yet are requeued at once;
+        running ones get `timeout` seconds to finish and are then requeued
+        too. Returns True if every job ended (finished or was handed back to
+        its caller for saving) within a further `grace` seconds.
+        """
+        with self.lock:
+            self.draining = True
+            queued = [d for d in self.jobs.values() if d.state == 'queued']
+        for deadline in queued:
+            deadline.requeue()
+        with self.lock:
+            if self.changed.wait_for(lambda: not self.jobs, timeout):
+                return True
+            running = list(self.jobs.values())
+        for deadline in running:
+            deadline.requeue()
+        with self.lock:
+            return self.changed.wait_for(lambda: not self.jobs, grace)
+
+    def cancel(self, job_id):
+        with self.lock:
+            deadline = self.jobs.get(job_id)
+        if deadline is None:
+            return None
+        deadline.cancel()
+        return deadline.report()
+
+    def list(self):
+        with self.lock:
+            return [deadline.report() for deadline in self.jobs.values()]
@@ -0,0 +1,127 @@
+import gzip
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.spendrific.columnar+json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+CACHE_SIZE = 32
+MIN_COMPRESS_BYTES = 512
+
+
+def columnar(payload):
+    """Turn a list of same-shaped dicts into {key: [values...]} so keys are sent once"""
+    if not isinstance(payload, list):
+        return payload
+    columns = {}
+    for row in payload:
+        for key in row:
+            columns.setdefault(key, [])
+    for row in payload:
+        for key, values in columns.items():
+            values.append(row.get(key))
+    return {'count': len(payload), 'columns': columns}
+
+
+def serialize(payload, fmt):
+    if fmt == MSGPACK_MIMETYPE:
+        return msgpack.packb(payload, use_bin_type=True)
+    if fmt == COLUMNAR_MIMETYPE:
+        payload = columnar(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def compress(body, coding):
+    if coding == 'br':
+        return brotli.compress(body, quality=5)
+    if coding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def negotiate(request):
+    """Pick (format, content coding) from the Accept and Accept-Encoding headers"""
+    offered = [JSON_MIMETYPE, COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        offered.append(MSGPACK_MIMETYPE)
+    fmt = request.accept_mimetypes.best_match(offered, default=JSON_MIMETYPE)
+    # best_match prefers the first offer on ties, so */* and plain JSON clients
+    # get JSON, and clients that take both codings equally get brotli. A
+    # coding with q=0 is never chosen.
+    codings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    coding = request.accept_encodings.best_match(codings, default='identity')
+    return fmt, coding
+
+
+class EncodedResponseCache:
+    """Encoded response bodies keyed by (resource, data version, format, coding).
+
+    A body is serialized and compressed once per version of the underlying
+    data; repeated refreshes from the app are served from memory.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def respond(self, request, resource, version, build):
+        """Return a Response for `resource`, calling build() only on a cache miss"""
+        fmt, coding = negotiate(request)
+        key = (resource, version, fmt, coding)
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+        if body is None:
+            body = serialize(build(), fmt)
+            if len(body) < MIN_COMPRESS_BYTES:
+                coding = 'identity'
+            body = compress(body, coding)
+            with self.lock:
+                self.entries[key] = (body, coding)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        else:
+            body, coding = body
+
+        response = Response(body, mimetype=fmt)
+        response.headers['Vary'] = 'Accept, Accept-Encoding'
+        if coding != 'identity':
+            response.headers['Content-Encoding'] = coding
+        return response
+
+
+def main():
+    """Compare payload size and encode time for 1,000 transactions"""
+    payload = [
+        {'Date': f'Jan {i % 28 + 1:02d}, 2025', 'Name': f'MERCHANT {i % 60}', 'Amount': f'${i % 9000 / 100:.2f}'}
+        for i in range(1000)
+    ]
+    formats = [JSON_MIMETYPE, COLUMNAR_MIMETYPE] + ([MSGPACK_MIMETYPE] if msgpack else [])
+    codings = ['identity', 'gzip'] + (['br'] if brotli else [])
+    for fmt in formats:
+        for coding in codings:
+            started = time.perf_counter()
+            for _ in range(20):
+                body = compress(serialize(payload, fmt), coding)
+            elapsed = (time.perf_counter() - started) / 20 * 1000
+            print(f"{fmt:45} {coding:9} {len(body):8,} bytes  {elapsed:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
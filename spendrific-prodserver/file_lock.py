@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def _try_lock(fd):
+    """Non-blocking exclusive lock on the first byte of fd; False if held elsewhere"""
+    if sys.platform == 'win32':
+        import msvcrt
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    import fcntl
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(fd):
+    if sys.platform == 'win32':
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(path, timeout=30, poll=0.05):
+    """Hold an exclusive lock on `path` across processes.
+
+    Browser workers and the server share state files, so a threading.Lock
+    is not enough. The OS drops the lock if its holder dies, so a crashed
+    worker never leaves the file locked. Raises LockTimeout after
+    `timeout` seconds.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + timeout
+        while not _try_lock(fd):
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"Timed out after {timeout}s waiting for {path}")
+            time.sleep(poll)
+        try:
+            yield
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
@@ -1,35 +1,71 @@
-from OpenSSL import crypto
 import os
+import sys
+import ipaddress
+from datetime import datetime, timedelta, timezone
 
-def generate_self_signed_cert():
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+
+def _write(path, data, mode=0o644):
+    # Replace atomically so a reloading server never reads a partial file
+    tmp = path + '.tmp'
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def generate_self_signed_cert(cert_dir=None, key_type='ec'):
+    """Write cert/server.key and cert/server.crt; returns (certfile, keyfile).
+
+    The key is ECDSA P-256 unless key_type is 'rsa': a smaller certificate
+    and a cheaper signature on every full handshake than RSA 2048.
+    """
     # Generate key
-    key = crypto.PKey()
-    key.generate_key(crypto.TYPE_RSA, 2048)
-    
+    if key_type == 'rsa':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        key = ec.generate_private_key(ec.SECP256R1())
+
     # Generate certificate
-    cert = crypto.X509()
-    cert.get_subject().CN = "localhost"
-    cert.set_serial_number(1000)
-    cert.gmtime_adj_notBefore(0)
-    cert.gmtime_adj_notAfter(365*24*60*60)  # Valid for one year
-    cert.set_issuer(cert.get_subject())
-    cert.set_pubkey(key)
-    cert.sign(key, 'sha256')
-    
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=365))  # Valid for one year
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName('localhost'),
+            x509.IPAddress(ipaddress.ip_address('127.0.0.1')),
+        ]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+
     # Create cert directory if it doesn't exist
-    cert_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cert')
+    cert_dir = cert_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cert')
     if not os.path.exists(cert_dir):
         os.makedirs(cert_dir)
-    
+
     # Save private key
-    with open(os.path.join(cert_dir, 'server.key'), 'wb') as f:
-        f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
-    
+    keyfile = os.path.join(cert_dir, 'server.key')
+    _write(keyfile, key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ), mode=0o600)
+
     # Save certificate
-    with open(os.path.join(cert_dir, 'server.crt'), 'wb') as f:
-        f.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
-    
-    print("Generated SSL certificate and key in 'cert' directory")
+    certfile = os.path.join(cert_dir, 'server.crt')
+    _write(certfile, cert.public_bytes(serialization.Encoding.PEM))
+
+    print(f"Generated {key_type.upper()} SSL certificate and key in {cert_dir}")
+    return certfile, keyfile
 
 if __name__ == '__main__':
-    generate_self_signed_cert() 
\ No newline at end of file
+    generate_self_signed_cert(key_type='rsa' if '--rsa' in sys.argv else 'ec')
@@ -0,0 +1,78 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = 'pending_jobs.json'
+
+
+class JobJournal:
+    """Browser jobs set aside by a drain, persisted for the next server process.
+
+    Entries are keyed (a payment key, or 'fetch' for the single Chase
+    scrape), so a job set aside twice is saved once. An entry is removed only
+    after its job has run to an outcome, so a crash during resume() leaves it
+    for the next start. Payments are safe to run again: the bill-pay
+    checkpoints make a resumed run check DATCU before paying.
+    """
+
+    def __init__(self, filename=JOURNAL_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def _save(self):
+        if not self.entries:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            return
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.filename)
+
+    def add(self, kind, key, **fields):
+        with self.lock:
+            entry = dict(fields, kind=kind, key=key, savedAt=datetime.now().isoformat())
+            self.entries[key] = entry
+            self._save()
+        logger.info(f"Saved {kind} job {key} for the next server process")
+        return entry
+
+    def remove(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self._save()
+
+    def pending(self):
+        with self.lock:
+            return [dict(entry) for entry in self.entries.values()]
+
+    def resume(self, handlers):
+        """Run every saved job through handlers[kind](entry), oldest first.
+
+        A handler that raises leaves its entry in place, except for kinds
+        with no handler, which are dropped.
+        """
+        resumed = 0
+        for entry in sorted(self.pending(), key=lambda e: e['savedAt']):
+            handler = handlers.get(entry['kind'])
+            if handler is None:
+                logger.warning(f"Dropping saved job of unknown kind {entry['kind']}")
+                self.remove(entry['key'])
+                continue
+            logger.info(f"Resuming saved {entry['kind']} job {entry['key']}")
+            try:
+                handler(entry)
+            except Exception as e:
+                logger.error(f"Resumed {entry['kind']} job {entry['key']} failed: {e}")
+                continue
+            self.remove(entry['key'])
+            resumed += 1
+        return resumed
@@ -0,0 +1,261 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import difflib
+import threading
+
+MERCHANTS_FILE = 'merchants.jsonl'
+
+# Payment processor prefixes: "SQ *JOES CAFE", "TST* TACO PLACE", "PAYPAL *SPOTIFY"
+PROCESSOR_PREFIX = re.compile(
+    r'^(?:SQ|TST|SP|PP|PAYPAL|PY|DD|DOORDASH|GOOGLE|IC|EB|WPY|BT|FS|CKE|SMK|LS|ZSL|PAR|SWA)\s?\*\s*'
+)
+# Order references after a '*': "AMAZON.COM*2K4AB1", "AMZN MKTP US*RT3"
+REFERENCE_SUFFIX = re.compile(r'\s*\*\s*[A-Z0-9]+$')
+# Store numbers: "#1234", "STORE 0542", and standalone runs of 3+ digits
+STORE_NUMBER = re.compile(r'#\s*\d+|\b(?:STORE|STR|NO\.?|UNIT)\s*#?\s*\d+\b|(?<!\S)\d{3,}(?!\S)')
+US_STATES = frozenset((
+    'AL AK AZ AR CA CO CT DE DC FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN MS MO MT NE NV NH NJ NM '
+    'NY NC ND OH OK OR PA RI SC SD TN TX UT VT VA WA WV WI WY'
+).split())
+
+# A known merchant absorbs a longer name only if at most this many words follow
+MAX_SUFFIX_WORDS = 2
+# ...and only if it is specific enough: this many words, or one long word.
+# "THE" or "HOME" would otherwise swallow unrelated merchants.
+MIN_PREFIX_WORDS = 2
+MIN_PREFIX_CHARS = 6
+FUZZY_RATIO = 0.9
+FUZZY_MIN_LENGTH = 5
+
+
+def _specific(words):
+    """True if a name of these words is long enough to stand for a merchant by prefix"""
+    return len(words) >= MIN_PREFIX_WORDS or (len(words) == 1 and len(words[0]) >= MIN_PREFIX_CHARS)
+
+
+def normalize_merchant(raw):
+    """Strip the noise card descriptors add around a merchant's name.
+
+    Uppercases and collapses whitespace, then drops processor prefixes
+    ("SQ *"), order references ("*2K4AB"), store numbers and a trailing
+    state code, with the word before it when enough words are left to
+    assume it is a city. Falls back to the uppercased name if nothing
+    would be left.
+    """
+    name = ' '.join(raw.split('\n')[0].upper().split())
+    text = PROCESSOR_PREFIX.sub('', name)
+    text = REFERENCE_SUFFIX.sub('', text)
+    text = STORE_NUMBER.sub(' ', text)
+    words = text.replace(' - ', ' ').split()
+    if len(words) > 1 and words[-1] in US_STATES:
+        words.pop()
+        if len(words) >= 3:
+            words.pop()
+    return ' '.join(words) or name
+
+
+class MerchantIndex:
+    """Interns scraped merchant names to canonical merchant ids.
+
+    A raw name is normalized, then matched against the known canonical names:
+    exactly, by a word-level prefix trie (a known merchant followed by up to
+    MAX_SUFFIX_WORDS extra words, typically a city), then fuzzily against
+    merchants that start with the same three letters. A name that is itself
+    the start of exactly one known merchant (it was first seen with a city
+    attached) joins it. Prefix matches in either direction need the shorter
+    name to be specific enough (MIN_PREFIX_WORDS words, or one word of
+    MIN_PREFIX_CHARS letters). Only a name that matches none of these
+    becomes a new merchant. Canonical names and ids never change.
+
+    Each raw name is resolved once; later lookups are a dictionary hit, so
+    this runs inline on every scrape. Resolutions are appended to
+    merchants.jsonl by flush().
+    """
+
+    def __init__(self, filename=MERCHANTS_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.names = []     # id -> canonical name
+        self.by_name = {}   # canonical name -> id
+        self.ids = {}       # raw name -> id
+        self.trie = {}      # word -> subtree; '' -> id of the name ending here
+        self.blocks = {}    # first three letters -> [id, ...] for fuzzy matching
+        self.aliases = []   # id -> number of raw names
+        self.unsaved = []
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if entry['id'] == len(self.names):
+                            self._add(entry['name'])
+                        elif entry['name'] != self.names[entry['id']]:
+                            self._rename(entry['id'], entry['name'])
+                        self.ids[sys.intern(entry['raw'])] = entry['id']
+                        self.aliases[entry['id']] += 1
+
+    def _add(self, name):
+        merchant_id = len(self.names)
+        self.names.append(name)
+        self.by_name[name] = merchant_id
+        self.aliases.append(0)
+        node = self.trie
+        for word in name.split():
+            node = node.setdefault(word, {})
+        node.setdefault('', merchant_id)
+        self.blocks.setdefault(name[:3], []).append(merchant_id)
+        return merchant_id
+
+    def _rename(self, merchant_id, name):
+        """Apply a rename recorded by an earlier version of the index"""
+        old = self.names[merchant_id]
+        self.blocks[old[:3]].remove(merchant_id)
+        self.blocks.setdefault(name[:3], []).append(merchant_id)
+        self.names[merchant_id] = name
+        self.by_name[name] = merchant_id
+        node = self.trie
+        for word in name.split():
+            node = node.setdefault(word, {})
+        node.setdefault('', merchant_id)
+
+    def _extension(self, words):
+        """Id of the only known name that is `words` plus a few more, if there is one"""
+        if not _specific(words):
+            return None
+        node = self.trie
+        for word in words:
+            node = node.get(word)
+            if node is None:
+                return None
+        found, level = set(), [node]
+        for _ in range(MAX_SUFFIX_WORDS):
+            level = [child for n in level for word, child in n.items() if word]
+            found.update(n[''] for n in level if '' in n)
+            if len(found) > 1:
+                return None
+        return found.pop() if found else None
+
+    def _prefix(self, words):
+        """Id of the longest known name that starts `words` and leaves few enough over"""
+        node, found = self.trie, None
+        for i, word in enumerate(words):
+            node = node.get(word)
+            if node is None:
+                break
+            if '' in node and len(words) - (i + 1) <= MAX_SUFFIX_WORDS and _specific(words[:i + 1]):
+                found = node['']
+        return found
+
+    def _fuzzy(self, name):
+        if len(name) < FUZZY_MIN_LENGTH:
+            return None
+        best, best_ratio = None, FUZZY_RATIO
+        matcher = difflib.SequenceMatcher(None, b=name)
+        for candidate in self.blocks.get(name[:3], ()):
+            matcher.set_seq1(self.names[candidate])
+            if matcher.real_quick_ratio() >= best_ratio and matcher.quick_ratio() >= best_ratio:
+                ratio = matcher.ratio()
+                if ratio >= best_ratio:
+                    best, best_ratio = candidate, ratio
+        return best
+
+    def _resolve(self, name):
+        merchant_id = self.by_name.get(name)
+        if merchant_id is None:
+            merchant_id = self._prefix(name.split())
+        if merchant_id is None:
+            merchant_id = self._extension(name.split())
+        if merchant_id is None:
+            merchant_id = self._fuzzy(name)
+        if merchant_id is None:
+            merchant_id = self._add(name)
+        return merchant_id
+
+    def canonical(self, raw):
+        """Canonical merchant id for a scraped name, adding one if needed"""
+        merchant_id = self.ids.get(raw)
+        if merchant_id is not None:
+            return merchant_id
+        with self.lock:
+            merchant_id = self.ids.get(raw)
+            if merchant_id is None:
+                merchant_id = self._resolve(normalize_merchant(raw))
+                self.ids[sys.intern(raw)] = merchant_id
+                self.aliases[merchant_id] += 1
+                self.unsaved.append(raw)
+            return merchant_id
+
+    def canonical_name(self, raw):
+        return self.names[self.canonical(raw)]
+
+    def name(self, merchant_id):
+        return self.names[merchant_id]
+
+    def flush(self):
+        """Append the raw names resolved since the last flush"""
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, []
+            if not unsaved:
+                return 0
+            with open(self.filename, 'a', encoding='utf-8') as f:
+                for raw in unsaved:
+                    merchant_id = self.ids[raw]
+                    f.write(json.dumps({'raw': raw, 'id': merchant_id, 'name': self.names[merchant_id]}) + '\n')
+            return len(unsaved)
+
+    def list(self, query=None):
+        """[{'id', 'name', 'aliases'}, ...], optionally only names containing query"""
+        query = normalize_merchant(query) if query else None
+        with self.lock:
+            return [
+                {'id': merchant_id, 'name': name, 'aliases': self.aliases[merchant_id]}
+                for merchant_id, name in enumerate(self.names)
+                if query is None or query in name
+            ]
+
+
+def main():
+    """Resolve a synthetic scrape of merchant name variants, cold then warm"""
+    import tempfile
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(0)
+    bases = [
+        ' '.join(''.join(rng.choice('ABCDEFGHIJKLMNOPRSTUW') for _ in range(rng.randint(3, 8)))
+                 for _ in range(rng.randint(1, 3)))
+        for _ in range(2000)
+    ]
+    cities = ['AUSTIN TX', 'SAN ANTONIO TX', 'ROUND ROCK TX', 'DALLAS TX', 'SEATTLE WA']
+
+    def variant(base):
+        roll = rng.random()
+        if roll < 0.3:
+            return f"{base} #{rng.randint(1, 9999)}"
+        if roll < 0.5:
+            return f"SQ *{base} {rng.choice(cities)}"
+        if roll < 0.7:
+            return f"{base} {rng.randint(100, 99999)} {rng.choice(cities)}"
+        return base
+
+    raw_names = [variant(rng.choice(bases)) for _ in range(count)]
+    with tempfile.TemporaryDirectory() as tmp:
+        index = MerchantIndex(os.path.join(tmp, MERCHANTS_FILE))
+        for label in ('cold', 'warm'):
+            started = time.perf_counter()
+            for raw in raw_names:
+                index.canonical(raw)
+            elapsed = time.perf_counter() - started
+            print(f"{label}: {count:,} names in {elapsed * 1000:7.1f} ms ({count / elapsed:,.0f} names/s)")
+        index.flush()
+        started = time.perf_counter()
+        reloaded = MerchantIndex(index.filename)
+        print(f"reload: {len(reloaded.ids):,} raw names in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(f"{len(set(raw_names)):,} distinct raw names -> {len(index.names):,} merchants ({len(bases):,} real)")
+
+
+if __name__ == "__main__":
+    main()
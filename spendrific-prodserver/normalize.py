@@ -0,0 +1,126 @@
+import re
+from datetime import datetime, date
+from functools import lru_cache
+
+DATE_FORMAT = '%b %d, %Y'
+
+# Amounts as they appear on Chase, in our CSV and from the iOS app:
+# "$1,234.56", "-$5.00", "$-5.00", "(5.00)", "−5.00", "12.5"
+AMOUNT_RE = re.compile(
+    r'^(?P<open>\()?(?P<sign>[-+−])?\$?(?P<sign2>[-+−])?'
+    r'(?P<whole>\d{1,3}(?:,\d{3})+|\d*)(?:\.(?P<frac>\d*))?(?P<close>\))?$'
+)
+
+# Date layouts mapped to strptime formats, checked by shape instead of by
+# attempting each format and catching ValueError
+DATE_PATTERNS = (
+    (re.compile(r'^[A-Za-z]{3} \d{1,2}, \d{4}$'), DATE_FORMAT),
+    (re.compile(r'^\d{1,2}/\d{1,2}/\d{4}$'), '%m/%d/%Y'),
+    (re.compile(r'^\d{4}-\d{2}-\d{2}$'), '%Y-%m-%d'),
+    (re.compile(r'^[A-Za-z]+ \d{1,2}, \d{4}$'), '%B %d, %Y'),
+)
+
+
+def _clean(value):
+    return str(value).strip().strip('"').strip()
+
+
+def parse_cents(text):
+    """Parse an amount string to integer cents, or None if it is not an amount.
+
+    Negatives and refunds may be written with a leading minus (before or after
+    the dollar sign) or in parentheses, but not both, and with one sign at
+    most. Extra decimal places are rounded half up.
+    """
+    match = AMOUNT_RE.match(_clean(text).replace(' ', ''))
+    if not match or bool(match['open']) != bool(match['close']):
+        return None
+    signs = bool(match['sign']) + bool(match['sign2'])
+    if signs > 1 or (signs and match['open']):
+        return None
+    whole, frac = match['whole'], match['frac'] or ''
+    if not whole and not frac:
+        return None
+    cents = int(whole.replace(',', '') or 0) * 100 + int(frac[:2].ljust(2, '0'))
+    if len(frac) > 2 and frac[2] >= '5':
+        cents += 1
+    negative = bool(match['open']) or (match['sign'] or match['sign2'] or '+') != '+'
+    return -cents if negative else cents
+
+
+def format_cents(cents, symbol=True):
+    """Format integer cents as '$1,234.56' (or '1234.56' for form entry)"""
+    sign = '-' if cents < 0 else ''
+    dollars, remainder = divmod(abs(cents), 100)
+    if not symbol:
+        return f"{sign}{dollars}.{remainder:02d}"
+    return f"{sign}${dollars:,}.{remainder:02d}"
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text):
+    """Return the date ordinal for a date string in any known layout, or None"""
+    text = _clean(text)
+    for pattern, fmt in DATE_PATTERNS:
+        if pattern.match(text):
+            try:
+                return datetime.strptime(text, fmt).toordinal()
+            except ValueError:
+                return None  # right shape, impossible date (e.g. Feb 30)
+    return None
+
+
+@lru_cache(maxsize=4096)
+def format_date(ordinal):
+    return date.fromordinal(ordinal).strftime(DATE_FORMAT)
+
+
+def _field(transaction, name):
+    """Read a field from either scraper ('date') or CSV ('Date') style dicts"""
+    value = transaction.get(name)
+    if value is None:
+        value = transaction.get(name.lower(), '')
+    return _clean(value)
+
+
+def normalize_transaction(transaction):
+    """Normalize one transaction dict to canonical date, name and amount.
+
+    Returns {'date', 'name', 'amount', 'day', 'cents'}; 'day' and 'cents' are
+    None when the date or amount could not be parsed, and the original text is
+    kept in 'date'/'amount' in that case.
+    """
+    date_str, amount_str = _field(transaction, 'Date'), _field(transaction, 'Amount')
+    day, cents = parse_date(date_str), parse_cents(amount_str)
+    return {
+        'date': format_date(day) if day is not None else date_str,
+        'name': _field(transaction, 'Name'),
+        'amount': format_cents(cents) if cents is not None else amount_str,
+        'day': day,
+        'cents': cents,
+    }
+
+
+
+def main():
+    """Check parse_cents against the amount spellings we accept and reject"""
+    accepted = {
+        '$1,234.56': 123456, '-$5.00': -500, '$-5.00': -500, '(5.00)': -500,
+        '($5.00)': -500, '−5.00': -500, '+5': 500, '12.5': 1250, '0.005': 1, '.99': 99,
+    }
+    rejected = ['', '$', '.', 'abc', '(5.00', '5.00)', '--5', '-+5', '-$-5', '(-5.00)', '($-5)', '+(5)', '1,23.00']
+    failures = 0
+    for text, cents in accepted.items():
+        if parse_cents(text) != cents:
+            print(f"FAIL {text!r}: {parse_cents(text)} != {cents}")
+            failures += 1
+    for text in rejected:
+        if parse_cents(text) is not None:
+            print(f"FAIL {text!r}: {parse_cents(text)}, expected None")
+            failures += 1
+    print(f"{len(accepted) + len(rejected) - failures}/{len(accepted) + len(rejected)} amounts parsed as expected")
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
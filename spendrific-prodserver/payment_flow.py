@@ -0,0 +1,229 @@
+import os
+import json
+import logging
+import threading
+from datetime import date, datetime
+
+from normalize import format_cents
+from payments import PaymentUncertainError
+from deadline import DeadlineExceeded, JobCancelled
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = 'bill_pay_checkpoints.json'
+
+# Steps in order. A failure before 'submit' is safe to retry from the bill pay
+# page in the same session; from 'submit' on the payment may have gone
+# through, so DATCU is checked before anything is retried.
+STEPS = ('login', 'navigate', 'enter_amount', 'review', 'submit', 'confirm')
+UNSAFE_FROM = STEPS.index('submit')
+# Last completed steps after which a lost run may already have paid
+UNSAFE_STEPS = STEPS[UNSAFE_FROM - 1:]
+DONE = 'done'
+
+
+class BillPayCheckpoints:
+    """Last completed step of each bill-pay run, persisted by payment key"""
+
+    def __init__(self, filename=CHECKPOINT_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.mtime = None
+        self._reload()
+
+    def _reload(self):
+        """Pick up checkpoints written by another process (a browser worker)"""
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self.mtime:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                self.runs = json.load(f)
+            self.mtime = mtime
+
+    def _save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.runs, f)
+        os.replace(tmp, self.filename)
+        self.mtime = os.stat(self.filename).st_mtime_ns
+
+    def get(self, key):
+        with self.lock:
+            self._reload()
+            run = self.runs.get(key)
+            return dict(run) if run else None
+
+    def save(self, key, **changes):
+        with self.lock:
+            self._reload()
+            run = dict(self.runs.get(key) or {}, **changes, updatedAt=datetime.now().isoformat())
+            self.runs[key] = run
+            self._save()
+            return dict(run)
+
+    def clear(self, key):
+        with self.lock:
+            self._reload()
+            if self.runs.pop(key, None) is not None:
+                self._save()
+
+
+class BillPayFlow:
+    """Runs a DATCU payment as checkpointed steps in one browser session.
+
+    Each completed step is recorded in the checkpoint file. A step that fails
+    before 'submit' is retried from the bill pay page without logging in
+    again. A failure at 'submit' or 'confirm' first looks for the payment on
+    the confirmation screen and in the bill pay history, compared with the
+    count for the same date seen before submitting: if it is there the run
+    is finished, if it is not the form is filled in again, and if it cannot
+    be checked (or the history could not be read before submitting)
+    PaymentUncertainError is raised. A run resumed in a new session checks
+    the history only, since there is no confirmation screen to look at.
+    """
+
+    def __init__(self, bill_pay, cents, key, checkpoints, max_attempts=3):
+        self.bill_pay = bill_pay
+        self.cents = cents
+        self.key = key
+        self.checkpoints = checkpoints
+        self.max_attempts = max_attempts
+        self.on_bill_pay = False  # past the accounts page in this session
+
+    def _open_bill_pay(self):
+        """Go to the bill pay page: through the accounts page right after
+        logging in, directly once this session has been there"""
+        if self.on_bill_pay:
+            self.bill_pay.reopen_bill_pay()
+        else:
+            self.bill_pay.navigate_to_bill_pay()
+            self.on_bill_pay = True
+
+    def _record(self, **changes):
+        return self.checkpoints.save(self.key, cents=self.cents, **changes)
+
+    def _do(self, step, run):
+        bill_pay = self.bill_pay
+        if step == 'login':
+            self.on_bill_pay = False
+            bill_pay.login()
+        elif step == 'navigate':
+            self._open_bill_pay()
+            # Payments of this amount already listed, so a later check can
+            # tell whether this run added one. Best effort: without it the
+            # payment only becomes uncertain if submit or confirm fails.
+            day = date.today().isoformat()
+            try:
+                baseline = bill_pay.count_payments(self.cents, day)
+            except (DeadlineExceeded, JobCancelled):
+                raise
+            except Exception as e:
+                logger.warning(f"Bill pay {self.key}: could not read the payment history: {e}")
+                baseline = None
+            return {'baseline': baseline, 'baselineDate': day}
+        elif step == 'enter_amount':
+            bill_pay.enter_amount(format_cents(self.cents, symbol=False))
+        elif step == 'review':
+            bill_pay.continue_to_review()
+        elif step == 'submit':
+            bill_pay.submit_payment()
+        elif step == 'confirm':
+            bill_pay.confirm_payment()
+        return {}
+
+    def _session_alive(self):
+        try:
+            return self.bill_pay.is_logged_in()
+        except Exception:
+            return False
+
+    def _verify(self, run, resumed=False):
+        """True if the payment went through, False if not; raises if unknown.
+
+        After a failure in this session the confirmation screen is checked
+        first, if the session is still alive. A resumed run has just logged
+        in, so only the history can tell.
+        """
+        baseline = run.get('baseline')
+        if baseline is None:
+            raise PaymentUncertainError("No payment history baseline to verify against")
+        if not resumed and self._session_alive() and self.bill_pay.has_confirmation(self.cents):
+            return True
+        self._open_bill_pay()
+        # Payments are listed under the date they were made, so a run
+        # resumed on a later day still compares like with like
+        return self.bill_pay.count_payments(self.cents, run.get('baselineDate')) > baseline
+
+    def run(self):
+        run = self.checkpoints.get(self.key)
+        if run and run.get('step') == DONE:
+            return run
+        if run and run.get('cents') != self.cents:
+            raise ValueError(f"Checkpoint for {self.key} is for a different amount")
+        # A new browser session always logs in again. If an earlier session
+        # got as far as submitting, check DATCU before filling in the form.
+        unverified = bool(run and run.get('step') in UNSAFE_STEPS)
+        if run:
+            logger.info(f"Bill pay {self.key}: resuming after step {run.get('step')}")
+        run = run or self._record(step=None, attempts=0)
+        index = 0
+        attempts = 0
+
+        while index < len(STEPS):
+            step = STEPS[index]
+            try:
+                if unverified and step == 'navigate':
+                    if self._verify(run, resumed=True):
+                        logger.info(f"Bill pay {self.key}: earlier attempt was paid")
+                        break
+                    unverified = False
+                changes = self._do(step, run)
+                run = self._record(step=step, error=None, **changes)
+                index += 1
+                continue
+            except PaymentUncertainError:
+                raise
+            except (DeadlineExceeded, JobCancelled) as e:
+                # Out of time or cancelled: no retries, but say so if the
+                # payment may already have gone through
+                self._record(error=f"{step}: {e}")
+                if index >= UNSAFE_FROM or unverified:
+                    raise PaymentUncertainError(f"{e} after the payment may have been submitted") from e
+                raise
+            except Exception as e:
+                attempts += 1
+                run = self._record(error=f"{step}: {e}", attempts=run.get('attempts', 0) + 1)
+                logger.warning(f"Bill pay {self.key}: step {step} failed: {e}")
+                if index >= UNSAFE_FROM:
+                    try:
+                        paid = self._verify(run)
+                    except PaymentUncertainError:
+                        raise
+                    except Exception as verify_error:
+                        raise PaymentUncertainError(
+                            f"{step} failed ({e}) and the payment could not be verified: {verify_error}"
+                        ) from e
+                    if paid:
+                        logger.info(f"Bill pay {self.key}: payment found in DATCU history")
+                        break
+                    logger.info(f"Bill pay {self.key}: payment not found, filling in the form again")
+                if attempts >= self.max_attempts:
+                    if unverified:
+                        raise PaymentUncertainError(
+                            f"Could not check whether an earlier attempt was paid: {e}"
+                        ) from e
+                    raise
+                # Anything after login restarts from the bill pay page, which
+                # also resets the payment iframe, unless the session is gone.
+                # The session is past the accounts page, so the page is
+                # loaded directly.
+                if step != 'login' and self._session_alive():
+                    self.on_bill_pay = True
+                    index = STEPS.index('navigate')
+                else:
+                    index = 0
+
+        return self._record(step=DONE, error=None)
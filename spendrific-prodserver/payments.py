@@ -0,0 +1,441 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from normalize import format_cents
+from file_lock import file_lock
+from records import Transaction
+from deadline import JobRequeued, ServerDraining
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FILE = 'payment_ledger.jsonl'
+# Ledger size past which it is rewritten with one line per payment
+LEDGER_COMPACT_BYTES = 1 << 20
+BATCH_FILE = 'payment_batches.json'
+AUDIT_FILE = 'payment_audit.jsonl'
+
+IN_PROGRESS = 'in_progress'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+UNKNOWN = 'unknown'
+QUEUED = 'queued'
+
+
+class PaymentUncertainError(Exception):
+    """A bill-pay run failed after the payment may have been submitted"""
+
+
+def payment_fingerprint(records):
+    """Stable hash of the transactions in a payment request, order-independent"""
+    rows = sorted(f"{r.day}|{r.name}|{r.cents}" for r in records)
+    return hashlib.sha256('\n'.join(rows).encode('utf-8')).hexdigest()
+
+
+class PaymentLedger:
+    """Persisted record of bill-pay submissions keyed by idempotency key.
+
+    begin() decides what a request should do:
+      ('start', entry)    - no earlier attempt (or it failed); caller pays
+      ('replay', entry)   - already paid; answer from entry['response']
+      ('attach', entry)   - the same payment is running; wait() for it
+      ('queued', entry)   - waiting in an open payment batch, or set aside
+                            by a server drain to resume after the restart
+      ('conflict', entry) - key reused for different transactions
+      ('unknown', entry)  - a run was interrupted mid-payment (e.g. restart);
+                            it must be verified by hand before retrying
+
+    Every change is appended as a line. Once the file passes `compact_bytes`
+    (and twice its last compacted size) it is rewritten under the file lock
+    with only the latest line per key, so startup replays one line per
+    payment instead of every change ever made.
+    """
+
+    def __init__(self, filename=LEDGER_FILE, compact_bytes=LEDGER_COMPACT_BYTES):
+        self.filename = filename
+        self.compact_bytes = compact_bytes
+        self.lock = threading.Lock()
+        self.events = {}
+        self.entries = self._read()
+        self.size = os.path.getsize(filename) if os.path.exists(filename) else 0
+        self.compacted_size = 0
+        for entry in self.entries.values():
+            if entry['status'] == IN_PROGRESS:
+                entry['status'] = UNKNOWN
+
+    def reload(self):
+        """Pick up entries another process wrote, e.g. the server this one
+        replaced. Runs in progress elsewhere that never finished are unknown."""
+        with self.lock:
+            entries = self._read()
+            for key, entry in entries.items():
+                if entry['status'] == IN_PROGRESS and key not in self.events:
+                    entry['status'] = UNKNOWN
+            self.entries = entries
+
+    def _read(self):
+        """Latest entry per key as recorded in the file"""
+        entries = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries[entry['key']] = entry
+        return entries
+
+    def _write(self, entry):
+        with file_lock(self.filename + '.lock'):
+            with open(self.filename, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+                self.size = f.tell()
+            if self.size > max(self.compact_bytes, 2 * self.compacted_size):
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the file with only the latest line per key. Called with
+        the file lock held; the file is re-read rather than self.entries
+        written out, so lines appended by another process are kept."""
+        entries = self._read()
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for entry in entries.values():
+                f.write(json.dumps(entry) + '\n')
+            size = f.tell()
+        os.replace(tmp, self.filename)
+        logger.info(f"Compacted the payment ledger from {self.size:,} to {size:,} bytes ({len(entries)} payments)")
+        self.size = self.compacted_size = size
+
+    def begin(self, key, fingerprint, amount):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry['fingerprint'] != fingerprint:
+                    return 'conflict', entry
+                if entry['status'] == SUCCEEDED:
+                    return 'replay', entry
+                if entry['status'] == IN_PROGRESS:
+                    return 'attach', entry
+                if entry['status'] == QUEUED:
+                    return 'queued', entry
+                if entry['status'] == UNKNOWN:
+                    return 'unknown', entry
+            entry = {
+                'key': key,
+                'fingerprint': fingerprint,
+                'amount': amount,
+                'status': IN_PROGRESS,
+                'attempts': (entry['attempts'] + 1) if entry else 1,
+                'startedAt': datetime.now().isoformat(),
+                'completedAt': None,
+                'response': None,
+                'error': None,
+            }
+            self.entries[key] = entry
+            self.events[key] = threading.Event()
+            self._write(entry)
+            return 'start', entry
+
+    def _finish(self, key, **changes):
+        with self.lock:
+            entry = dict(self.entries[key], completedAt=datetime.now().isoformat(), **changes)
+            self.entries[key] = entry
+            self._write(entry)
+            event = self.events.pop(key, None)
+        if event:
+            event.set()
+        return entry
+
+    def update(self, key, **changes):
+        """Change an entry without finishing it (e.g. queued -> in progress)"""
+        with self.lock:
+            entry = dict(self.entries[key], **changes)
+            self.entries[key] = entry
+            self._write(entry)
+            return entry
+
+    def defer(self, key, **changes):
+        """A server drain set the run aside; it resumes in the next process"""
+        with self.lock:
+            entry = dict(self.entries[key], status=QUEUED, **changes)
+            self.entries[key] = entry
+            self._write(entry)
+            event = self.events.pop(key, None)
+        if event:
+            event.set()
+        return entry
+
+    def succeed(self, key, response):
+        return self._finish(key, status=SUCCEEDED, response=response)
+
+    def fail(self, key, error):
+        return self._finish(key, status=FAILED, error=error)
+
+    def mark_unknown(self, key, error):
+        """The run failed after the payment may have been submitted"""
+        return self._finish(key, status=UNKNOWN, error=error)
+
+    def resolve(self, key, paid):
+        """Settle an 'unknown' entry after checking DATCU by hand"""
+        if paid:
+            entry = self.get(key)
+            response = {
+                'status': 'success',
+                'message': 'Bill pay completed',
+                'amount': entry['amount'],
+                'paymentKey': key,
+            }
+            return self._finish(key, status=SUCCEEDED, response=response, error=None)
+        return self._finish(key, status=FAILED, error='Marked unpaid after manual check')
+
+    def wait(self, key, timeout):
+        """Block until an in-flight payment finishes; returns its entry"""
+        with self.lock:
+            event = self.events.get(key)
+        if event:
+            event.wait(timeout)
+        with self.lock:
+            return self.entries.get(key)
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+
+class PaymentBatcher:
+    """Coalesces approved /pay-bill requests into one DATCU payment.
+
+    Requests join the open batch (persisted in payment_batches.json, so a
+    restart picks it back up). The batch is submitted as a single payment
+    through one browser session when `window` seconds have passed since it
+    opened or its total reaches `threshold_cents`. Every transaction in it is
+    written to payment_audit.jsonl with the batch id and combined amount.
+
+    A batch being submitted is kept in payment_batches.json.submitting until
+    its outcome is in the ledger. One found there at startup (the server
+    stopped or was drained mid-payment) is submitted again before anything
+    else; its bill pay checkpoint, keyed by the batch id, makes that run
+    check DATCU first if the earlier one may have paid.
+    """
+
+    def __init__(self, ledger, submit, on_paid, window=3600, threshold_cents=None,
+                 filename=BATCH_FILE, audit_file=AUDIT_FILE):
+        self.ledger = ledger
+        self.submit = submit      # callable(total_cents, key), raises on failure
+        self.on_paid = on_paid    # callable([Transaction]) after a successful payment
+        self.window = window
+        self.threshold_cents = threshold_cents
+        self.filename = filename
+        self.submitting_file = filename + '.submitting'
+        self.audit_file = audit_file
+        self.lock = threading.Lock()
+        self.flush_now = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.batch = None
+        self.resume = None        # batch left mid-submission by an earlier run
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.batch = json.load(f)
+        if os.path.exists(self.submitting_file):
+            with open(self.submitting_file, 'r', encoding='utf-8') as f:
+                self.resume = json.load(f)
+            logger.warning(f"Payment batch {self.resume['id']} was left mid-submission; resuming it")
+            self.flush_now.set()
+
+    def _save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.batch, f)
+        os.replace(tmp, self.filename)
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='payment-batcher', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.flush_now.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def add(self, key, records):
+        """Queue a request's transactions; returns the batch id"""
+        cents = sum(r.cents for r in records)
+        with self.lock:
+            if self.batch is None:
+                self.batch = {
+                    'id': uuid.uuid4().hex[:12],
+                    'openedAt': time.time(),
+                    'totalCents': 0,
+                    'members': [],
+                }
+            self.batch['members'].append({
+                'key': key,
+                'cents': cents,
+                'transactions': [r.to_record() for r in records],
+            })
+            self.batch['totalCents'] += cents
+            self._save()
+            batch_id = self.batch['id']
+            full = self.threshold_cents is not None and self.batch['totalCents'] >= self.threshold_cents
+        self.ledger.update(key, status=QUEUED, batchId=batch_id)
+        if full:
+            self.flush_now.set()
+        return batch_id
+
+    def cancel(self, key):
+        """Take a queued request out of the open batch; False if it is not in it"""
+        with self.lock:
+            members = self.batch['members'] if self.batch else []
+            member = next((m for m in members if m['key'] == key), None)
+            if member is None:
+                return False
+            members.remove(member)
+            self.batch['totalCents'] -= member['cents']
+            if members:
+                self._save()
+            else:
+                self.batch = None
+                os.remove(self.filename)
+        self.ledger.fail(key, 'Cancelled before the batch was paid')
+        return True
+
+    def adjust(self, previous, record):
+        """Carry a queued transaction's posted amount and date into the open batch.
+
+        Returns the payment key whose amount changed, or None if the
+        transaction is not waiting in the open batch.
+        """
+        with self.lock:
+            found = next((
+                (member, i)
+                for member in (self.batch['members'] if self.batch else [])
+                for i, t in enumerate(member['transactions'])
+                if (t['day'], t['name'], t['cents']) == (previous.day, previous.name, previous.cents)
+            ), None)
+            if found is None:
+                return None
+            member, i = found
+            member['transactions'][i] = dict(
+                member['transactions'][i], day=record.day, name=record.name, cents=record.cents, state=record.state
+            )
+            delta = record.cents - previous.cents
+            member['cents'] += delta
+            self.batch['totalCents'] += delta
+            self._save()
+            key, cents = member['key'], member['cents']
+        self.ledger.update(key, amount=format_cents(cents))
+        logger.info(f"Payment {key} in batch adjusted to {format_cents(cents)}: {record.name} posted at {record.amount}")
+        return key
+
+    def status(self):
+        with self.lock:
+            if self.batch is None:
+                return {'open': False}
+            return {
+                'open': True,
+                'id': self.batch['id'],
+                'total': format_cents(self.batch['totalCents']),
+                'requests': len(self.batch['members']),
+                'closesAt': datetime.fromtimestamp(self.batch['openedAt'] + self.window).isoformat(),
+            }
+
+    def _audit(self, batch, submitted_at):
+        with open(self.audit_file, 'a', encoding='utf-8') as f:
+            for member in batch['members']:
+                for record in member['transactions']:
+                    t = Transaction.from_record(record)
+                    f.write(json.dumps({
+                        'batchId': batch['id'],
+                        'paymentKey': member['key'],
+                        'Date': t.date,
+                        'Name': t.name,
+                        'Amount': t.amount,
+                        'batchTotal': format_cents(batch['totalCents']),
+                        'submittedAt': submitted_at,
+                    }) + '\n')
+
+    def flush(self):
+        """Submit the batch left mid-submission, or else the open batch, if there is one"""
+        with self.lock:
+            if self.resume is not None:
+                batch, self.resume = self.resume, None
+            else:
+                batch, self.batch = self.batch, None
+                if batch is None:
+                    return None
+                # Keep the batch on disk until its outcome is in the ledger
+                with open(self.submitting_file, 'w', encoding='utf-8') as f:
+                    json.dump(batch, f)
+                os.remove(self.filename)
+
+        total = format_cents(batch['totalCents'])
+        keys = [member['key'] for member in batch['members']]
+        logger.info(f"Submitting payment batch {batch['id']}: {len(keys)} requests, {total}")
+        for key in keys:
+            self.ledger.update(key, status=IN_PROGRESS)
+        try:
+            self.submit(batch['totalCents'], batch['id'])
+        except (JobRequeued, ServerDraining):
+            self._set_aside(batch)
+            raise
+        except PaymentUncertainError as e:
+            for key in keys:
+                self.ledger.mark_unknown(key, str(e))
+            os.remove(self.submitting_file)
+            raise
+        except Exception as e:
+            for key in keys:
+                self.ledger.fail(key, str(e))
+            os.remove(self.submitting_file)
+            raise
+
+        submitted_at = datetime.now().isoformat()
+        self._audit(batch, submitted_at)
+        for member in batch['members']:
+            self.ledger.succeed(member['key'], {
+                'status': 'success',
+                'message': 'Bill pay completed',
+                'amount': format_cents(member['cents']),
+                'batchId': batch['id'],
+                'batchTotal': total,
+                'paymentKey': member['key'],
+            })
+        os.remove(self.submitting_file)
+        self.on_paid([
+            Transaction.from_record(record)
+            for member in batch['members'] for record in member['transactions']
+        ])
+        return batch['id']
+
+    def _set_aside(self, batch):
+        """Leave a batch the server drained in payment_batches.json.submitting,
+        so the next process submits it as it was; its checkpoint makes that
+        run check DATCU first"""
+        for member in batch['members']:
+            self.ledger.defer(member['key'], batchId=batch['id'])
+        logger.info(f"Payment batch {batch['id']} saved for after the restart")
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            with self.lock:
+                closes_at = self.batch['openedAt'] + self.window if self.batch else None
+            delay = closes_at - time.time() if closes_at else self.window
+            if delay > 0 and not self.flush_now.wait(delay):
+                continue
+            self.flush_now.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Payment batch failed: {e}")
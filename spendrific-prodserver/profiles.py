@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+import uuid
+import shutil
+import logging
+from contextlib import contextmanager
+
+from file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Golden profiles, seeded by logging in through open_browser.py
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHASE_PROFILE_DIR = os.path.join(BASE_DIR, "chrome_profile")
+DATCU_PROFILE_DIR = os.path.join(BASE_DIR, "chrome_profile_datcu")
+
+# Chrome's per-process locks; a clone must not inherit the golden profile's
+LOCK_FILES = {'SingletonLock', 'SingletonCookie', 'SingletonSocket', 'lockfile'}
+
+# Caches are large and rebuilt on demand, so clones start without them
+SKIP_DIRS = {
+    'Cache', 'Code Cache', 'GPUCache', 'ShaderCache', 'GrShaderCache', 'GraphiteDawnCache',
+    'DawnCache', 'CacheStorage', 'ScriptCache', 'Crashpad', 'BrowserMetrics', 'component_crx_cache',
+}
+
+# Session state copied back to the golden profile after a clean run. Chrome
+# has exited by then, so the cookie databases are complete without their
+# journals; a journal left next to a database from another session would be
+# replayed into it.
+SYNC_FILES = (
+    'Local State',
+    os.path.join('Default', 'Cookies'),
+    os.path.join('Default', 'Network', 'Cookies'),
+)
+JOURNAL_SUFFIXES = ('-journal', '-wal', '-shm')
+
+FICLONE = 0x40049409  # Linux ioctl: share the source file's extents (btrfs, XFS)
+
+
+def _reflink(src, dst):
+    """Copy-on-write clone of one file; False where the filesystem can't"""
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            return False
+    shutil.copystat(src, dst)
+    return True
+
+
+class ProfileManager:
+    """Ephemeral copies of a golden, logged-in Chrome profile.
+
+    Chrome locks a --user-data-dir to one process, so each concurrent
+    session gets its own clone under `clones_dir`. Files are reflinked
+    (copy-on-write) where the filesystem supports it and copied otherwise;
+    caches and lock files are left out. Hardlinks are not used because
+    Chrome rewrites its SQLite files in place, which would write through
+    to the golden profile. After a clean session the cookie stores and
+    Local State are copied back if any of them changed, all from that one
+    clone, under a lock file shared by every worker process, so refreshed
+    logins survive. Clones older than `stale_after` seconds are removed.
+    """
+
+    def __init__(self, golden_dir, clones_dir=None, stale_after=2 * 3600):
+        self.golden_dir = golden_dir
+        self.clones_dir = clones_dir or golden_dir + '_clones'
+        self.sync_lock_file = golden_dir + '.sync.lock'
+        self.stale_after = stale_after
+        self.reflink_ok = True
+
+    def _copy_file(self, src, dst):
+        if self.reflink_ok:
+            try:
+                if _reflink(src, dst):
+                    return
+            except OSError:
+                pass
+            self.reflink_ok = False
+        shutil.copy2(src, dst)
+
+    def clone(self):
+        """Create a fresh clone and return its directory"""
+        self.collect_garbage()
+        started = time.monotonic()
+        target = os.path.join(self.clones_dir, f"{int(time.time())}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(target)
+        for root, dirs, files in os.walk(self.golden_dir):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            relative = os.path.relpath(root, self.golden_dir)
+            destination = os.path.normpath(os.path.join(target, relative))
+            os.makedirs(destination, exist_ok=True)
+            for name in files:
+                if name in LOCK_FILES:
+                    continue
+                src = os.path.join(root, name)
+                if os.path.islink(src):
+                    continue
+                try:
+                    self._copy_file(src, os.path.join(destination, name))
+                except OSError as e:
+                    logger.warning(f"Profile clone: skipped {src}: {e}")
+        method = 'reflinked' if self.reflink_ok else 'copied'
+        logger.info(f"Cloned {self.golden_dir} ({method}) in {time.monotonic() - started:.2f}s")
+        return target
+
+    def sync_back(self, clone_dir):
+        """Copy the clone's cookie stores and Local State into the golden
+        profile if any of them is newer there; returns whether it did"""
+        if any(os.path.lexists(os.path.join(self.golden_dir, name)) for name in LOCK_FILES):
+            logger.info("Golden profile is open in Chrome, not syncing cookies back")
+            return False
+        with file_lock(self.sync_lock_file):
+            names = [name for name in SYNC_FILES if os.path.exists(os.path.join(clone_dir, name))]
+            changed = any(
+                not os.path.exists(os.path.join(self.golden_dir, name))
+                or os.stat(os.path.join(self.golden_dir, name)).st_mtime_ns
+                < os.stat(os.path.join(clone_dir, name)).st_mtime_ns
+                for name in names
+            )
+            if not changed:
+                return False
+            # Stage every file first so a failed copy leaves the golden
+            # profile untouched
+            staged = []
+            try:
+                for name in names:
+                    dst = os.path.join(self.golden_dir, name)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    tmp = f"{dst}.{os.getpid()}.sync"
+                    shutil.copy2(os.path.join(clone_dir, name), tmp)
+                    staged.append((tmp, dst))
+            except OSError:
+                for tmp, _ in staged:
+                    os.remove(tmp)
+                raise
+            for tmp, dst in staged:
+                for suffix in JOURNAL_SUFFIXES:
+                    if os.path.exists(dst + suffix):
+                        os.remove(dst + suffix)
+                os.replace(tmp, dst)
+        logger.info(f"Synced {len(names)} session files back to {self.golden_dir}")
+        return True
+
+    def remove(self, clone_dir):
+        shutil.rmtree(clone_dir, ignore_errors=True)
+
+    def collect_garbage(self):
+        """Remove clones left behind by crashed or killed sessions"""
+        if not os.path.isdir(self.clones_dir):
+            return 0
+        removed = 0
+        cutoff = time.time() - self.stale_after
+        for name in os.listdir(self.clones_dir):
+            path = os.path.join(self.clones_dir, name)
+            try:
+                created = int(name.split('-', 1)[0])
+            except ValueError:
+                continue
+            if created < cutoff:
+                self.remove(path)
+                removed += 1
+        return removed
+
+    @contextmanager
+    def session(self):
+        """Yield a clone directory; sync it back if the block succeeds, then delete it"""
+        clone_dir = self.clone()
+        try:
+            yield clone_dir
+            # The job itself succeeded; a failed sync only costs a login later
+            try:
+                self.sync_back(clone_dir)
+            except Exception as e:
+                logger.error(f"Profile sync back to {self.golden_dir} failed: {e}")
+        finally:
+            self.remove(clone_dir)
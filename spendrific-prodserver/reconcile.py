@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import bisect
+import random
+from datetime import datetime
+
+from normalize import format_cents, format_date
+from records import Transaction, PAID, PENDING, POSTED
+
+RECONCILE_FILE = 'reconcile_log.jsonl'
+
+
+class Reconciler:
+    """Links a posted charge to the pending record it settles.
+
+    Pending records are indexed per merchant by day, so finding candidates
+    for an incoming record is a bisect into one merchant's list rather than
+    a scan of the history. A posted record matches a pending one from the
+    same merchant dated up to `window_days` earlier whose amount is within
+    the tolerance: `tolerance_pct` percent of the pending amount or
+    `tolerance_cents`, whichever is larger, which covers tips. The closest
+    amount wins, then the closest date. Pending rows are never matched: the
+    scrape reads only the latest rows, so a pending row missing from it is
+    no evidence that its amount changed, and a similar new one may well be
+    a second purchase.
+
+    SpendTotals replaces the matched record under its existing key, so the
+    history key is the transaction's stable id from its first sighting.
+    Every match is appended to reconcile_log.jsonl, and `on_adjust(key,
+    previous, record)` is called when the amount changed; it returns what
+    it did about payments covering the old amount.
+    """
+
+    def __init__(self, window_days=4, tolerance_pct=25, tolerance_cents=500,
+                 filename=RECONCILE_FILE, on_adjust=None):
+        self.window_days = window_days
+        self.tolerance_pct = tolerance_pct
+        self.tolerance_cents = tolerance_cents
+        self.filename = filename
+        self.on_adjust = on_adjust
+        self.pending = {}   # merchant -> sorted [(day, key), ...] of pending records
+        self.aliases = {}   # scraped key of a matched row -> key of the record it settled
+        self.matched = 0
+        for entry in self._entries():
+            self.aliases[entry['scraped']] = entry['id']
+
+    def add(self, key, merchant, record):
+        if record.state == PENDING:
+            bisect.insort(self.pending.setdefault(merchant, []), (record.day, key))
+
+    def remove(self, key, merchant, record):
+        if record.state == PENDING:
+            days = self.pending[merchant]
+            del days[bisect.bisect_left(days, (record.day, key))]
+            if not days:
+                del self.pending[merchant]
+
+    def tolerance(self, cents):
+        return max(self.tolerance_cents, abs(cents) * self.tolerance_pct // 100)
+
+    def match(self, merchant, record, records, exclude=()):
+        """Key of the pending record that a posted `record` settles, or None.
+
+        `records` maps keys to Transactions; keys in `exclude` (rows present
+        in the same scrape) are never matched.
+        """
+        days = self.pending.get(merchant)
+        if not days or record.state != POSTED:
+            return None
+        lo = bisect.bisect_left(days, (record.day - self.window_days,))
+        hi = bisect.bisect_left(days, (record.day + 1,))
+        best, best_score = None, None
+        for day, key in days[lo:hi]:
+            if key in exclude:
+                continue
+            candidate = records[key]
+            difference = abs(record.cents - candidate.cents)
+            if difference > self.tolerance(candidate.cents):
+                continue
+            score = (difference, record.day - day)
+            if best_score is None or score < best_score:
+                best, best_score = key, score
+        return best
+
+    def _entries(self):
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def settle(self, matches):
+        """Log (scraped key, key, previous, record) matches and adjust payments
+        for changed amounts"""
+        if not matches:
+            return []
+        entries = []
+        for scraped, key, previous, record in matches:
+            delta = record.cents - previous.cents
+            payment = self.on_adjust(key, previous, record) if delta and self.on_adjust else None
+            entries.append({
+                'id': key,
+                'scraped': scraped,
+                'merchant': record.name,
+                'from': {'date': format_date(previous.day), 'cents': previous.cents, 'state': previous.state},
+                'to': {'date': format_date(record.day), 'cents': record.cents, 'state': record.state},
+                'deltaCents': delta,
+                'delta': format_cents(delta),
+                'paid': previous.status == PAID,
+                'payment': payment,
+                'reconciledAt': datetime.now().isoformat(),
+            })
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        self.matched += len(entries)
+        return entries
+
+    def summary(self, limit=100):
+        """The last `limit` matches, newest first, and the net amount charges
+        posted above what was already paid for them"""
+        entries = self._entries()
+        underpaid = sum(e['deltaCents'] for e in entries if e['paid'])
+        return {
+            'reconciled': entries[::-1][:limit],
+            'underpaid': format_cents(underpaid),
+            'underpaidCents': underpaid,
+        }
+
+
+def main():
+    """Reconcile a synthetic posted batch against a large pending history"""
+    import tempfile
+    from totals import SpendTotals
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(0)
+    merchants = [f"MERCHANT {i}" for i in range(2000)]
+    history = [Transaction(739000 + i * 365 // count, rng.choice(merchants), rng.randint(100, 20000)) for i in range(count)]
+    posted = [
+        Transaction(t.day + rng.randint(0, 3), t.name, t.cents + rng.choice((0, 0, t.cents // 5)), state=POSTED)
+        for t in rng.sample(history, 1000)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        reconciler = Reconciler(filename=os.path.join(tmp, RECONCILE_FILE))
+        totals = SpendTotals(os.path.join(tmp, 'history.jsonl'), reconciler=reconciler)
+        totals.ingest(history)
+        started = time.perf_counter()
+        added = totals.ingest(posted)
+        elapsed = time.perf_counter() - started
+        reconciled = reconciler.matched
+
+        # The same matching as a scan of every record, for comparison
+        records = list(totals.records.items())
+        started = time.perf_counter()
+        for record in posted[:50]:
+            next((key for key, r in records if r.state == PENDING and r.name == record.name
+                  and 0 <= record.day - r.day <= 4 and abs(record.cents - r.cents) <= max(500, r.cents // 4)), None)
+        scan = (time.perf_counter() - started) / 50
+
+    print(f"{len(posted):,} posted against {count:,} history: {reconciled:,} reconciled, {added:,} new "
+          f"in {elapsed * 1000:.1f} ms ({elapsed / len(posted) * 1e6:.1f} us each)")
+    print(f"pairwise scan: {scan * 1e6:,.0f} us per posted record")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import sys
+import time
+import tracemalloc
+
+from normalize import format_cents, format_date, normalize_transaction
+
+UNPAID = sys.intern('unpaid')
+PAID = sys.intern('paid')
+# Card states: a pending charge may post later with another amount or date
+PENDING = sys.intern('pending')
+POSTED = sys.intern('posted')
+
+
+class Transaction:
+    """A single card transaction.
+
+    Uses __slots__, an interned merchant name, integer cents and a date
+    ordinal, so a large history costs a fraction of the equivalent dicts
+    with repeated 'Date'/'Name'/'Amount' keys and string values.
+    """
+
+    __slots__ = ('day', 'name', 'cents', 'status', 'state')
+
+    def __init__(self, day, name, cents, status=UNPAID, state=PENDING):
+        self.day = day
+        self.name = sys.intern(name)
+        self.cents = cents
+        self.status = sys.intern(status)
+        self.state = sys.intern(state)
+
+    @classmethod
+    def from_dict(cls, transaction):
+        """Build from a scraper ('date') or CSV/API ('Date') style dict.
+
+        Returns None when the date or amount cannot be parsed.
+        """
+        t = normalize_transaction(transaction)
+        if t['day'] is None or t['cents'] is None:
+            return None
+        return cls(t['day'], t['name'], t['cents'], state=transaction.get('state') or PENDING)
+
+    @classmethod
+    def from_record(cls, record):
+        """Inverse of to_record, used when replaying the history file"""
+        return cls(
+            record['day'], record['name'], record['cents'],
+            record.get('status', UNPAID), record.get('state', PENDING)
+        )
+
+    @property
+    def date(self):
+        return format_date(self.day)
+
+    @property
+    def amount(self):
+        return format_cents(self.cents)
+
+    def to_dict(self):
+        """API/CSV representation, matching the keys the iOS app decodes"""
+        return {'Date': self.date, 'Name': self.name, 'Amount': self.amount}
+
+    def to_row(self):
+        return [self.date, self.name, self.amount]
+
+    def to_record(self):
+        return {'day': self.day, 'name': self.name, 'cents': self.cents, 'status': self.status, 'state': self.state}
+
+    def __eq__(self, other):
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return (self.day, self.name, self.cents, self.status, self.state) == \
+            (other.day, other.name, other.cents, other.status, other.state)
+
+    def __repr__(self):
+        return f"Transaction({self.date!r}, {self.name!r}, {self.amount!r}, {self.status!r}, {self.state!r})"
+
+
+def from_dicts(transactions, on_invalid=None):
+    """Convert a batch of dicts, passing unparseable ones to on_invalid"""
+    result = []
+    for t in transactions:
+        record = Transaction.from_dict(t)
+        if record is None:
+            if on_invalid:
+                on_invalid(t)
+            continue
+        result.append(record)
+    return result
+
+
+def main():
+    """Compare the memory footprint of 100k dict and Transaction records"""
+    count = 100_000
+    merchants = [f"MERCHANT {i} AUSTIN TX" for i in range(500)]
+
+    def measure(build):
+        tracemalloc.start()
+        started = time.perf_counter()
+        items = build()
+        elapsed = time.perf_counter() - started
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return items, size, elapsed
+
+    dicts, dict_bytes, dict_time = measure(lambda: [
+        {'Date': 'Jan 23, 2025', 'Name': ''.join(merchants[i % 500]), 'Amount': f"${i % 9000 / 100:.2f}"}
+        for i in range(count)
+    ])
+    del dicts
+    records, record_bytes, record_time = measure(lambda: [
+        Transaction(739274 + i % 365, ''.join(merchants[i % 500]), i % 9000)
+        for i in range(count)
+    ])
+
+    print(f"dicts:        {dict_bytes / 1024 / 1024:6.1f} MiB per {count:,} ({dict_time * 1000:.0f} ms)")
+    print(f"Transaction:  {record_bytes / 1024 / 1024:6.1f} MiB per {count:,} ({record_time * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = 'poll_profile.json'
+
+# Until real activity is observed, assume charges happen during the day
+DEFAULT_PROFILE = [1 if 8 <= hour < 22 else 0.2 for hour in range(24)]
+
+
+class AccountPoller:
+    """Polling state for one account"""
+
+    def __init__(self, name, poll, profile=None):
+        self.name = name
+        self.poll = poll  # callable returning the number of new transactions
+        self.profile = list(profile or DEFAULT_PROFILE)
+        self.empty_streak = 0
+        self.interval = None
+        self.next_run = time.time()
+        self.last_run = None
+        self.last_duration = None
+        self.last_result = None
+        self.last_error = None
+        self.polls = 0
+
+    def status(self):
+        return {
+            'name': self.name,
+            'nextRun': datetime.fromtimestamp(self.next_run).isoformat(),
+            'lastRun': datetime.fromtimestamp(self.last_run).isoformat() if self.last_run else None,
+            'lastDuration': self.last_duration,
+            'lastResult': self.last_result,
+            'lastError': self.last_error,
+            'emptyStreak': self.empty_streak,
+            'interval': round(self.interval) if self.interval is not None else None,
+            'polls': self.polls,
+            'hourlyProfile': [round(weight, 2) for weight in self.profile],
+        }
+
+
+class PollScheduler:
+    """Adaptive background polling, one account at a time.
+
+    The interval for each account is chosen from its hour-of-day activity
+    profile (busy hours poll near `min_interval`, quiet hours near
+    `max_interval`), doubled for each consecutive empty poll once
+    `backoff_after` polls in a row have found nothing new, capped at
+    `max_interval`, and jittered by +/- `jitter`.
+    Polls run sequentially on a single thread, so one always finishes before
+    the next starts.
+    """
+
+    def __init__(self, min_interval=900, max_interval=4 * 3600, backoff_after=3,
+                 jitter=0.1, profile_file=PROFILE_FILE):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_after = backoff_after
+        self.jitter = jitter
+        self.profile_file = profile_file
+        self.accounts = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.profiles = {}
+        if os.path.exists(profile_file):
+            with open(profile_file, 'r', encoding='utf-8') as f:
+                self.profiles = json.load(f)
+
+    def add_account(self, name, poll):
+        with self.lock:
+            self.accounts[name] = AccountPoller(name, poll, self.profiles.get(name))
+        self.wakeup.set()
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='poll-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def status(self):
+        with self.lock:
+            return {
+                'running': bool(self.thread and self.thread.is_alive()),
+                'minInterval': self.min_interval,
+                'maxInterval': self.max_interval,
+                'accounts': [account.status() for account in self.accounts.values()],
+            }
+
+    def _interval(self, account, now):
+        profile = account.profile
+        busiest = max(profile) or 1
+        activity = profile[datetime.fromtimestamp(now).hour] / busiest
+        interval = self.max_interval - (self.max_interval - self.min_interval) * activity
+        extra_empty = account.empty_streak - self.backoff_after + 1
+        if extra_empty > 0:
+            interval *= 2 ** min(extra_empty, 10)
+        interval = min(interval, self.max_interval)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _learn(self, account, found, now):
+        """Fold a poll result into the account's hour-of-day profile"""
+        if found:
+            hour = datetime.fromtimestamp(now).hour
+            account.profile = [weight * 0.98 for weight in account.profile]
+            account.profile[hour] += found
+            self.profiles[account.name] = account.profile
+            tmp = self.profile_file + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.profiles, f)
+            os.replace(tmp, self.profile_file)
+
+    def _run_once(self, account):
+        started = time.time()
+        logger.info(f"Scheduler: polling {account.name}")
+        try:
+            found = account.poll() or 0
+            account.last_error = None
+        except Exception as e:
+            logger.error(f"Scheduler: poll of {account.name} failed: {e}")
+            account.last_error = str(e)
+            found = 0
+        finished = time.time()
+        with self.lock:
+            account.polls += 1
+            account.last_run = started
+            account.last_duration = round(finished - started, 1)
+            account.last_result = found
+            account.empty_streak = 0 if found else account.empty_streak + 1
+            self._learn(account, found, started)
+            account.interval = self._interval(account, finished)
+            account.next_run = finished + account.interval
+        logger.info(
+            f"Scheduler: {account.name} found {found} new, next poll in {account.interval:.0f}s"
+        )
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            with self.lock:
+                due = min(self.accounts.values(), key=lambda a: a.next_run, default=None)
+            if due is None:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            delay = due.next_run - time.time()
+            if delay > 0:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+            self._run_once(due)
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from file_lock import file_lock
+
+STATE_FILE = 'scrape_state.json'
+RECENT_RUNS = 100
+# Longest an unchanged outcome waits in memory before it is written
+FLUSH_INTERVAL = 300
+
+
+def fingerprint(text):
+    """Cheap content hash of a scraped region's text"""
+    return hashlib.blake2b((text or '').encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ScrapeState:
+    """Content hashes of the last persisted scrape, plus changed/unchanged stats.
+
+    check() compares a region's text against the hash from the last run that
+    was actually saved; commit() stores the new hash once the caller has
+    persisted the data, so a failed save is retried on the next run.
+
+    The server and browser workers share the file, so every write takes a
+    file lock, re-reads the file and applies only this instance's pending
+    changes to it. An unchanged run is the common case and only bumps the
+    stats, so it is held in memory and written with the next change, commit,
+    flush() or after `flush_interval` seconds.
+    """
+
+    def __init__(self, filename=STATE_FILE, flush_interval=FLUSH_INTERVAL):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.state = {'hashes': {}, 'counts': {}, 'recent': []}
+        self.mtime = None
+        self.pending = {'hashes': {}, 'counts': {}, 'recent': []}
+        self.pending_since = None
+        self._reload()
+
+    def _reload(self):
+        """Pick up state written by another process"""
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self.mtime:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                self.state = dict({'hashes': {}, 'counts': {}, 'recent': []}, **json.load(f))
+            self.mtime = mtime
+
+    def _flush(self):
+        """Merge pending changes into the file as it is now and write it"""
+        with file_lock(self.filename + '.lock'):
+            self._reload()
+            self.state['hashes'].update(self.pending['hashes'])
+            for region, delta in self.pending['counts'].items():
+                counts = self.state['counts'].setdefault(region, {'changed': 0, 'unchanged': 0})
+                for outcome, n in delta.items():
+                    counts[outcome] = counts.get(outcome, 0) + n
+            self.state['recent'] = sorted(
+                self.state['recent'] + self.pending['recent'], key=lambda run: run['at']
+            )[-RECENT_RUNS:]
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f)
+            os.replace(tmp, self.filename)
+            self.mtime = os.stat(self.filename).st_mtime_ns
+        self.pending = {'hashes': {}, 'counts': {}, 'recent': []}
+        self.pending_since = None
+
+    def check(self, region, text):
+        """Return (changed, digest) for a region and record the outcome"""
+        digest = fingerprint(text)
+        now = time.time()
+        with self.lock:
+            self._reload()
+            committed = self.pending['hashes'].get(region, self.state['hashes'].get(region))
+            changed = committed != digest
+            counts = self.pending['counts'].setdefault(region, {'changed': 0, 'unchanged': 0})
+            counts['changed' if changed else 'unchanged'] += 1
+            self.pending['recent'].append({'region': region, 'changed': changed, 'at': now})
+            self.pending_since = self.pending_since or now
+            if changed or now - self.pending_since >= self.flush_interval:
+                self._flush()
+        return changed, digest
+
+    def commit(self, region, digest):
+        with self.lock:
+            self._reload()
+            if self.state['hashes'].get(region) == digest and not self.pending['recent']:
+                return
+            self.pending['hashes'][region] = digest
+            self._flush()
+
+    def flush(self):
+        """Write outcomes still held in memory (call before dropping the instance)"""
+        with self.lock:
+            if self.pending_since is not None:
+                self._flush()
+
+    def stats(self):
+        with self.lock:
+            self._reload()
+            counts = {region: dict(c) for region, c in self.state['counts'].items()}
+            for region, delta in self.pending['counts'].items():
+                merged = counts.setdefault(region, {'changed': 0, 'unchanged': 0})
+                for outcome, n in delta.items():
+                    merged[outcome] = merged.get(outcome, 0) + n
+            recent = sorted(self.state['recent'] + self.pending['recent'], key=lambda run: run['at'])
+            return {'counts': counts, 'recent': recent[-RECENT_RUNS:]}
@@ -0,0 +1,39 @@
+import json
+import zlib
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+FLUSH_EVERY = 64  # records per gzip flush once the first record is out
+
+
+def wants_ndjson(request):
+    """True when the client asked for a streamed NDJSON listing"""
+    if request.args.get('stream') in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def wants_gzip(request):
+    """True when Accept-Encoding allows gzip with a non-zero quality"""
+    return request.accept_encodings.quality('gzip') > 0
+
+
+def ndjson_lines(records):
+    """Serialize records one line at a time as they are produced"""
+    for record in records:
+        yield json.dumps(record.to_dict()) + '\n'
+
+
+def gzip_stream(lines, flush_every=FLUSH_EVERY):
+    """Gzip a stream of text chunks without buffering the whole body.
+
+    The first line is flushed on its own so time-to-first-byte does not depend
+    on result size; after that output is flushed every `flush_every` lines.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip framing
+    for count, line in enumerate(lines):
+        chunk = compressor.compress(line.encode('utf-8'))
+        if count % flush_every == 0:
+            chunk += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
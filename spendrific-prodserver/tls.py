@@ -0,0 +1,117 @@
+import os
+import ssl
+import time
+import logging
+import threading
+from datetime import datetime
+
+from cheroot.ssl.builtin import BuiltinSSLAdapter
+
+logger = logging.getLogger(__name__)
+
+# TLS 1.2 suites for clients without 1.3: forward secret and AEAD only, ECDSA
+# first. set_ciphers() does not touch the TLS 1.3 suites, which are all AEAD.
+TLS12_CIPHERS = ':'.join((
+    'ECDHE-ECDSA-AES128-GCM-SHA256',
+    'ECDHE-ECDSA-CHACHA20-POLY1305',
+    'ECDHE-ECDSA-AES256-GCM-SHA384',
+    'ECDHE-RSA-AES128-GCM-SHA256',
+    'ECDHE-RSA-CHACHA20-POLY1305',
+    'ECDHE-RSA-AES256-GCM-SHA384',
+))
+
+
+def build_context(certfile, keyfile, tickets=2):
+    """Server context for TLS 1.2 and 1.3 with session-ticket resumption.
+
+    A TLS 1.3 full handshake takes one round trip, and a resumed one skips
+    the certificate and its signature. `tickets` is how many TLS 1.3 tickets
+    a client gets per full handshake; each ticket resumes one connection.
+    TLS 1.2 clients resume through stateless tickets as well.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.maximum_version = ssl.TLSVersion.TLSv1_3
+    context.set_ciphers(TLS12_CIPHERS)
+    context.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_NO_RENEGOTIATION
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = tickets
+    context.verify_mode = ssl.CERT_NONE
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def _not_after(certfile):
+    from cryptography import x509
+    with open(certfile, 'rb') as f:
+        cert = x509.load_pem_x509_certificate(f.read())
+    return cert.not_valid_after_utc.isoformat()
+
+
+class ReloadingSSLAdapter(BuiltinSSLAdapter):
+    """cheroot TLS adapter that picks up a rotated certificate and key.
+
+    On an incoming connection, at most once every `interval` seconds, the
+    cert and key mtimes are checked and a changed pair is loaded into a new
+    context; open connections keep the old one. A pair that does not load
+    (say the key was replaced but the cert not yet) is logged and retried,
+    and the current context stays in use. Tickets issued under the old
+    context cannot be decrypted by the new one, so each client makes one
+    full handshake after a rotation.
+    """
+
+    def __init__(self, certfile, keyfile, interval=5, tickets=2):
+        super().__init__(certfile, keyfile)
+        self.interval = interval
+        self.tickets = tickets
+        self.lock = threading.Lock()
+        self.reloads = 0
+        self.handshakes = {'full': 0, 'resumed': 0}
+        self._load(self._stamp())
+
+    def _stamp(self):
+        return tuple(os.stat(path).st_mtime_ns for path in (self.certificate, self.private_key))
+
+    def _load(self, stamp):
+        context = build_context(self.certificate, self.private_key, self.tickets)
+        self.expires = _not_after(self.certificate)
+        self.context = context
+        self.stamp = stamp
+        self.checked = time.monotonic()
+        self.loaded_at = datetime.now().isoformat()
+
+    def maybe_reload(self):
+        """Load the cert and key again if either file changed; True if reloaded"""
+        if time.monotonic() - self.checked < self.interval:
+            return False
+        with self.lock:
+            if time.monotonic() - self.checked < self.interval:
+                return False
+            self.checked = time.monotonic()
+            try:
+                stamp = self._stamp()
+                if stamp == self.stamp:
+                    return False
+                self._load(stamp)
+            except (OSError, ssl.SSLError, ValueError) as e:
+                logger.error(f"TLS: keeping the current certificate, the new one did not load: {e}")
+                return False
+            self.reloads += 1
+        logger.info(f"TLS: reloaded {self.certificate} (expires {self.expires})")
+        return True
+
+    def wrap(self, sock):
+        self.maybe_reload()
+        s, environ = super().wrap(sock)
+        with self.lock:
+            self.handshakes['resumed' if s.session_reused else 'full'] += 1
+        return s, environ
+
+    def status(self):
+        return {
+            'protocols': [self.context.minimum_version.name, self.context.maximum_version.name],
+            'loadedAt': self.loaded_at,
+            'expires': self.expires,
+            'reloads': self.reloads,
+            'handshakes': dict(self.handshakes),
+        }
@@ -0,0 +1,108 @@
+"""Handshake latency benchmark: full vs resumed TLS handshakes.
+
+    python tls_bench.py [PORT] [COUNT] [--tls1.2] [--rsa]
+
+With a PORT it connects to a running server on localhost and requests
+/health. Without one it starts a throwaway server on a free port with the
+same TLS settings as app.py and a fresh certificate (ECDSA, or RSA with
+--rsa). --tls1.2 caps the client at TLS 1.2 for comparison.
+"""
+import sys
+import time
+import socket
+import ssl
+import tempfile
+import threading
+import statistics
+
+from tls import build_context
+from generate_cert import generate_self_signed_cert
+
+HOST = 'localhost'
+REQUEST = b'GET /health HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok'
+
+
+def start_local_server(key_type):
+    cert_dir = tempfile.mkdtemp(prefix='tls_bench_')
+    certfile, keyfile = generate_self_signed_cert(cert_dir, key_type)
+    context = build_context(certfile, keyfile)
+    listener = socket.create_server((HOST, 0))
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            try:
+                with context.wrap_socket(conn, server_side=True) as tls:
+                    data = b''
+                    while b'\r\n\r\n' not in data:
+                        chunk = tls.recv(4096)
+                        if not chunk:
+                            break
+                        data += chunk
+                    tls.sendall(RESPONSE)
+            except (ssl.SSLError, OSError):
+                conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def handshake(port, context, session=None):
+    """One connection; returns (handshake seconds, reused, session, version)"""
+    sock = socket.create_connection((HOST, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    started = time.perf_counter()
+    tls = context.wrap_socket(sock, server_hostname=HOST, session=session)
+    elapsed = time.perf_counter() - started
+    version = f"{tls.version()} {tls.cipher()[0]}"
+    # Reading the response also collects the TLS 1.3 tickets sent after the handshake
+    tls.sendall(REQUEST)
+    while tls.recv(4096):
+        pass
+    result = (elapsed, tls.session_reused, tls.session, version)
+    tls.close()
+    return result
+
+
+def summarize(label, samples):
+    ms = sorted(s * 1000 for s in samples)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    print(f"{label:8} median {statistics.median(ms):7.3f} ms   mean {statistics.mean(ms):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    port = int(args[0]) if args else None
+    count = int(args[1]) if len(args) > 1 else 200
+    if port is None:
+        port = start_local_server('rsa' if '--rsa' in sys.argv else 'ec')
+        print(f"Started local TLS server on port {port}")
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    if '--tls1.2' in sys.argv:
+        context.maximum_version = ssl.TLSVersion.TLSv1_2
+
+    full, resumed = [], []
+    _, _, session, version = handshake(port, context)  # warm up
+    for _ in range(count):
+        elapsed, _, session, _ = handshake(port, context)
+        full.append(elapsed)
+    misses = 0
+    for _ in range(count):
+        elapsed, reused, new_session, _ = handshake(port, context, session)
+        (resumed if reused else full).append(elapsed)
+        misses += not reused
+        session = new_session
+
+    print(f"{version}, {count} connections each")
+    summarize('full', full)
+    if resumed:
+        summarize('resumed', resumed)
+    print(f"resumption: {count - misses}/{count} attempts reused the session")
+
+
+if __name__ == '__main__':
+    main()
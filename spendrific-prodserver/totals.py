@@ -0,0 +1,291 @@
+import os
+import json
+import bisect
+import threading
+from datetime import datetime
+
+from normalize import format_cents, format_date, parse_date
+from records import Transaction, PAID, UNPAID, PENDING, POSTED
+
+HISTORY_FILE = 'spend_history.jsonl'
+GROUPS = ('day', 'week', 'merchant', 'status')
+
+
+def _to_ordinal(date_str):
+    day = parse_date(date_str)
+    if day is None:
+        raise ValueError(f"Invalid date format: {date_str}")
+    return day
+
+
+class SpendTotals:
+    """Spend aggregates by day, week, merchant and payment status.
+
+    Every observed transaction is appended to a JSON-lines history file and
+    folded into running totals as it arrives, so queries never rescan the
+    history. Totals without a date range are dictionary lookups. For ranged
+    merchant and status queries each group keeps cumulative totals by day,
+    so a group's total over a range is two bisects and a subtraction; day
+    and week queries bisect the sorted list of days and read each day's
+    total, since they return one row per day or week anyway.
+    With a MerchantIndex, merchant totals are kept per canonical merchant id.
+    With a Reconciler, posted charges settle the pending records they match.
+    """
+
+    def __init__(self, filename=HISTORY_FILE, merchants=None, reconciler=None):
+        self.filename = filename
+        self.merchants = merchants
+        self.reconciler = reconciler
+        self.lock = threading.Lock()
+        self.records = {}       # key -> Transaction
+        self.day_keys = {}      # day ordinal -> [key, ...]
+        self.days = []          # sorted day ordinals with at least one record
+        self.totals = {group: {} for group in GROUPS}
+        # group -> key -> ([day, ...], [cents up to day], [count up to day])
+        self.prefix = {'merchant': {}, 'status': {}}
+        self.subscribers = []   # callables(key, record) notified of every change
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    self._apply(entry['key'], Transaction.from_record(entry))
+        if self.merchants:
+            self.merchants.flush()
+
+    def _bump(self, bucket, key, cents, count):
+        total = bucket.setdefault(key, [0, 0])
+        total[0] += cents
+        total[1] += count
+        if total[1] == 0:
+            del bucket[key]
+
+    def merchant_of(self, name):
+        """Canonical merchant id for a name, or the name itself without an index"""
+        return self.merchants.canonical(name) if self.merchants else name
+
+    def _bump_prefix(self, group, key, day, cents, count):
+        """Add to a key's cumulative totals from day on. New records are
+        usually the latest day, so this is normally an append."""
+        days, cum_cents, cum_counts = self.prefix[group].setdefault(key, ([], [], []))
+        i = bisect.bisect_left(days, day)
+        if i == len(days) or days[i] != day:
+            days.insert(i, day)
+            cum_cents.insert(i, cum_cents[i - 1] if i else 0)
+            cum_counts.insert(i, cum_counts[i - 1] if i else 0)
+        for j in range(i, len(days)):
+            cum_cents[j] += cents
+            cum_counts[j] += count
+        if cum_counts[i] == (cum_counts[i - 1] if i else 0):
+            # No records left on that day; later totals are unaffected
+            del days[i], cum_cents[i], cum_counts[i]
+            if not days:
+                del self.prefix[group][key]
+
+    def _fold(self, record, sign):
+        day, cents = record.day, sign * record.cents
+        merchant = self.merchant_of(record.name)
+        if day not in self.totals['day']:
+            bisect.insort(self.days, day)
+        self._bump(self.totals['day'], day, cents, sign)
+        self._bump(self.totals['week'], day - datetime.fromordinal(day).weekday(), cents, sign)
+        self._bump(self.totals['merchant'], merchant, cents, sign)
+        self._bump(self.totals['status'], record.status, cents, sign)
+        self._bump_prefix('merchant', merchant, day, cents, sign)
+        self._bump_prefix('status', record.status, day, cents, sign)
+        if day not in self.totals['day']:
+            self.days.pop(bisect.bisect_left(self.days, day))
+
+    def _apply(self, key, record):
+        """Replace whatever is stored under key with record, updating totals"""
+        previous = self.records.get(key)
+        if previous is not None:
+            self._fold(previous, -1)
+            if previous.day != record.day:
+                # A posted charge can carry a later date than its pending row
+                keys = self.day_keys[previous.day]
+                keys.remove(key)
+                if not keys:
+                    del self.day_keys[previous.day]
+                self.day_keys.setdefault(record.day, []).append(key)
+        else:
+            self.day_keys.setdefault(record.day, []).append(key)
+        if self.reconciler:
+            if previous is not None:
+                self.reconciler.remove(key, self.merchant_of(previous.name), previous)
+            self.reconciler.add(key, self.merchant_of(record.name), record)
+        self.records[key] = record
+        self._fold(record, 1)
+        for subscriber in self.subscribers:
+            subscriber(key, record)
+
+    def _persist(self, entries):
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            for key, record in entries:
+                f.write(json.dumps(dict(record.to_record(), key=key)) + '\n')
+        if self.merchants:
+            self.merchants.flush()
+
+    def _keyed(self, transactions):
+        """Yield (key, Transaction) pairs, numbering identical charges on the same day"""
+        seen = {}
+        for t in transactions:
+            record = t if isinstance(t, Transaction) else Transaction.from_dict(t)
+            if record is None:
+                raise ValueError(f"Invalid transaction: {t}")
+            base = f"{record.date}|{record.name}|{record.amount}"
+            seen[base] = seen.get(base, 0) + 1
+            key = base if seen[base] == 1 else f"{base}#{seen[base]}"
+            yield key, record
+
+    def ingest(self, transactions):
+        """Fold newly scraped transactions into the totals, skipping known ones.
+
+        A posted row for a known pending record marks it posted. With a
+        Reconciler, a posted row that matches a pending record with another
+        amount or date replaces that record under its key, keeping its
+        payment status, and later scrapes of that row resolve to the same
+        key. Returns the number of new transactions.
+        """
+        with self.lock:
+            added, changed, matches = [], [], []
+            batch = list(self._keyed(transactions))
+            if self.reconciler:
+                batch = [(self.reconciler.aliases.get(key, key), record) for key, record in batch]
+            scraped = {key for key, _ in batch}
+            for scraped_key, record in batch:
+                key = scraped_key
+                existing = self.records.get(key)
+                matched = False
+                if existing is None and self.reconciler:
+                    match = self.reconciler.match(self.merchant_of(record.name), record, self.records, scraped)
+                    if match is not None:
+                        self.reconciler.aliases[key] = match
+                        key, existing, matched = match, self.records[match], True
+                        scraped.add(match)
+                if existing is None:
+                    self._apply(key, record)
+                    added.append((key, record))
+                elif existing.state == PENDING and (matched or record.state == POSTED):
+                    updated = Transaction(record.day, record.name, record.cents, existing.status, record.state)
+                    self._apply(key, updated)
+                    changed.append((key, updated))
+                    matches.append((scraped_key, key, existing, updated))
+            self._persist(added + changed)
+        if matches and self.reconciler:
+            self.reconciler.settle(matches)
+        return len(added)
+
+    def mark_paid(self, transactions):
+        """Move paid transactions to the 'paid' bucket, picking up amount edits.
+
+        A transaction whose amount was adjusted before payment (e.g. a tip) is
+        matched to the unpaid record with the same date and merchant.
+        """
+        with self.lock:
+            changed = []
+            for key, record in self._keyed(transactions):
+                if key not in self.records:
+                    for candidate in self.day_keys.get(record.day, []):
+                        existing = self.records[candidate]
+                        if existing.name == record.name and existing.status == UNPAID:
+                            key = candidate
+                            break
+                existing = self.records.get(key)
+                if existing is not None and existing.state == POSTED:
+                    # The posted amount and date are the bank's; only the status changes
+                    record = existing
+                record = Transaction(record.day, record.name, record.cents, PAID, record.state)
+                if existing != record:
+                    self._apply(key, record)
+                    changed.append((key, record))
+            self._persist(changed)
+            return len(changed)
+
+    def transactions_on(self, date_str):
+        """Return the records observed for a single day"""
+        day = _to_ordinal(date_str)
+        with self.lock:
+            return [self.records[key] for key in self.day_keys.get(day, [])]
+
+    def iter_transactions(self, start=None, end=None):
+        """Return a generator over recorded transactions in date order.
+
+        Dates are validated and the list of matching days is copied up front;
+        each day's records are then read under the lock as the caller consumes
+        the generator, so memory stays bounded by the busiest single day.
+        """
+        return self._iter_days(self._days_between(start, end))
+
+    def iter_keyed(self, start=None, end=None):
+        """Like iter_transactions, but yields (key, Transaction) pairs"""
+        return self._iter_days(self._days_between(start, end), keyed=True)
+
+    def _days_between(self, start, end):
+        start = _to_ordinal(start) if start else None
+        end = _to_ordinal(end) if end else None
+        with self.lock:
+            lo = bisect.bisect_left(self.days, start) if start is not None else 0
+            hi = bisect.bisect_right(self.days, end) if end is not None else len(self.days)
+            return self.days[lo:hi]
+
+    def _iter_days(self, days, keyed=False):
+        for day in days:
+            with self.lock:
+                records = [
+                    (key, self.records[key]) if keyed else self.records[key]
+                    for key in self.day_keys.get(day, [])
+                ]
+            yield from records
+
+    def query(self, group_by='day', start=None, end=None):
+        """Return [{'key', 'amount', 'cents', 'count'}, ...] for a grouping and date range"""
+        if group_by not in GROUPS:
+            raise ValueError(f"group_by must be one of: {', '.join(GROUPS)}")
+        start = _to_ordinal(start) if start else None
+        end = _to_ordinal(end) if end else None
+
+        with self.lock:
+            if start is None and end is None:
+                groups = {key: list(total) for key, total in self.totals[group_by].items()}
+            elif group_by in ('merchant', 'status'):
+                groups = {}
+                for key, (days, cum_cents, cum_counts) in self.prefix[group_by].items():
+                    lo = bisect.bisect_left(days, start) if start is not None else 0
+                    hi = bisect.bisect_right(days, end) if end is not None else len(days)
+                    if hi > lo:
+                        groups[key] = [
+                            cum_cents[hi - 1] - (cum_cents[lo - 1] if lo else 0),
+                            cum_counts[hi - 1] - (cum_counts[lo - 1] if lo else 0),
+                        ]
+            else:
+                lo = bisect.bisect_left(self.days, start) if start is not None else 0
+                hi = bisect.bisect_right(self.days, end) if end is not None else len(self.days)
+                groups = {}
+                for day in self.days[lo:hi]:
+                    cents, count = self.totals['day'][day]
+                    if group_by == 'week':
+                        day -= datetime.fromordinal(day).weekday()
+                    self._bump(groups, day, cents, count)
+
+        if group_by in ('day', 'week'):
+            ordered = sorted(groups.items())
+            label = format_date
+        else:
+            ordered = sorted(groups.items(), key=lambda item: -item[1][0])
+            label = lambda key: key
+        if group_by == 'merchant' and self.merchants:
+            return [
+                {'key': self.merchants.name(key), 'merchantId': key,
+                 'amount': format_cents(cents), 'cents': cents, 'count': count}
+                for key, (cents, count) in ordered
+            ]
+        return [
+            {'key': label(key), 'amount': format_cents(cents), 'cents': cents, 'count': count}
+            for key, (cents, count) in ordered
+        ]
@@ -0,0 +1,223 @@
+import time
+import threading
+
+from records import from_dicts
+
+# Installed in the activity page. Re-reads the pending rows whenever the DOM
+# changes (debounced) and queues a snapshot only when the rows differ from the
+# last one, so Python just drains a small array instead of re-scraping.
+OBSERVER_JS = """
+const MAX_ROWS = 50;
+const cell = (id) => document.querySelector(`#${id} .mds-activity-table__row-value--text`);
+const read = () => {
+    const rows = [];
+    for (let i = 0; i < MAX_ROWS; i++) {
+        const date = cell(`PENDING-dataTableId-row-header-row${i}-columnundefined`);
+        const name = cell(`PENDING-dataTableId-value-row${i}-column1`);
+        const amount = cell(`PENDING-dataTableId-value-row${i}-column2`);
+        if (!date || !name || !amount) break;
+        rows.push({date: date.innerText, name: name.innerText.split('\\n')[0].trim(), amount: amount.innerText});
+    }
+    return rows;
+};
+if (!document.getElementById('PENDING-dataTableId-mds-diy-data-table')) return null;
+if (window.__spendrificObserver) window.__spendrificObserver.disconnect();
+window.__spendrificChanges = [];
+let last = JSON.stringify(read());
+let pending = null;
+window.__spendrificObserver = new MutationObserver(() => {
+    clearTimeout(pending);
+    pending = setTimeout(() => {
+        const rows = read();
+        const snapshot = JSON.stringify(rows);
+        if (snapshot !== last) {
+            last = snapshot;
+            window.__spendrificChanges.push(rows);
+        }
+    }, 250);
+});
+window.__spendrificObserver.observe(document.body, {childList: true, subtree: true, characterData: true});
+return read();
+"""
+
+DRAIN_JS = """
+if (!window.__spendrificObserver) return null;
+return window.__spendrificChanges.splice(0);
+"""
+
+
+class ChaseWatcher:
+    """Keeps one logged-in Chase activity tab open and reports pending changes.
+
+    A MutationObserver in the page queues a snapshot of the pending table
+    whenever it changes; the watcher thread drains that queue every
+    `poll_interval` seconds, which costs one execute_script call. The page is
+    soft-refreshed every `refresh_interval` seconds so Chase keeps fetching new
+    activity, and the whole browser is relaunched if the session is lost.
+    With a BrowserWatchdog, the session is registered as long-lived, so it
+    is recycled (and relaunched at once) only for its memory, not its age.
+    """
+
+    def __init__(self, on_change, poll_interval=2, refresh_interval=300, retry_delay=60, watchdog=None):
+        self.on_change = on_change
+        self.watchdog = watchdog
+        self.driver_pid = None
+        self.relaunch = threading.Event()
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+        self.retry_delay = retry_delay
+        self.browser = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.refresh_requested = threading.Event()
+        self.refreshed = threading.Condition()
+        self.refresh_gen = 0         # bumped by every refresh_now request
+        self.refresh_outcome = None  # (gen, result or exception) of the last refresh
+        self.last_refresh = 0
+        self.stats = {
+            'started': None,
+            'changes': 0,
+            'refreshes': 0,
+            'launches': 0,
+            'lastChange': None,
+            'lastError': None,
+        }
+        self.transactions = []
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='chase-watcher', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=30):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+        self._close()
+
+    def is_running(self):
+        return bool(self.thread and self.thread.is_alive())
+
+    def refresh_now(self, timeout=60):
+        """Ask the watcher thread for a soft refresh and wait for its outcome.
+
+        Returns {'changed', 'transactions', 'added'} from a refresh that
+        started after this call. Raises TimeoutError if none finished within
+        `timeout` seconds and RuntimeError if the tab is not open or the
+        refresh failed, so the caller can scrape another way.
+        """
+        if self.browser is None:
+            raise RuntimeError("Live Chase tab is not open")
+        with self.refreshed:
+            self.refresh_gen += 1
+            gen = self.refresh_gen
+            self.refresh_requested.set()
+            done = self.refreshed.wait_for(
+                lambda: self.refresh_outcome is not None and self.refresh_outcome[0] >= gen, timeout
+            )
+            outcome = self.refresh_outcome[1] if done else None
+        if not done:
+            raise TimeoutError(f"Live Chase tab did not refresh within {timeout}s")
+        if isinstance(outcome, Exception):
+            raise RuntimeError(f"Live Chase tab refresh failed: {outcome}") from outcome
+        return outcome
+
+    def status(self):
+        return dict(self.stats, running=self.is_running(), transactions=len(self.transactions))
+
+    def _launch(self):
+        self._close()
+        print("Watcher: launching Chase browser...")
+        from chase import Browser  # selenium is only loaded once the watcher runs
+        self.browser = Browser()
+        if self.watchdog:
+            self.driver_pid = self.watchdog.register(
+                self.browser.driver.service.process.pid, self.relaunch.set, long_lived=True
+            )
+        self.browser.open()
+        self._install()
+
+    def _close(self):
+        if self.driver_pid is not None:
+            self.watchdog.unregister(self.driver_pid)
+            self.driver_pid = None
+        if self.browser:
+            try:
+                self.browser.close()
+            except Exception as e:
+                print(f"Watcher: error closing browser: {e}")
+            self.browser = None
+
+    def _install(self):
+        rows = self.browser.driver.execute_script(OBSERVER_JS)
+        if rows is None:
+            raise RuntimeError("Pending transactions table not found")
+        self.last_refresh = time.monotonic()
+        return self._publish(rows)
+
+    def _soft_refresh(self):
+        print("Watcher: soft refresh of activity page")
+        # Raises if the session expired and the activity table never loads
+        self.browser.navigate_to_transactions()
+        changed, added = self._install()
+        self.stats['refreshes'] += 1
+        return {'changed': changed, 'transactions': list(self.transactions), 'added': added}
+
+    def _publish(self, rows):
+        """Report rows that differ from the last ones; returns (changed, added)"""
+        transactions = from_dicts(rows, on_invalid=lambda t: print(f"Watcher: could not parse {t}"))
+        if transactions == self.transactions:
+            return False, 0
+        self.transactions = transactions
+        self.stats['changes'] += 1
+        self.stats['lastChange'] = time.time()
+        self.browser.save_to_csv(transactions)
+        added = self.on_change(transactions)
+        self.browser.commit_activity()
+        return True, added
+
+    def _poll(self):
+        due = time.monotonic() - self.last_refresh >= self.refresh_interval
+        if due or self.refresh_requested.is_set():
+            # Requests made from here on need another refresh
+            with self.refreshed:
+                self.refresh_requested.clear()
+                gen = self.refresh_gen
+            outcome = RuntimeError("Refresh was interrupted")
+            try:
+                outcome = self._soft_refresh()
+            except Exception as e:
+                outcome = e
+                raise
+            finally:
+                with self.refreshed:
+                    self.refresh_outcome = (gen, outcome)
+                    self.refreshed.notify_all()
+            return
+        changes = self.browser.driver.execute_script(DRAIN_JS)
+        if changes is None:
+            # Page navigated or re-rendered without our observer
+            self._install()
+        elif changes:
+            self._publish(changes[-1])
+
+    def _run(self):
+        self.stats['started'] = time.time()
+        while not self.stop_event.is_set():
+            try:
+                if self.browser is None:
+                    self._launch()
+                    self.stats['launches'] += 1
+                self._poll()
+                self.stop_event.wait(self.poll_interval)
+            except Exception as e:
+                print(f"Watcher error: {e}")
+                self.stats['lastError'] = str(e)
+                self._close()
+                # A watchdog recycle is not a Chase problem; relaunch at once
+                if not self.relaunch.is_set():
+                    self.stop_event.wait(self.retry_delay)
+                self.relaunch.clear()
+        self._close()